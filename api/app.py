@@ -17,18 +17,18 @@ import datetime
 import mimetypes
 import os
 import base64
-import tempfile
 from pathlib import Path
 from typing import List, Literal
 import hmac, hashlib, time
-from fastapi import Depends, HTTPException, Security, FastAPI, File, UploadFile, Form, Request, BackgroundTasks
+from fastapi import Depends, HTTPException, Security, FastAPI, File, UploadFile, Form, Request, BackgroundTasks, Header
+from fastapi import WebSocket, WebSocketDisconnect
 from fastapi.security import APIKeyHeader
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from pydantic import BaseModel, Field
 from starlette.concurrency import run_in_threadpool
 from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.responses import RedirectResponse
+from starlette.responses import RedirectResponse, StreamingResponse, JSONResponse
 from core.config import Config
 import uuid, os
 from pathlib import Path
@@ -37,19 +37,41 @@ from celery.result import AsyncResult
 from pydantic import BaseModel
 from celery_app import celery
 # import tasks
-from tasks import process_pdf_task, process_images_task
+from tasks import process_pdf_task, process_images_task, dispatch_next_batch_item
 from fastapi import Form
 import logging, traceback, sys
-from services.storage.spaces import SpacesClient
-from services.reporting.engine import (
-     process_invoice_file,
-     process_image_files,
-     EnergyTypeError,
-     EnergyTypeMismatchError,
- )
+from services.execution.engine_pool import engine_pool, EngineBusyError
+from api.delivery import deliver_reports, ranged_pdf_response, BINARY_RESPONSES, REPORT_FULL_FILENAME, REPORT_ANON_FILENAME
+from api.job_results import job_result_cache, snapshot_from_result, JobSnapshot
+from services.cache.result_cache import result_cache, make_key as result_cache_key
+from services.cache.llm_cache import llm_cache
+from api.ingest import read_upload, spool_upload, expand_zip, RequestSizeLimitMiddleware, ZIP_MIMES, PDF_MIMES
+from services.batches.store import batch_store
+from api.events import iter_progress, sse_stream, SSE_HEADERS
+from core import progress, metrics
+from core.admission import admission, request_cost
+from api import warmup
+from api.idempotency import idempotency_store, fingerprint as request_fingerprint
+from starlette.responses import Response
 
 logger = logging.getLogger("pioui.spaces")
-_spaces = SpacesClient()
+
+def _spaces():
+    # boto3 client built on first backup (or by the warm-up), one per worker process
+    from services.storage.spaces import get_spaces_client
+    return get_spaces_client()
+
+def _engine():
+    # the engine (LLM SDKs, ReportLab, pdfplumber) is loaded by the warm-up thread or the first request
+    from services.reporting import engine
+    return engine
+
+# resolved at call time, on the engine pool threads (never imports on the event loop)
+def _analyze_invoice_file(*args, **kwargs):
+    return _engine().analyze_invoice_file(*args, **kwargs)
+
+def _analyze_image_files(*args, **kwargs):
+    return _engine().analyze_image_files(*args, **kwargs)
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s %(levelname)s %(name)s %(message)s",
@@ -115,9 +137,6 @@ class HTTPSRedirectMiddleware(BaseHTTPMiddleware):
         
         return response
 
-# Use  existing app limit as a per-file guard (bytes)
-MAX_IMAGE_BYTES = Config.MAX_CONTENT_LENGTH
-
 api_key_header = APIKeyHeader(name="X-API-Key", auto_error=False)
 
 # ————————————————————————————————————————————————————————————————
@@ -126,35 +145,15 @@ api_key_header = APIKeyHeader(name="X-API-Key", auto_error=False)
 
 class JobEnqueueResponse(BaseModel):
     task_id: str
-
-class JobStatusResponse(BaseModel):
-    task_id: str
-    status: str
-    result: Optional[ProcessResponse] = None  # reuse  existing response schema
-
-def _save_upload_for_worker(upload: UploadFile, *, allowed_suffix: set[str], max_bytes: int, dest_dir: str) -> str:
-    name = upload.filename or ""
-    suffix = Path(name).suffix.lower()
-    if suffix not in allowed_suffix:
-        raise HTTPException(status_code=400, detail=f"Unsupported extension: {suffix or 'unknown'}")
-
-    os.makedirs(dest_dir, exist_ok=True)
-    file_id = f"{uuid.uuid4().hex}{suffix}"
-    out_path = os.path.join(dest_dir, file_id)
-
-    total = 0
-    with open(out_path, "wb") as w:
-        while True:
-            chunk = upload.file.read(1024 * 1024)
-            if not chunk:
-                break
-            total += len(chunk)
-            if total > max_bytes:
-                w.close()
-                os.remove(out_path)
-                raise HTTPException(status_code=413, detail=f"File too large (> {max_bytes} bytes)")
-            w.write(chunk)
-    return out_path
+    replayed: bool = False  # True: identical earlier enqueue (Idempotency-Key / same content), no new job
+
+def _engine_busy(e: EngineBusyError):
+    # fast refusal: the caller retries later instead of timing out in our queue
+    raise HTTPException(
+        status_code=503,
+        detail="Service saturé, réessayez plus tard.",
+        headers={"Retry-After": str(e.retry_after)},
+    )
 
 
 def _unauth(msg="Non autorisé"):
@@ -167,9 +166,24 @@ async def require_api_key(x_api_key: str = Security(api_key_header)):
         raise HTTPException(status_code=500, detail="Configuration d'authentification du serveur incorrecte")
     if not x_api_key:
         _unauth()
-    ok = any(hmac.compare_digest(x_api_key, k) for k in Config.API_KEY)
-    if not ok:
+    if not _api_key_ok(x_api_key):
         _unauth()
+    return x_api_key
+
+def _api_key_ok(key: Optional[str]) -> bool:
+    return bool(key) and any(hmac.compare_digest(key, k) for k in Config.API_KEY)
+
+async def _admit(api_key: str, cost: float, pool: Optional[str] = "inflight"):
+    # per-key rate / inflight limits: fast 429 instead of queueing into a timeout
+    decision = await run_in_threadpool(admission.acquire, api_key, cost, pool)
+    if not decision.allowed:
+        raise HTTPException(
+            status_code=429,
+            detail="Limite de débit atteinte, réessayez plus tard." if decision.reason == "rate"
+            else "Trop de traitements en cours pour cette clé, réessayez plus tard.",
+            headers={"Retry-After": str(decision.retry_after)},
+        )
+    return decision
 app = FastAPI(
     title="Pioui Invoice API",
     version="2.0.0",
@@ -182,6 +196,17 @@ app.add_middleware(
     force_https=os.getenv("FORCE_HTTPS", "false").lower() == "true"
 )
 
+# Per-route body caps: Content-Length refused before multipart parsing, streamed bytes counted
+app.add_middleware(
+    RequestSizeLimitMiddleware,
+    max_bytes=Config.MAX_REQUEST_BYTES,  # image endpoints: up to 8 files
+    overrides={
+        "/v1/invoices/pdf": Config.MAX_PDF_REQUEST_BYTES,
+        "/v1/jobs/pdf": Config.MAX_PDF_REQUEST_BYTES,
+        "/v1/batches": Config.BATCH_MAX_REQUEST_BYTES,
+    },
+)
+
 # Trusted host middleware for additional security
 app.add_middleware(
     TrustedHostMiddleware,
@@ -201,16 +226,34 @@ app.add_middleware(
 # API Models
 # ————————————————————————————————————————————————————————————————
 EnergyMode = Literal["auto", "electricite", "gaz", "dual"]
+ReportVariants = Literal["full", "anon", "both"]
 
 class ProcessResponse(BaseModel):
-    """The API response, containing both reports as Base64 encoded strings."""
-    non_anonymous_report_base64: str = Field(..., description="Base64 encoded non-anonymous PDF report.")
-    anonymous_report_base64: str = Field(..., description="Base64 encoded anonymous PDF report.")
+    """The API response, containing the requested reports as Base64 encoded strings."""
+    non_anonymous_report_base64: Optional[str] = Field(None, description="Base64 encoded non-anonymous PDF report (null if variants=anon).")
+    anonymous_report_base64: Optional[str] = Field(None, description="Base64 encoded anonymous PDF report (null if variants=full).")
     highlights: list[str] = Field(default_factory=list, description="3–4 short marketing highlights.")
     # Optional pass-through identifiers (useful for DB correlation)
     user_id: Optional[int] = Field(None, description="Optional user identifier passed in the request and echoed back.")
     invoice_id: Optional[int] = Field(None, description="Optional invoice identifier passed in the request and echoed back.")
     external_ref: Optional[str] = Field(None, description="Optional external reference string passed in the request and echoed back.")
+
+class JobResult(ProcessResponse):
+    """Job result metadata; the Base64 reports are only filled with include_reports=true."""
+    non_anonymous_size: Optional[int] = None
+    anonymous_size: Optional[int] = None
+    non_anonymous_sha256: Optional[str] = None
+    anonymous_sha256: Optional[str] = None
+    source_kind: Optional[str] = None
+    batch_id: Optional[str] = None
+    batch_index: Optional[int] = None
+
+class JobStatusResponse(BaseModel):
+    task_id: str
+    status: str
+    result: Optional[JobResult] = None
+    reports: Optional[dict[str, str]] = Field(None, description="Download URL per rendered variant (raw PDF).")
+
 # ————————————————————————————————————————————————————————————————
 # Endpoints
 # ————————————————————————————————————————————————————————————————
@@ -219,23 +262,51 @@ async def health(_auth = Depends(require_api_key),):
     """A simple endpoint to confirm the API is running."""
     return {"status": "ok"}
 
+def _spaces_probe():
+    c = _spaces()
+    masked = (Config.DO_SPACES_KEY or "")[:4] + "…" if Config.DO_SPACES_KEY else "NONE"
+    logger.info("spaces_config", extra={
+        "bucket": Config.DO_SPACES_BUCKET,
+        "endpoint": Config.DO_SPACES_ENDPOINT,
+        "region": Config.DO_SPACES_REGION,
+        "key_prefix": masked,
+    })
+    # Fast sanity check (will throw if key is invalid)
+    c._s3.list_buckets()
+    logger.info("spaces_probe_ok")
+
+def _warm_llm_clients():
+    e = _engine()
+    e.get_llm_client()
+    if Config.MISTRAL_API_KEY:
+        e.get_mistral_client()
+        return "openai, mistral"
+    return "openai"
+
+def _redis_ping():
+    from core.redis_client import get_redis
+    get_redis().ping()
+
+_warmup = warmup.Warmup()
+_warmup.add("engine", lambda: _engine().__name__)
+_warmup.add("fonts", lambda: "poppins" if _engine().ensure_fonts() else "helvetica")
+_warmup.add("llm_clients", _warm_llm_clients)
+if engine_pool.render_workers > 0:
+    _warmup.add("render_pool", lambda: f"{engine_pool.warm()} process(es)")
+_warmup.add("redis", _redis_ping, required=False)
+_warmup.add("spaces", _spaces_probe, required=False)
+
 @app.on_event("startup")
-def _spaces_startup_probe():
-    try:
-        from services.storage.spaces import SpacesClient
-        c = SpacesClient()
-        masked = (Config.DO_SPACES_KEY or "")[:4] + "…" if Config.DO_SPACES_KEY else "NONE"
-        logger.info("spaces_config", extra={
-            "bucket": Config.DO_SPACES_BUCKET,
-            "endpoint": Config.DO_SPACES_ENDPOINT,
-            "region": Config.DO_SPACES_REGION,
-            "key_prefix": masked,
-        })
-        # Fast sanity check (will throw if key is invalid)
-        c._s3.list_buckets()
-        logger.info("spaces_probe_ok")
-    except Exception as e:
-        logger.exception("spaces_probe_failed", exc_info=e)
+def _start_warmup():
+    # background by default: the process answers /healthz right away, /readyz once warm
+    warmup.start(_warmup)
+
+def _timed_backup(task, *, energy_type: Optional[str], source_kind: str) -> None:
+    # Spaces upload duration, labelled like the engine stages
+    with metrics.labels(energy_type=energy_type, source_kind=source_kind):
+        t0 = time.perf_counter()
+        ok = task()
+        metrics.observe_stage("spaces_backup", time.perf_counter() - t0, ok=bool(ok))
 
 def _enqueue_spaces_backup_pdf(
     *,
@@ -245,8 +316,8 @@ def _enqueue_spaces_backup_pdf(
     external_ref: str | None,
     energy_type: str,
     original_pdf_bytes: bytes,
-    non_anon_bytes: bytes,
-    anon_bytes: bytes,
+    non_anon_bytes: bytes | None,
+    anon_bytes: bytes | None,
     highlights: list | dict | None,
     customer_name: str | None = None,
 ):
@@ -254,7 +325,7 @@ def _enqueue_spaces_backup_pdf(
     run_id = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
 
     # 2. Use the run_id to build the versioned prefix
-    prefix = _spaces.build_prefix(
+    prefix = _spaces().build_prefix(
         user_id=user_id,
         invoice_id=invoice_id,
         external_ref=external_ref,
@@ -273,7 +344,7 @@ def _enqueue_spaces_backup_pdf(
     def _task():
         try:
             # 3. Generate the new, simplified filenames
-            filenames = _spaces.make_filenames(
+            filenames = _spaces().make_filenames(
                 energy_type=energy_type,
             )
 
@@ -288,7 +359,7 @@ def _enqueue_spaces_backup_pdf(
                 "customer_name": customer_name,
                 "highlights": highlights or [],
             }
-            keys = _spaces.upload_files_flat(
+            keys = _spaces().upload_files_flat(
                 prefix=prefix,
                 filenames=filenames,
                 original_pdf_bytes=original_pdf_bytes,
@@ -298,15 +369,18 @@ def _enqueue_spaces_backup_pdf(
                 metadata=meta,
             )
             logger.info("spaces_upload_ok", extra={"prefix": prefix, "keys": keys})
+            return True
         except Exception as e:
             logger.exception("spaces_upload_error", exc_info=e)
+            return False
 
-    background_tasks.add_task(_task)
+    background_tasks.add_task(_timed_backup, _task, energy_type=energy_type, source_kind="pdf")
 
 
 @app.post(
     "/v1/invoices/pdf",
     response_model=ProcessResponse,
+    responses=BINARY_RESPONSES,
     summary="Process a single PDF invoice",
 )
 async def create_from_pdf(
@@ -315,32 +389,43 @@ async def create_from_pdf(
     type: str = Form(..., description="energy type enum used by engine"),
     confidence_min: float = Form(0.6),
     strict: bool = Form(False),
+    variants: ReportVariants = Form("both", description="Report(s) to render: full | anon | both"),
     # pass-through identifiers from the PHP backend:
     user_id: int | None = Form(None),
     invoice_id: int | None = Form(None),
     external_ref: str | None = Form(None),
     customer_name: str | None = Form(None),
-    _auth = Depends(require_api_key),
+    accept: str | None = Header(None),
+    api_key: str = Depends(require_api_key),
 ):
-    # 1) Read the original PDF fully (bounded by your existing size limit)
-    original_pdf_bytes = await file.read()
-    if not original_pdf_bytes:
-        raise HTTPException(status_code=400, detail="Empty file")
-
-    # 2) Write to a NamedTemporaryFile if your engine requires a path
-    with tempfile.NamedTemporaryFile(delete=True, suffix=".pdf") as tmp:
-        await file.seek(0)
-        tmp.write(original_pdf_bytes)
-        tmp.flush()
-
-        # 3) Run your engine using the temp path
-        from services.reporting.engine import process_invoice_file
+    # 1) Streamed read: size cap, magic-byte check, page-count preflight, sha256 on the fly
+    upload = await read_upload(file, "pdf")
+    original_pdf_bytes = upload.data
+
+    # 2) Identical submission already processed? (same bytes + same parameters)
+    cache_key = result_cache_key(
+        kind="pdf", digests=[upload.sha256], energy_mode=type,
+        confidence_min=confidence_min, strict=strict, variants=variants,
+    )
+    result = await run_in_threadpool(result_cache.get, cache_key)
+
+    # 3) Run the engine on the in-memory bytes (off the event loop, bounded pool, no temp file)
+    if result is None:
+        decision = await _admit(api_key, request_cost("pdf", pages=upload.pages or 1))
         try:
-            non_anon_bytes, anon_bytes, highlights = process_invoice_file(
-                tmp.name, energy_mode=type, confidence_min=confidence_min, strict=strict
-            )
+            with metrics.labels(energy_type=type, source_kind="pdf"):
+                result = await engine_pool.run(
+                    _analyze_invoice_file, original_pdf_bytes, energy_mode=type, confidence_min=confidence_min,
+                    strict=strict, variants=variants,
+                )
+        except EngineBusyError as e:
+            _engine_busy(e)
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Engine error: {e}")
+        finally:
+            await run_in_threadpool(admission.release, decision.key, decision.lease)
+        background_tasks.add_task(result_cache.put, cache_key, result)
+    non_anon_bytes, anon_bytes, highlights = result["non_anon"], result["anon"], result["highlights"]
 
     # 4) Fire-and-forget Spaces backups
     _enqueue_spaces_backup_pdf(
@@ -356,15 +441,16 @@ async def create_from_pdf(
         customer_name=customer_name if 'customer_name' in locals() else None,
     )
 
-    # 5) Return the same response as before (Base64 + highlights)
-    return {
-        "non_anonymous_report_base64": base64.b64encode(non_anon_bytes).decode("utf-8"),
-        "anonymous_report_base64": base64.b64encode(anon_bytes).decode("utf-8"),
-        "highlights": highlights,
-        "user_id": user_id,
-        "invoice_id": invoice_id,
-        "external_ref": external_ref,
-    }
+    # 5) Base64 JSON by default, raw PDFs if negotiated via Accept
+    return deliver_reports(
+        accept,
+        non_anon=non_anon_bytes,
+        anon=anon_bytes,
+        highlights=highlights,
+        user_id=user_id,
+        invoice_id=invoice_id,
+        external_ref=external_ref,
+    )
 
 def _enqueue_spaces_backup_images(
     *,
@@ -374,13 +460,13 @@ def _enqueue_spaces_backup_images(
     external_ref: str | None,
     energy_type: str,                 # NEW
     original_images: list[tuple[str, bytes]],  # (filename, bytes)
-    non_anon_bytes: bytes,
-    anon_bytes: bytes,
+    non_anon_bytes: bytes | None,
+    anon_bytes: bytes | None,
     highlights: list | dict | None,
     customer_name: str | None = None,
 ):
     run_id = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
-    prefix = _spaces.build_prefix(
+    prefix = _spaces().build_prefix(
         user_id=user_id, invoice_id=invoice_id, external_ref=external_ref, customer_name=customer_name, run_id=run_id
     )
     meta = {
@@ -394,7 +480,7 @@ def _enqueue_spaces_backup_images(
     def _task():
         try:
             # ✅ CORRECTED a single-argument call to match the new function definition.
-            filenames = _spaces.make_filenames(
+            filenames = _spaces().make_filenames(
                 energy_type=energy_type,
             )
 
@@ -412,7 +498,7 @@ def _enqueue_spaces_backup_images(
             }
             # Note: I removed the original_pdf_bytes=None, as your function
             # in spaces.py doesn't expect it if it's not present.
-            keys = _spaces.upload_files_flat(
+            keys = _spaces().upload_files_flat(
                 prefix=prefix,
                 filenames=filenames,
                 original_pdf_bytes=None,  # Explicitly pass None for clarity
@@ -423,7 +509,7 @@ def _enqueue_spaces_backup_images(
             )
 
             # This part uploads the original image files alongside the reports
-            _spaces.upload_image_pages_flat(
+            _spaces().upload_image_pages_flat(
                 prefix=prefix,
                 user_id=user_id,
                 invoice_id=invoice_id,
@@ -434,16 +520,19 @@ def _enqueue_spaces_backup_images(
             )
 
             logger.info("spaces_upload_ok", extra={"prefix": prefix, "keys": keys})
+            return True
         except Exception as e:
             logger.exception("spaces_upload_error", exc_info=e)
+            return False
 
-    background_tasks.add_task(_task)
+    background_tasks.add_task(_timed_backup, _task, energy_type=energy_type, source_kind="images")
 
 
 
 @app.post(
     "/v1/invoices/images",
     response_model=ProcessResponse,
+    responses=BINARY_RESPONSES,
     summary="Process one or more invoice images"
 )
 async def create_from_images(
@@ -452,44 +541,49 @@ async def create_from_images(
     type: str = Form(...),
     confidence_min: float = Form(0.6),
     strict: bool = Form(False),
+    variants: ReportVariants = Form("both", description="Report(s) to render: full | anon | both"),
     user_id: int | None = Form(None),
     invoice_id: int | None = Form(None),
     external_ref: str | None = Form(None),
     customer_name: str | None = Form(None),
-    _auth = Depends(require_api_key),
+    accept: str | None = Header(None),
+    api_key: str = Depends(require_api_key),
 ):
     if not files:
         raise HTTPException(status_code=400, detail="No files uploaded")
+    if len(files) > 8:
+        raise HTTPException(status_code=400, detail="At most 8 images are allowed per invoice.")
 
-    # 1) Keep original bytes in memory (respect your existing size caps upstream)
-    original_images: list[tuple[str, bytes]] = []
-    tmp_paths: list[str] = []
+    # 1) Streamed reads (size cap + magic-byte check per file), kept in memory
+    uploads = [await read_upload(f, "image") for f in files]
+    original_images: list[tuple[str, bytes]] = [(u.filename, u.data) for u in uploads]
 
     try:
-        for f in files:
-            data = await f.read()
-            if not data:
-                raise HTTPException(status_code=400, detail=f"Empty file: {f.filename}")
-            original_images.append((f.filename or "image", data))
-
-            # If engine needs file paths, write each to temp
-            tmp = tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(f.filename or '')[-1] or ".jpg")
-            tmp.write(data)
-            tmp.flush()
-            tmp.close()
-            tmp_paths.append(tmp.name)
-
-        from services.reporting.engine import process_image_files
-        non_anon_bytes, anon_bytes, highlights = process_image_files(
-            tmp_paths, energy_mode=type, confidence_min=confidence_min, strict=strict
+        cache_key = result_cache_key(
+            kind="images", digests=[u.sha256 for u in uploads], energy_mode=type,
+            confidence_min=confidence_min, strict=strict, variants=variants,
         )
+        result = await run_in_threadpool(result_cache.get, cache_key)
+
+        if result is None:
+            decision = await _admit(api_key, request_cost("images", images=len(uploads)))
+            try:
+                # The engine takes the raw bytes directly (MIME sniffed from magic bytes)
+                with metrics.labels(energy_type=type, source_kind="images"):
+                    result = await engine_pool.run(
+                        _analyze_image_files, [data for _, data in original_images], energy_mode=type, confidence_min=confidence_min, strict=strict,
+                        variants=variants,
+                    )
+            finally:
+                await run_in_threadpool(admission.release, decision.key, decision.lease)
+            background_tasks.add_task(result_cache.put, cache_key, result)
+    except HTTPException:
+        raise
+    except EngineBusyError as e:
+        _engine_busy(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Engine error: {e}")
-    finally:
-        # Cleanup any temp files
-        for p in tmp_paths:
-            try: os.remove(p)
-            except Exception: pass
+    non_anon_bytes, anon_bytes, highlights = result["non_anon"], result["anon"], result["highlights"]
 
     # 2) Fire-and-forget Spaces backups
     _enqueue_spaces_backup_images(
@@ -504,16 +598,46 @@ async def create_from_images(
         highlights=highlights,
     )
 
-    # 3) Return the same response as before (Base64 + highlights)
-    import base64
-    return {
-        "non_anonymous_report_base64": base64.b64encode(non_anon_bytes).decode("utf-8"),
-        "anonymous_report_base64": base64.b64encode(anon_bytes).decode("utf-8"),
-        "highlights": highlights,
-        "user_id": user_id,
-        "invoice_id": invoice_id,
-        "external_ref": external_ref,
-    }
+    # 3) Base64 JSON by default, raw PDFs if negotiated via Accept
+    return deliver_reports(
+        accept,
+        non_anon=non_anon_bytes,
+        anon=anon_bytes,
+        highlights=highlights,
+        user_id=user_id,
+        invoice_id=invoice_id,
+        external_ref=external_ref,
+    )
+
+def _discard(paths: List[str]) -> None:
+    for p in paths:
+        try: os.remove(p)
+        except Exception: pass
+
+async def _claim_job(api_key: str, idempotency_key: Optional[str], fp: str, cost: float, paths: List[str]):
+    """
+    Idempotency claim, then admission. Returns (claim, admission decision); the decision is
+    None when the request replays an earlier enqueue (the spooled files are then dropped).
+    """
+    claim = await run_in_threadpool(idempotency_store.claim, api_key, idempotency_key, fp, uuid.uuid4().hex)
+    if claim.conflict or claim.replayed:
+        _discard(paths)
+        if claim.conflict:
+            raise HTTPException(status_code=422, detail="Idempotency-Key déjà utilisée pour une autre requête.")
+        return claim, None
+    try:
+        # a "queued" lease (own, higher cap) held until the task finishes (released by the worker)
+        return claim, await _admit(api_key, cost, pool="queued")
+    except HTTPException:
+        _discard(paths)
+        await run_in_threadpool(idempotency_store.release, claim)
+        raise
+
+def _abandon_job(claim, decision, paths: List[str]) -> None:
+    # enqueue failed (broker down): later retries must not be pointed at a task that never ran
+    idempotency_store.release(claim)
+    admission.release(decision.key, decision.lease, decision.pool)
+    _discard(paths)
 
 @app.post("/v1/jobs/pdf", response_model=JobEnqueueResponse, summary="Enqueue PDF invoice processing")
 async def enqueue_pdf_job(
@@ -521,33 +645,45 @@ async def enqueue_pdf_job(
     type_: EnergyMode = Form("auto", alias="type"),
     confidence_min: float = Form(0.5, ge=0.0, le=1.0),
     strict: bool = Form(True),
+    variants: ReportVariants = Form("both"),
     webhook_url: Optional[str] = Form(None),
     # NEW: pass-through context
     user_id: Optional[int] = Form(None),
     invoice_id: Optional[int] = Form(None),
     external_ref: Optional[str] = Form(None),
-    _auth=Depends(require_api_key),
+    idempotency_key: Optional[str] = Header(None, max_length=255),
+    api_key: str = Depends(require_api_key),
 ):
-    # persist to shared folder for the worker
-    if not file.filename or not file.filename.lower().endswith(".pdf"):
-        raise HTTPException(status_code=400, detail="Invalid file type. Only PDF is allowed.")
-
-    os.makedirs(Config.UPLOAD_FOLDER, exist_ok=True)
-    path = _save_upload_for_worker(
-        file, allowed_suffix={".pdf"}, max_bytes=Config.MAX_CONTENT_LENGTH, dest_dir=Config.UPLOAD_FOLDER
-    )  # MAX_CONTENT_LENGTH comes from  config. :contentReference[oaicite:8]{index=8}
-
-    task = process_pdf_task.apply_async(kwargs={
-        "file_path": path,
-        "type": type_,
-        "confidence_min": confidence_min,
-        "strict": strict,
-        "webhook_url": webhook_url,
-        "user_id": user_id,
-        "invoice_id": invoice_id,
-        "external_ref": external_ref,
-        "source_kind": "pdf",
-    })
+    # persist to shared folder for the worker (streamed, same checks as the sync endpoints)
+    spooled = await spool_upload(file, "pdf", dest_dir=Config.UPLOAD_FOLDER)
+    path = spooled.path
+    fp = request_fingerprint("pdf", [spooled.sha256], type=type_, confidence_min=confidence_min, strict=strict,
+                             variants=variants, webhook_url=webhook_url, user_id=user_id,
+                             invoice_id=invoice_id, external_ref=external_ref)
+    claim, decision = await _claim_job(api_key, idempotency_key, fp,
+                                       request_cost("pdf", pages=spooled.pages or 1), [path])
+    if decision is None:
+        return {"task_id": claim.task_id, "replayed": True}
+
+    task_id = claim.task_id
+    await run_in_threadpool(progress.publish, task_id, "queued")
+    try:
+        task = process_pdf_task.apply_async(task_id=task_id, kwargs={
+            "file_path": path,
+            "type": type_,
+            "confidence_min": confidence_min,
+            "strict": strict,
+            "variants": variants,
+            "webhook_url": webhook_url,
+            "user_id": user_id,
+            "invoice_id": invoice_id,
+            "external_ref": external_ref,
+            "source_kind": "pdf",
+            "admission": {"key": decision.key, "lease": decision.lease, "pool": decision.pool},
+        })
+    except Exception:
+        await run_in_threadpool(_abandon_job, claim, decision, [path])
+        raise
     return {"task_id": task.id}
 
 @app.post("/v1/jobs/images", response_model=JobEnqueueResponse, summary="Enqueue image invoice processing")
@@ -556,58 +692,279 @@ async def enqueue_images_job(
     type_: EnergyMode = Form("auto", alias="type"),
     confidence_min: float = Form(0.5, ge=0.0, le=1.0),
     strict: bool = Form(True),
+    variants: ReportVariants = Form("both"),
     webhook_url: Optional[str] = Form(None),
     user_id: Optional[int] = Form(None),
     invoice_id: Optional[int] = Form(None),
     external_ref: Optional[str] = Form(None),
-    _auth=Depends(require_api_key),
+    idempotency_key: Optional[str] = Header(None, max_length=255),
+    api_key: str = Depends(require_api_key),
 ):
     if not files:
         raise HTTPException(status_code=400, detail="At least one image is required.")
     if len(files) > 8:
         raise HTTPException(status_code=400, detail="At most 8 images are allowed per invoice.")
 
-    os.makedirs(Config.UPLOAD_FOLDER, exist_ok=True)
-    paths = []
+    spooled = []
     try:
         for f in files:
-            paths.append(_save_upload_for_worker(
-                f, allowed_suffix={'.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.tif'},
-                max_bytes=Config.MAX_CONTENT_LENGTH, dest_dir=Config.UPLOAD_FOLDER
-            ))
+            spooled.append(await spool_upload(f, "image", dest_dir=Config.UPLOAD_FOLDER))
     except Exception:
         # clean partial
-        for p in paths:
-            try: os.remove(p)
-            except Exception: pass
+        _discard([u.path for u in spooled])
+        raise
+    paths = [u.path for u in spooled]
+    fp = request_fingerprint("images", [u.sha256 for u in spooled], type=type_, confidence_min=confidence_min,
+                             strict=strict, variants=variants, webhook_url=webhook_url, user_id=user_id,
+                             invoice_id=invoice_id, external_ref=external_ref)
+    claim, decision = await _claim_job(api_key, idempotency_key, fp,
+                                       request_cost("images", images=len(paths)), paths)
+    if decision is None:
+        return {"task_id": claim.task_id, "replayed": True}
+
+    task_id = claim.task_id
+    await run_in_threadpool(progress.publish, task_id, "queued")
+    try:
+        task = process_images_task.apply_async(task_id=task_id, kwargs={
+            "file_paths": paths,  # <— list of image paths
+            "type": type_,
+            "confidence_min": confidence_min,
+            "strict": strict,
+            "variants": variants,
+            "webhook_url": webhook_url,
+            "user_id": user_id,
+            "invoice_id": invoice_id,
+            "external_ref": external_ref,
+            "source_kind": "images",
+            "admission": {"key": decision.key, "lease": decision.lease, "pool": decision.pool},
+        })
+    except Exception:
+        await run_in_threadpool(_abandon_job, claim, decision, paths)
         raise
-
-    task = process_images_task.apply_async(kwargs={
-        "file_paths": paths,  # <— list of image paths
-        "type": type_,
-        "confidence_min": confidence_min,
-        "strict": strict,
-        "webhook_url": webhook_url,
-        "user_id": user_id,
-        "invoice_id": invoice_id,
-        "external_ref": external_ref,
-        "source_kind": "images",
-    })
     return {"task_id": task.id}
 
 
 
-@app.get("/v1/jobs/{task_id}", response_model=JobStatusResponse)
-def job_status(task_id: str, _auth = Depends(require_api_key)):
+class BatchItemRef(BaseModel):
+    index: int
+    name: str
+    kind: str
+    task_id: str
+
+class BatchCreateResponse(BaseModel):
+    batch_id: str
+    total: int
+    items: List[BatchItemRef]
+
+class BatchSummaryResponse(BaseModel):
+    batch_id: str
+    status: str
+    total: int
+    queued: int
+    running: int
+    succeeded: int
+    failed: int
+    progress: float
+    max_parallel: int
+    external_ref: Optional[str] = None
+    created_at: float
+    completed_at: Optional[float] = None
+
+@app.post("/v1/batches", response_model=BatchCreateResponse, summary="Enqueue a batch of invoices (PDFs, images or ZIP)")
+async def create_batch(
+    files: List[UploadFile] = File(..., description="PDFs, images and/or ZIP archives"),
+    type_: EnergyMode = Form("auto", alias="type"),
+    confidence_min: float = Form(0.5, ge=0.0, le=1.0),
+    strict: bool = Form(True),
+    variants: ReportVariants = Form("both"),
+    max_parallel: Optional[int] = Form(None, ge=1, description="Items of this batch processed at once (capped by BATCH_MAX_PARALLEL)"),
+    webhook_url: Optional[str] = Form(None, description="Called once, when every item is done"),
+    external_ref: Optional[str] = Form(None),
+    api_key: str = Depends(require_api_key),
+):
+    """
+    Every PDF is one item and every loose image is one item; inside a ZIP, the images
+    of a same folder form one image group (one invoice). Items run on the Celery workers,
+    at most `max_parallel` at a time; each item keeps its own task id (usable with /v1/jobs/{task_id}).
+    """
+    items: list[dict] = []
+    spooled: list[str] = []
+    try:
+        for f in files:
+            up = await spool_upload(f, "batch", dest_dir=Config.UPLOAD_FOLDER)
+            if up.mime in ZIP_MIMES:
+                try:
+                    entries = await run_in_threadpool(
+                        expand_zip, up.path, Config.UPLOAD_FOLDER, max_items=Config.BATCH_MAX_ITEMS - len(items)
+                    )
+                finally:
+                    os.remove(up.path)
+                for e in entries:
+                    spooled.extend(e["paths"])
+                items.extend(entries)
+            else:
+                spooled.append(up.path)
+                items.append({"name": up.filename, "kind": "pdf" if up.mime in PDF_MIMES else "images",
+                              "paths": [up.path]})
+            if len(items) > Config.BATCH_MAX_ITEMS:
+                raise HTTPException(status_code=400, detail=f"Too many batch items (> {Config.BATCH_MAX_ITEMS})")
+        if not items:
+            raise HTTPException(status_code=400, detail="No PDF or image found in the upload.")
+        # charged per item like the job endpoints (no lease: the batch window bounds its concurrency)
+        await _admit(api_key, sum(request_cost("pdf") if it["kind"] == "pdf"
+                                  else request_cost("images", images=len(it["paths"])) for it in items), pool=None)
+
+        parallel = min(max_parallel or Config.BATCH_MAX_PARALLEL, Config.BATCH_MAX_PARALLEL)
+        params = {"type": type_, "confidence_min": confidence_min, "strict": strict, "variants": variants}
+        header = await run_in_threadpool(
+            lambda: batch_store.create(items, params=params, max_parallel=parallel,
+                                       webhook_url=webhook_url, external_ref=external_ref)
+        )
+    except Exception:
+        for p in spooled:
+            try: os.remove(p)
+            except Exception: pass
+        raise
+
+    batch_id = header["batch_id"]
+    for _ in range(min(parallel, len(items))):
+        await run_in_threadpool(dispatch_next_batch_item, batch_id)
+    refs = await run_in_threadpool(batch_store.items, batch_id)
+    return {
+        "batch_id": batch_id,
+        "total": len(items),
+        "items": [{k: it[k] for k in ("index", "name", "kind", "task_id")} for it in refs],
+    }
+
+@app.get("/v1/batches/{batch_id}", response_model=BatchSummaryResponse, summary="Batch progress")
+def batch_summary(batch_id: str, _auth=Depends(require_api_key)):
+    summary = batch_store.summary(batch_id)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired batch")
+    return summary
+
+@app.get("/v1/batches/{batch_id}/items", summary="Per-item status and results (metadata only)")
+def batch_items(batch_id: str, offset: int = 0, limit: int = 100, _auth=Depends(require_api_key)):
+    summary = batch_store.summary(batch_id)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired batch")
+    offset, limit = max(0, offset), max(1, min(limit, 500))
+    items = batch_store.items(batch_id, offset=offset, limit=limit)
+    for it in items:
+        it.pop("paths", None)
+    return {"batch_id": batch_id, "total": summary["total"], "offset": offset, "limit": limit, "items": items}
+
+
+def _fetch_job(task_id: str) -> JobSnapshot:
     res = AsyncResult(task_id, app=celery)
     status = res.status  # PENDING / STARTED / RETRY / FAILURE / SUCCESS
-    body = {"task_id": task_id, "status": status}
-    if res.successful():
-        body["result"] = res.result  # <- this is the dict the task returned
-    elif res.failed():
+    return snapshot_from_result(task_id, status, res.result if status == "SUCCESS" else None)
+
+@app.get("/v1/jobs/{task_id}", response_model=JobStatusResponse)
+def job_status(task_id: str, include_reports: bool = False, _auth = Depends(require_api_key)):
+    """
+    State + metadata (highlights, sizes, SHA-256). The PDFs are downloaded from `reports`
+    (GET /v1/jobs/{task_id}/reports/{full|anon}); include_reports=true restores the inline Base64.
+    """
+    snap = job_result_cache.get(task_id, _fetch_job)
+    body = {"task_id": task_id, "status": snap.status}
+    if snap.status == "SUCCESS":
+        body["result"] = snap.raw if include_reports else snap.meta
+        body["reports"] = {v: f"/v1/jobs/{task_id}/reports/{v}" for v in snap.reports}
+    elif snap.status == "FAILURE":
         raise HTTPException(status_code=500, detail="Job failed")
     return body
 
+@app.get(
+    "/v1/jobs/{task_id}/reports/{variant}",
+    summary="Raw PDF report of a finished job (ETag, Range, conditional GET)",
+    responses={200: {"content": {"application/pdf": {}}}, 206: {"description": "Partial content"},
+               304: {"description": "Not modified"}, 416: {"description": "Range not satisfiable"}},
+)
+def job_report(task_id: str, variant: Literal["full", "anon"], request: Request, _auth = Depends(require_api_key)):
+    snap = job_result_cache.get(task_id, _fetch_job)
+    if snap.status == "FAILURE":
+        raise HTTPException(status_code=500, detail="Job failed")
+    if snap.status != "SUCCESS":
+        raise HTTPException(status_code=409, detail=f"Job not finished ({snap.status})")
+    body = snap.reports.get(variant)
+    if body is None:
+        raise HTTPException(status_code=404, detail=f"Report '{variant}' was not rendered for this job")
+    filename = REPORT_FULL_FILENAME if variant == "full" else REPORT_ANON_FILENAME
+    etag = snap.etags.get(variant) or hashlib.sha256(body).hexdigest()
+    return ranged_pdf_response(body, etag=etag, filename=filename, headers=request.headers)
+
+def _progress_from_backend(task_id: str) -> Optional[dict]:
+    # Jobs without progress events (expired, or enqueued before they existed): terminal state only
+    res = AsyncResult(task_id, app=celery)
+    if res.successful():
+        result = res.result if isinstance(res.result, dict) else {}
+        meta = {k: v for k, v in result.items() if not k.endswith("_base64")}
+        return progress.make_event(task_id, "done", **meta)
+    if res.failed():
+        return progress.make_event(task_id, "failed", error="Job failed", will_retry=False)
+    return None
+
+@app.get("/v1/jobs/{task_id}/events", summary="Job progress as Server-Sent Events")
+async def job_events(task_id: str, _auth = Depends(require_api_key)):
+    """
+    `text/event-stream`: one event per stage (queued, extracting, llm, rendering, uploading, done | failed),
+    `: keep-alive` comments while idle. The stream closes after the terminal event.
+    """
+    events = iter_progress(task_id, fallback=lambda: _progress_from_backend(task_id))
+    return StreamingResponse(sse_stream(events), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@app.websocket("/v1/jobs/{task_id}/ws")
+async def job_events_ws(websocket: WebSocket, task_id: str):
+    """Same events as /events, as JSON text frames (`{"stage": "heartbeat"}` while idle). X-API-Key header required."""
+    if not _api_key_ok(websocket.headers.get("x-api-key")):
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    try:
+        async for event in iter_progress(task_id, fallback=lambda: _progress_from_backend(task_id)):
+            await websocket.send_json(event)
+        await websocket.close()
+    except WebSocketDisconnect:
+        pass
+
 @app.get("/healthz")
 def healthz():
     return {"ok": True}
+
+@app.get("/readyz")
+def readyz():
+    """Per-component warm-up state; 503 until the required components are ready."""
+    snap = _warmup.snapshot()
+    return JSONResponse(snap, status_code=200 if snap["ready"] else 503)
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics(authorization: str | None = Header(None)):
+    """Prometheus text format. With METRICS_TOKEN set, requires `Authorization: Bearer <token>`."""
+    if Config.METRICS_TOKEN and not hmac.compare_digest(authorization or "", f"Bearer {Config.METRICS_TOKEN}"):
+        _unauth()
+    body, content_type = metrics.render_latest()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/v1/engine/pool", summary="Sync engine pool occupancy")
+def engine_pool_stats(_auth = Depends(require_api_key)):
+    """Occupancy of the sync execution pools (size gunicorn `-w` against `capacity`/`utilization`)."""
+    return engine_pool.stats()
+
+@app.get("/v1/cache/jobs", summary="Job status cache counters (coalesced backend lookups)")
+def job_cache_stats(_auth = Depends(require_api_key)):
+    return job_result_cache.stats()
+
+@app.get("/v1/cache/results", summary="Result cache counters")
+def result_cache_stats(_auth = Depends(require_api_key)):
+    """Hit/miss counters of the content-addressed result cache (this worker's local tier + redis hits)."""
+    return result_cache.stats()
+
+@app.get("/v1/cache/llm", summary="LLM response cache counters")
+def llm_cache_stats(_auth = Depends(require_api_key)):
+    """Hit/miss counters of the LLM response cache (this worker) and size of the shared SQLite tier."""
+    return llm_cache.stats()
+
+@app.on_event("shutdown")
+def _engine_pool_shutdown():
+    engine_pool.shutdown()
@@ -0,0 +1,223 @@
+# api/delivery.py
+"""
+Report delivery formats for the sync endpoints (/v1/invoices/pdf, /v1/invoices/images).
+
+The default stays the JSON contract with both PDFs Base64-encoded (ProcessResponse).
+Clients that can handle binary bodies pick another format with `Accept`:
+- multipart/mixed  -> raw parts: metadata JSON (highlights + ids), full PDF, anonymous PDF
+- application/zip  -> ZIP stream (stored, PDFs are already compressed) with the same entries
+A report that was not rendered (variants=full|anon) is simply left out of the binary bodies.
+No Base64 encode on our side, no decode on the client, ~25% fewer bytes on the wire.
+Finished jobs serve their PDFs the same way, one variant per request (ETag + Range).
+"""
+from __future__ import annotations
+
+import base64
+import hashlib
+import io
+import json
+import uuid
+import zipfile
+from typing import List, Mapping, Optional, Tuple
+
+from starlette.responses import Response
+
+MULTIPART_MIXED = "multipart/mixed"
+APPLICATION_ZIP = "application/zip"
+
+META_FILENAME = "meta.json"
+REPORT_FULL_FILENAME = "report_full.pdf"
+REPORT_ANON_FILENAME = "report_anon.pdf"
+
+# OpenAPI documentation for the alternative 200 bodies
+BINARY_RESPONSES = {
+    200: {
+        "description": "JSON/Base64 by default; raw PDFs with `Accept: multipart/mixed` or `Accept: application/zip`.",
+        "content": {MULTIPART_MIXED: {}, APPLICATION_ZIP: {}},
+    }
+}
+
+
+def negotiate(accept: Optional[str]) -> str:
+    """Returns 'json' | 'multipart' | 'zip' from an Accept header (highest q wins, JSON on ties/absence)."""
+    if not accept:
+        return "json"
+    best, best_q = "json", 0.0
+    for item in accept.split(","):
+        fields = [f.strip() for f in item.split(";")]
+        media = fields[0].lower()
+        q = 1.0
+        for f in fields[1:]:
+            if f.startswith("q="):
+                try:
+                    q = float(f[2:])
+                except ValueError:
+                    q = 0.0
+        kind = {"application/json": "json", MULTIPART_MIXED: "multipart", APPLICATION_ZIP: "zip"}.get(media)
+        # JSON wins ties whatever the order: binary bodies only when strictly preferred
+        if kind and (q > best_q or (q == best_q and kind == "json")):
+            best, best_q = kind, q
+    return best
+
+
+def _size(b: Optional[bytes]) -> Optional[int]:
+    return len(b) if b is not None else None
+
+
+def _sha256(b: Optional[bytes]) -> Optional[str]:
+    return hashlib.sha256(b).hexdigest() if b is not None else None
+
+
+def _b64(b: Optional[bytes]) -> Optional[str]:
+    return base64.b64encode(b).decode("utf-8") if b is not None else None
+
+
+def report_meta(*, highlights: List[str], non_anon: Optional[bytes], anon: Optional[bytes],
+                user_id: Optional[int], invoice_id: Optional[int], external_ref: Optional[str]) -> dict:
+    """Small JSON part shipped alongside the raw PDFs."""
+    return {
+        "highlights": highlights,
+        "non_anonymous_size": _size(non_anon),
+        "anonymous_size": _size(anon),
+        "non_anonymous_sha256": _sha256(non_anon),
+        "anonymous_sha256": _sha256(anon),
+        "user_id": user_id,
+        "invoice_id": invoice_id,
+        "external_ref": external_ref,
+    }
+
+
+def _parts(meta: dict, non_anon: Optional[bytes], anon: Optional[bytes]) -> List[Tuple[str, str, str, bytes]]:
+    # (part name, filename, content-type, body)
+    meta_bytes = json.dumps(meta, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    parts = [("meta", META_FILENAME, "application/json", meta_bytes)]
+    if non_anon is not None:
+        parts.append(("non_anonymous_report", REPORT_FULL_FILENAME, "application/pdf", non_anon))
+    if anon is not None:
+        parts.append(("anonymous_report", REPORT_ANON_FILENAME, "application/pdf", anon))
+    return parts
+
+
+def encode_multipart(meta: dict, non_anon: Optional[bytes], anon: Optional[bytes]) -> Tuple[bytes, str]:
+    """Returns (body, boundary)."""
+    boundary = uuid.uuid4().hex
+    out = io.BytesIO()
+    for name, filename, ctype, body in _parts(meta, non_anon, anon):
+        out.write(f"--{boundary}\r\n".encode("ascii"))
+        out.write(f"Content-Type: {ctype}\r\n".encode("ascii"))
+        out.write(f'Content-Disposition: attachment; name="{name}"; filename="{filename}"\r\n'.encode("ascii"))
+        out.write(f"Content-Length: {len(body)}\r\n\r\n".encode("ascii"))
+        out.write(body)
+        out.write(b"\r\n")
+    out.write(f"--{boundary}--\r\n".encode("ascii"))
+    return out.getvalue(), boundary
+
+
+def encode_zip(meta: dict, non_anon: Optional[bytes], anon: Optional[bytes]) -> bytes:
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, "w", compression=zipfile.ZIP_STORED) as zf:
+        for _name, filename, _ctype, body in _parts(meta, non_anon, anon):
+            zf.writestr(filename, body)
+    return out.getvalue()
+
+
+def encode_json(*, highlights: List[str], non_anon: Optional[bytes], anon: Optional[bytes],
+                user_id: Optional[int], invoice_id: Optional[int], external_ref: Optional[str]) -> dict:
+    """The historical Base64 contract (ProcessResponse); a report not rendered is null."""
+    return {
+        "non_anonymous_report_base64": _b64(non_anon),
+        "anonymous_report_base64": _b64(anon),
+        "highlights": highlights,
+        "user_id": user_id,
+        "invoice_id": invoice_id,
+        "external_ref": external_ref,
+    }
+
+
+def deliver_reports(accept: Optional[str], *, non_anon: Optional[bytes], anon: Optional[bytes], highlights: List[str],
+                    user_id: Optional[int] = None, invoice_id: Optional[int] = None,
+                    external_ref: Optional[str] = None):
+    """Builds the endpoint return value: a dict (JSON/Base64) or a binary Response."""
+    kind = negotiate(accept)
+    ids = {"user_id": user_id, "invoice_id": invoice_id, "external_ref": external_ref}
+    if kind == "json":
+        return encode_json(highlights=highlights, non_anon=non_anon, anon=anon, **ids)
+
+    meta = report_meta(highlights=highlights, non_anon=non_anon, anon=anon, **ids)
+    if kind == "multipart":
+        body, boundary = encode_multipart(meta, non_anon, anon)
+        return Response(content=body, media_type=f'{MULTIPART_MIXED}; boundary="{boundary}"',
+                        headers={"Vary": "Accept"})
+    body = encode_zip(meta, non_anon, anon)
+    return Response(content=body, media_type=APPLICATION_ZIP,
+                    headers={"Content-Disposition": 'attachment; filename="reports.zip"', "Vary": "Accept"})
+
+
+# ——— Raw report downloads (GET /v1/jobs/{id}/reports/{variant}) ———
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Single byte range from a Range header -> (start, end) inclusive.
+    None = serve the whole body (no/unsupported header, several ranges);
+    raises ValueError when the range cannot be satisfied.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    spec = header[len("bytes="):].strip()
+    start_s, _, end_s = spec.partition("-")
+    try:
+        if start_s == "":
+            length = int(end_s)
+            if length <= 0:
+                raise ValueError(spec)
+            return max(0, size - length), size - 1
+        start = int(start_s)
+        end = int(end_s) if end_s else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        raise ValueError(spec)
+    return start, min(end, size - 1)
+
+
+def _etag_matches(header: Optional[str], etag: str) -> bool:
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return any(t.strip().removeprefix("W/") == etag for t in header.split(","))
+
+
+def ranged_pdf_response(body: bytes, *, etag: str, filename: str, headers: Mapping[str, str]) -> Response:
+    """
+    Raw PDF with ETag (strong, quoted sha256), conditional GET (If-None-Match -> 304)
+    and single byte ranges (Range / If-Range -> 206, unsatisfiable -> 416).
+    """
+    etag = f'"{etag}"'
+    base = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, max-age=3600",
+        "Content-Disposition": f'inline; filename="{filename}"',
+    }
+    if _etag_matches(headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=base)
+
+    size = len(body)
+    range_header = headers.get("range")
+    if_range = headers.get("if-range")
+    if range_header and if_range and if_range.strip() != etag:
+        range_header = None  # representation changed: full body
+    try:
+        rng = parse_range(range_header, size)
+    except ValueError:
+        return Response(status_code=416, headers={**base, "Content-Range": f"bytes */{size}"})
+    if rng is None:
+        return Response(content=body, media_type="application/pdf", headers=base)
+    start, end = rng
+    return Response(
+        content=memoryview(body)[start:end + 1].tobytes(),
+        status_code=206,
+        media_type="application/pdf",
+        headers={**base, "Content-Range": f"bytes {start}-{end}/{size}"},
+    )
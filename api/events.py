@@ -0,0 +1,93 @@
+# api/events.py
+"""
+Job progress streaming for the API: Redis pub/sub (core/progress.py) -> SSE / WebSocket.
+
+One pub/sub connection per open stream. The task's last event is sent first, so a
+client connecting after the job finished gets `done` immediately; the stream ends
+on a terminal event (done, or failed without retry) or after PROGRESS_STREAM_TIMEOUT.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+from typing import AsyncIterator, Callable, Dict, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from core import progress
+from core.config import Config
+
+logger = logging.getLogger("pioui.events")
+
+HEARTBEAT = {"stage": "heartbeat"}
+
+
+def is_terminal(event: Dict) -> bool:
+    stage = event.get("stage")
+    return stage == "done" or (stage == "failed" and not event.get("will_retry"))
+
+
+async def iter_progress(task_id: str, *, fallback: Optional[Callable[[], Optional[Dict]]] = None,
+                        heartbeat: Optional[float] = None, timeout: Optional[float] = None,
+                        ) -> AsyncIterator[Dict]:
+    """
+    Yields progress events for `task_id` (HEARTBEAT when idle for `heartbeat` seconds).
+    `fallback` (blocking, run in a thread) provides an initial event when Redis has none,
+    e.g. from the Celery result backend for jobs enqueued before progress events existed.
+    """
+    import redis.asyncio as aioredis
+
+    heartbeat = heartbeat or Config.PROGRESS_HEARTBEAT
+    timeout = timeout or Config.PROGRESS_STREAM_TIMEOUT
+    client = aioredis.Redis.from_url(Config.REDIS_URL, socket_connect_timeout=Config.REDIS_SOCKET_TIMEOUT)
+    pubsub = client.pubsub()
+    try:
+        # subscribe before reading the last event: nothing published in between is lost
+        await pubsub.subscribe(progress.channel(task_id))
+        last = await run_in_threadpool(progress.last_event, task_id)
+        if last is None and fallback is not None:
+            try:
+                last = await run_in_threadpool(fallback)
+            except Exception as e:
+                logger.warning("progress_fallback_failed: %s: %s", task_id, e)
+        if last is not None:
+            yield last
+            if is_terminal(last):
+                return
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while loop.time() < deadline:
+            msg = await pubsub.get_message(ignore_subscribe_messages=True, timeout=heartbeat)
+            if msg is None:
+                yield HEARTBEAT
+                continue
+            event = json.loads(msg["data"])
+            if event == last:
+                continue
+            yield event
+            if is_terminal(event):
+                return
+    finally:
+        try:
+            await pubsub.unsubscribe()
+            await pubsub.aclose()
+            await client.aclose()
+        except Exception as e:
+            logger.debug("progress_stream_close: %s", e)
+
+
+def sse_format(event: Dict) -> bytes:
+    if event is HEARTBEAT:
+        return b": keep-alive\n\n"
+    data = json.dumps(event, ensure_ascii=False, separators=(",", ":"))
+    return f"event: {event.get('stage', 'message')}\ndata: {data}\n\n".encode("utf-8")
+
+
+async def sse_stream(events: AsyncIterator[Dict]) -> AsyncIterator[bytes]:
+    async for event in events:
+        yield sse_format(event)
+
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "Connection": "keep-alive"}
@@ -0,0 +1,147 @@
+# api/idempotency.py
+"""
+Idempotent job enqueue (`/v1/jobs/*`).
+
+A retried enqueue (network blip on the PHP side) must not run the GPT / Pixtral
+pipeline twice. Each enqueue is mapped, in Redis, to the task id it created:
+- with an `Idempotency-Key` header: `pioui:idem:{key id}:k:{sha256(header)}`,
+- without: `pioui:idem:{key id}:h:{fingerprint}` (content digests + parameters + external_ref).
+The mapping is written with SET NX *before* the task is enqueued, so it is also the
+in-flight lock: concurrent duplicates get the first request's task id back at once.
+A mapping whose job failed for good is replaced (the retry runs again); the same
+header with a different request is a 422, like other idempotency-key APIs. "Failed" is
+read from the Celery result backend (kept as long as the mapping): FAILURE / REVOKED,
+or PENDING once the progress events are gone (job lost, e.g. worker killed), plus the
+last progress event while it is still around.
+Redis down => no deduplication (logged), the job is still enqueued.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Iterable, Optional
+
+from celery.result import AsyncResult
+
+from celery_app import celery
+from core import progress
+from core.admission import key_id
+from core.config import Config
+from core.prefork import after_fork
+from core.redis_client import get_redis
+
+logger = logging.getLogger("pioui.idempotency")
+
+_PREFIX = "pioui:idem:"
+_FAILED_STATES = ("FAILURE", "REVOKED")
+_CLAIM_GRACE = 60  # seconds: a fresh mapping may not have its "queued" event yet
+
+# KEYS[1] mapping; ARGV expected current value, new value (empty = delete), ttl
+_SWAP_LUA = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+  return 0
+end
+if ARGV[2] == '' then
+  redis.call('DEL', KEYS[1])
+else
+  redis.call('SET', KEYS[1], ARGV[2], 'EX', tonumber(ARGV[3]))
+end
+return 1
+"""
+
+
+def fingerprint(kind: str, digests: Iterable[str], **params: Any) -> str:
+    """Request identity: content digests (in order) + every parameter that changes the result."""
+    doc = json.dumps({"kind": kind, "digests": list(digests), **params}, sort_keys=True,
+                     separators=(",", ":"), default=str)
+    return hashlib.sha256(doc.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class Claim:
+    task_id: str
+    replayed: bool = False      # True: task_id belongs to an earlier identical enqueue
+    conflict: bool = False      # same Idempotency-Key, different request
+    key: Optional[str] = None   # Redis key to release if the enqueue is abandoned
+    value: Optional[str] = None
+
+
+class IdempotencyStore:
+    def __init__(self, *, enabled: bool, ttl: int):
+        self.enabled = enabled
+        self.ttl = ttl
+        self._script = None
+
+    @classmethod
+    def from_config(cls) -> "IdempotencyStore":
+        return cls(enabled=Config.IDEMPOTENCY_ENABLED, ttl=Config.IDEMPOTENCY_TTL)
+
+    def _swap(self, redis_key: str, expected: bytes, new_value: str) -> bool:
+        if self._script is None:
+            self._script = get_redis().register_script(_SWAP_LUA)
+        return bool(self._script(keys=[redis_key], args=[expected, new_value, self.ttl]))
+
+    def reset(self) -> None:
+        self._script = None
+
+    @staticmethod
+    def redis_key(api_key: str, idempotency_key: Optional[str], fp: str) -> str:
+        scope = f"{_PREFIX}{key_id(api_key)}"
+        if idempotency_key:
+            return f"{scope}:k:{hashlib.sha256(idempotency_key.encode('utf-8')).hexdigest()}"
+        return f"{scope}:h:{fp}"
+
+    def claim(self, api_key: str, idempotency_key: Optional[str], fp: str, task_id: str) -> Claim:
+        """Maps the request to `task_id`, or returns the task id an identical request already got."""
+        if not self.enabled:
+            return Claim(task_id)
+        redis_key = self.redis_key(api_key, idempotency_key, fp)
+        value = json.dumps({"task_id": task_id, "fingerprint": fp, "created": int(time.time())},
+                           separators=(",", ":"))
+        try:
+            r = get_redis()
+            for _ in range(3):
+                if r.set(redis_key, value, nx=True, ex=self.ttl):
+                    return Claim(task_id, key=redis_key, value=value)
+                current = r.get(redis_key)
+                if current is None:
+                    continue  # expired in between
+                doc = json.loads(current)
+                if doc.get("fingerprint") != fp:
+                    return Claim(doc["task_id"], conflict=True)
+                if not self._failed(doc["task_id"], doc.get("created", 0)):
+                    logger.info("idempotent_replay", extra={"task_id": doc["task_id"]})
+                    return Claim(doc["task_id"], replayed=True)
+                # the earlier job failed for good: this retry runs again
+                if self._swap(redis_key, current, value):
+                    return Claim(task_id, key=redis_key, value=value)
+        except Exception as e:
+            logger.warning("idempotency_unavailable: %s", e)
+        return Claim(task_id)
+
+    def release(self, claim: Claim) -> None:
+        """Drops the mapping of an enqueue that did not happen (e.g. refused by admission control)."""
+        if not (claim.key and claim.value):
+            return
+        try:
+            self._swap(claim.key, claim.value.encode("utf-8"), "")
+        except Exception as e:
+            logger.warning("idempotency_release_failed: %s", e)
+
+    @staticmethod
+    def _failed(task_id: str, created: float) -> bool:
+        state = AsyncResult(task_id, app=celery).state
+        if state in _FAILED_STATES:
+            return True
+        event = progress.last_event(task_id)
+        if event is None:
+            # never started, or its events expired (PROGRESS_TTL) while Celery knows nothing of it
+            return state == "PENDING" and time.time() - created > _CLAIM_GRACE
+        return event.get("stage") == "failed" and not event.get("will_retry")
+
+
+idempotency_store = IdempotencyStore.from_config()
+after_fork(idempotency_store.reset)
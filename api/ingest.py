@@ -0,0 +1,330 @@
+# api/ingest.py
+"""
+Streaming, size-bounded ingestion shared by the four upload endpoints.
+
+Uploads are read in chunks (into memory for the sync endpoints, spooled to
+UPLOAD_FOLDER for the workers): the size cap (MAX_CONTENT_LENGTH) is enforced while
+reading, the type is checked on the magic bytes of the first chunk (the file
+name / client Content-Type are not trusted), the sha256 is computed on the fly,
+and PDFs get a page-count preflight (MAX_PDF_PAGES) before any engine work.
+`RequestSizeLimitMiddleware` caps the whole request per route (MAX_PDF_REQUEST_BYTES
+for the single-PDF endpoints, MAX_REQUEST_BYTES for up to 8 images, BATCH_MAX_REQUEST_BYTES
+for batches): a declared Content-Length above the cap is refused before the multipart
+body is parsed, and the bytes actually received are counted too (chunked uploads).
+Batch uploads (kind "batch") also accept ZIP archives, expanded by `expand_zip`.
+
+The sync path writes no intermediate files of its own, but the multipart parser does:
+Starlette's `UploadFile` is a SpooledTemporaryFile that rolls over to a temp file above
+1 MB, so most real invoices briefly touch the temp directory before `read_upload`.
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import shutil
+import uuid
+import zipfile
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Literal, Optional
+
+from fastapi import HTTPException, UploadFile
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse
+
+from core.config import Config
+from services.reporting.sources import sniff_mime
+
+logger = logging.getLogger("pioui.ingest")
+
+CHUNK_SIZE = 256 * 1024
+
+UploadKind = Literal["pdf", "image", "batch"]
+
+PDF_MIMES = {"application/pdf": ".pdf"}
+IMAGE_MIMES = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/bmp": ".bmp",
+    "image/tiff": ".tiff",
+}
+ZIP_MIMES = {"application/zip": ".zip"}
+BATCH_MIMES = {**PDF_MIMES, **IMAGE_MIMES, **ZIP_MIMES}
+
+
+@dataclass
+class IngestedFile:
+    filename: str
+    mime: str
+    size: int
+    sha256: str
+    data: Optional[bytes] = None   # in-memory ingestion (sync endpoints)
+    path: Optional[str] = None     # spooled ingestion (job endpoints)
+    pages: Optional[int] = None    # PDFs only
+
+
+def _allowed(kind: UploadKind) -> dict:
+    return {"pdf": PDF_MIMES, "image": IMAGE_MIMES, "batch": BATCH_MIMES}[kind]
+
+
+def _max_bytes_for(mime: str) -> int:
+    return Config.BATCH_MAX_REQUEST_BYTES if mime in ZIP_MIMES else Config.MAX_CONTENT_LENGTH
+
+
+def _check_type(kind: UploadKind, head: bytes, filename: str) -> str:
+    mime = sniff_mime(head)
+    if mime not in _allowed(kind):
+        raise HTTPException(
+            status_code=415,
+            detail=f"Unsupported file type for {filename or 'upload'}: expected {kind}, got {mime or 'unknown'}",
+        )
+    return mime
+
+
+def _too_large(max_bytes: int):
+    raise HTTPException(status_code=413, detail=f"File too large (> {max_bytes} bytes)")
+
+
+def _check_pages(pages: int, max_pages: int) -> None:
+    if pages < 1:
+        raise HTTPException(status_code=422, detail="PDF has no pages")
+    if max_pages and pages > max_pages:
+        raise HTTPException(status_code=413, detail=f"Too many pages ({pages} > {max_pages})")
+
+
+def count_pdf_pages(source) -> int:
+    """Page count from the xref/page tree only (no rendering, no text extraction)."""
+    import pypdfium2 as pdfium  # shipped with pdfplumber
+
+    doc = pdfium.PdfDocument(source)
+    try:
+        return len(doc)
+    finally:
+        doc.close()
+
+
+async def _preflight_pdf(source, filename: str, max_pages: int) -> int:
+    try:
+        pages = await run_in_threadpool(count_pdf_pages, source)
+    except Exception as e:
+        raise HTTPException(status_code=422, detail=f"Unreadable PDF {filename or ''}: {e}".strip())
+    _check_pages(pages, max_pages)
+    return pages
+
+
+async def read_upload(upload: UploadFile, kind: UploadKind, *, max_bytes: Optional[int] = None,
+                      max_pages: Optional[int] = None) -> IngestedFile:
+    """Reads an upload into memory in chunks, with type / size / page checks and a streaming sha256."""
+    max_bytes = Config.MAX_CONTENT_LENGTH if max_bytes is None else max_bytes
+    max_pages = Config.MAX_PDF_PAGES if max_pages is None else max_pages
+    filename = upload.filename or kind
+
+    buf = bytearray()
+    digest = hashlib.sha256()
+    mime = None
+    while True:
+        chunk = await upload.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        if mime is None:
+            mime = _check_type(kind, chunk, filename)
+        if len(buf) + len(chunk) > max_bytes:
+            _too_large(max_bytes)
+        digest.update(chunk)
+        buf += chunk
+    if not buf:
+        raise HTTPException(status_code=400, detail=f"Empty file: {filename}")
+
+    data = bytes(buf)
+    del buf
+    pages = await _preflight_pdf(data, filename, max_pages) if kind == "pdf" else None
+    return IngestedFile(filename=filename, mime=mime, size=len(data), sha256=digest.hexdigest(),
+                        data=data, pages=pages)
+
+
+async def spool_upload(upload: UploadFile, kind: UploadKind, *, dest_dir: str, max_bytes: Optional[int] = None,
+                       max_pages: Optional[int] = None) -> IngestedFile:
+    """
+    Same checks as `read_upload`, but streams to `dest_dir` (shared folder read by the Celery worker).
+    Without `max_bytes`, the cap follows the sniffed type (ZIP archives: BATCH_MAX_REQUEST_BYTES).
+    """
+    max_pages = Config.MAX_PDF_PAGES if max_pages is None else max_pages
+    filename = upload.filename or kind
+
+    os.makedirs(dest_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    total = 0
+    mime = None
+    out_path = None
+    w = None
+    try:
+        while True:
+            chunk = await upload.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            if mime is None:
+                mime = _check_type(kind, chunk, filename)
+                if max_bytes is None:
+                    max_bytes = _max_bytes_for(mime)
+                out_path = os.path.join(dest_dir, f"{uuid.uuid4().hex}{_allowed(kind)[mime]}")
+                w = open(out_path, "wb")
+            total += len(chunk)
+            if total > max_bytes:
+                _too_large(max_bytes)
+            digest.update(chunk)
+            await run_in_threadpool(w.write, chunk)
+        if not total:
+            raise HTTPException(status_code=400, detail=f"Empty file: {filename}")
+        w.close()
+        pages = await _preflight_pdf(out_path, filename, max_pages) if mime in PDF_MIMES else None
+    except BaseException:
+        if w is not None:
+            w.close()
+        if out_path is not None:
+            try: os.remove(out_path)
+            except OSError: pass
+        raise
+    return IngestedFile(filename=filename, mime=mime, size=total, sha256=digest.hexdigest(),
+                        path=out_path, pages=pages)
+
+
+def _is_hidden(name: str) -> bool:
+    parts = name.replace("\\", "/").split("/")
+    return any(p.startswith(".") or p == "__MACOSX" for p in parts)
+
+
+def expand_zip(zip_path: str, dest_dir: str, *, max_items: int) -> List[Dict[str, object]]:
+    """
+    Expands a batch ZIP into batch items (blocking: run in a thread).
+    - every PDF (any depth) is one item
+    - images directly under a folder form one image group (max 8); images at the root are one item each
+    Other entries are skipped. Oversized / unreadable entries reject the whole archive.
+    """
+    max_bytes = Config.MAX_CONTENT_LENGTH
+    written: List[str] = []
+    items: List[Dict[str, object]] = []
+    groups: "OrderedDict[str, List[str]]" = OrderedDict()
+    try:
+        with zipfile.ZipFile(zip_path) as zf:
+            infos = sorted((i for i in zf.infolist() if not i.is_dir() and not _is_hidden(i.filename)),
+                           key=lambda i: i.filename)
+            if sum(i.file_size for i in infos) > Config.BATCH_MAX_UNZIPPED_BYTES:
+                raise HTTPException(status_code=413, detail="ZIP content too large once expanded")
+            for info in infos:
+                if info.file_size > max_bytes:
+                    raise HTTPException(status_code=413, detail=f"{info.filename}: file too large (> {max_bytes} bytes)")
+                with zf.open(info) as src:
+                    head = src.read(16)
+                    mime = sniff_mime(head)
+                    if mime not in PDF_MIMES and mime not in IMAGE_MIMES:
+                        logger.info("zip_entry_skipped: %s (%s)", info.filename, mime or "unknown")
+                        continue
+                    out_path = os.path.join(dest_dir, f"{uuid.uuid4().hex}{BATCH_MIMES[mime]}")
+                    written.append(out_path)
+                    with open(out_path, "wb") as w:
+                        w.write(head)
+                        shutil.copyfileobj(src, w, CHUNK_SIZE)
+                if mime in PDF_MIMES:
+                    try:
+                        pages = count_pdf_pages(out_path)
+                    except Exception as e:
+                        raise HTTPException(status_code=422, detail=f"Unreadable PDF {info.filename}: {e}")
+                    _check_pages(pages, Config.MAX_PDF_PAGES)
+                    items.append({"name": info.filename, "kind": "pdf", "paths": [out_path]})
+                else:
+                    folder = os.path.dirname(info.filename)
+                    if folder:
+                        groups.setdefault(folder, []).append(out_path)
+                    else:
+                        items.append({"name": info.filename, "kind": "images", "paths": [out_path]})
+                if len(items) + len(groups) > max_items:
+                    raise HTTPException(status_code=400, detail=f"Too many batch items (> {max_items})")
+        for folder, paths in groups.items():
+            if len(paths) > 8:
+                raise HTTPException(status_code=400, detail=f"{folder}: at most 8 images are allowed per invoice.")
+            items.append({"name": folder, "kind": "images", "paths": paths})
+    except zipfile.BadZipFile as e:
+        _remove_all(written)
+        raise HTTPException(status_code=422, detail=f"Invalid ZIP archive: {e}")
+    except BaseException:
+        _remove_all(written)
+        raise
+    return items
+
+
+def _remove_all(paths: List[str]) -> None:
+    for p in paths:
+        try: os.remove(p)
+        except OSError: pass
+
+
+class _BodyTooLarge(HTTPException):
+    def __init__(self, limit: int):
+        super().__init__(status_code=413, detail=f"Request too large (> {limit} bytes)")
+
+
+class RequestSizeLimitMiddleware:
+    """
+    Caps the request body at `max_bytes`; `overrides` maps a path prefix to its own limit
+    (e.g. /v1/invoices/pdf, /v1/batches). A declared Content-Length above the limit is
+    refused before the body is read; the body stream itself is counted as well, so a
+    chunked upload (no Content-Length) or a lying header stops at the limit instead of
+    being parsed and spooled in full.
+    """
+
+    def __init__(self, app, max_bytes: int, overrides: Optional[Dict[str, int]] = None):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.overrides = overrides or {}
+
+    def _limit(self, path: str) -> int:
+        for prefix, limit in self.overrides.items():
+            if path.startswith(prefix):
+                return limit
+        return self.max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        path = scope.get("path", "")
+        limit = self._limit(path)
+        if not limit:
+            return await self.app(scope, receive, send)
+        length = dict(scope.get("headers") or []).get(b"content-length")
+        if length is not None:
+            try:
+                declared = int(length)
+            except ValueError:
+                return await JSONResponse(status_code=400, content={"detail": "Invalid Content-Length"})(
+                    scope, receive, send)
+            if declared > limit:
+                logger.warning("request_too_large: %s bytes on %s", declared, path)
+                return await JSONResponse(status_code=413, content={"detail": f"Request too large (> {limit} bytes)"})(
+                    scope, receive, send)
+
+        received = 0
+        started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    logger.warning("request_too_large: > %s bytes streamed on %s", limit, path)
+                    raise _BodyTooLarge(limit)  # surfaces as a 413 through the app's HTTPException handler
+            return message
+
+        async def tracked_send(message):
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracked_send)
+        except _BodyTooLarge as e:
+            if started:
+                raise
+            await JSONResponse(status_code=413, content={"detail": e.detail})(scope, receive, send)
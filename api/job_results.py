@@ -0,0 +1,120 @@
+# api/job_results.py
+"""
+Short-lived, in-process view of Celery job results for the polling endpoints.
+
+Without it every `GET /v1/jobs/{id}` builds an AsyncResult, round-trips to the
+Redis result backend and decodes multi-megabyte Base64 again. Here:
+- lookups of the same task are coalesced (single flight): concurrent pollers wait
+  for the one backend read in progress instead of issuing their own,
+- non-terminal states are cached for JOB_STATUS_CACHE_TTL seconds (short: progress
+  must stay fresh), finished jobs for JOB_RESULT_CACHE_TTL,
+- the PDFs are Base64-decoded once per finished job and kept (LRU, bounded by
+  JOB_RESULT_CACHE_MAX_ENTRIES) for the ranged report downloads.
+"""
+from __future__ import annotations
+
+import base64
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional
+
+from core.config import Config
+
+READY_STATES = ("SUCCESS", "FAILURE", "REVOKED")
+
+_REPORT_FIELDS = {
+    "full": ("non_anonymous_report_base64", "non_anonymous_sha256"),
+    "anon": ("anonymous_report_base64", "anonymous_sha256"),
+}
+
+
+@dataclass
+class JobSnapshot:
+    task_id: str
+    status: str
+    meta: Optional[Dict[str, Any]] = None          # task result without the Base64 fields
+    raw: Optional[Dict[str, Any]] = None           # full task result (include_reports=true)
+    reports: Dict[str, bytes] = field(default_factory=dict)
+    etags: Dict[str, str] = field(default_factory=dict)
+    fetched_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def ready(self) -> bool:
+        return self.status in READY_STATES
+
+
+def snapshot_from_result(task_id: str, status: str, result: Any) -> JobSnapshot:
+    snap = JobSnapshot(task_id=task_id, status=status)
+    if status != "SUCCESS" or not isinstance(result, dict):
+        return snap
+    snap.raw = result
+    snap.meta = {k: v for k, v in result.items() if not k.endswith("_base64")}
+    for variant, (b64_field, sha_field) in _REPORT_FIELDS.items():
+        encoded = result.get(b64_field)
+        if encoded:
+            body = base64.b64decode(encoded)
+            snap.reports[variant] = body
+            snap.etags[variant] = result.get(sha_field) or ""
+    return snap
+
+
+class JobResultCache:
+    def __init__(self, *, status_ttl: float, result_ttl: float, max_entries: int):
+        self.status_ttl = status_ttl
+        self.result_ttl = result_ttl
+        self.max_entries = max(1, max_entries)
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, JobSnapshot]" = OrderedDict()
+        self._inflight: Dict[str, threading.Event] = {}
+        self._counters = {"hits": 0, "misses": 0, "coalesced": 0}
+
+    @classmethod
+    def from_config(cls) -> "JobResultCache":
+        return cls(status_ttl=Config.JOB_STATUS_CACHE_TTL, result_ttl=Config.JOB_RESULT_CACHE_TTL,
+                   max_entries=Config.JOB_RESULT_CACHE_MAX_ENTRIES)
+
+    def _fresh(self, snap: JobSnapshot) -> bool:
+        ttl = self.result_ttl if snap.ready else self.status_ttl
+        return time.monotonic() - snap.fetched_at < ttl
+
+    def get(self, task_id: str, fetch: Callable[[str], JobSnapshot]) -> JobSnapshot:
+        """Returns a fresh snapshot of `task_id`, calling `fetch` at most once at a time per task (blocking)."""
+        while True:
+            with self._lock:
+                snap = self._entries.get(task_id)
+                if snap is not None and self._fresh(snap):
+                    self._entries.move_to_end(task_id)
+                    self._counters["hits"] += 1
+                    return snap
+                waiter = self._inflight.get(task_id)
+                if waiter is None:
+                    self._inflight[task_id] = threading.Event()
+                    self._counters["misses"] += 1
+                    break
+                self._counters["coalesced"] += 1
+            # another thread is reading the backend for this task: wait for its answer
+            waiter.wait(timeout=max(self.status_ttl, 5.0))
+            with self._lock:
+                snap = self._entries.get(task_id)
+                if snap is not None:
+                    return snap
+        try:
+            snap = fetch(task_id)
+            with self._lock:
+                self._entries[task_id] = snap
+                self._entries.move_to_end(task_id)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            return snap
+        finally:
+            with self._lock:
+                self._inflight.pop(task_id).set()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self._counters, entries=len(self._entries))
+
+
+job_result_cache = JobResultCache.from_config()
@@ -0,0 +1,98 @@
+# api/warmup.py
+"""
+Background warm-up of the API process, reported by `/readyz`.
+
+The app binds and answers `/healthz` before anything heavy is loaded; a daemon
+thread then, in order: imports the engine, registers the fonts, builds the LLM
+clients, starts the render processes, checks Redis and Spaces. Each component is
+`pending` -> `warming` -> `ready` | `failed`. Required components gate readiness;
+optional ones (Redis, Spaces backups) are reported but never take the API out
+of rotation. Requests arriving before warm-up load what they need on first use.
+
+STARTUP_WARMUP: background (default) | blocking (warm inside the startup event) | off.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from core.config import Config
+
+logger = logging.getLogger("pioui.warmup")
+
+
+@dataclass
+class Component:
+    name: str
+    fn: Callable[[], Any]
+    required: bool = True
+    state: str = "pending"
+    seconds: Optional[float] = None
+    detail: Optional[str] = None
+
+
+@dataclass
+class Warmup:
+    components: List[Component] = field(default_factory=list)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    _thread: Optional[threading.Thread] = None
+
+    def add(self, name: str, fn: Callable[[], Any], *, required: bool = True) -> None:
+        self.components.append(Component(name, fn, required))
+
+    def run(self) -> None:
+        self.started_at = time.monotonic()
+        for c in self.components:
+            c.state = "warming"
+            t0 = time.perf_counter()
+            try:
+                out = c.fn()
+                c.detail = None if out is None else str(out)
+                c.state = "ready"
+            except Exception as e:
+                c.state = "failed"
+                c.detail = f"{type(e).__name__}: {e}"
+                log = logger.error if c.required else logger.warning
+                log("warmup_failed: %s: %s", c.name, c.detail)
+            c.seconds = round(time.perf_counter() - t0, 3)
+        self.finished_at = time.monotonic()
+        logger.info("warmup_done", extra=self.snapshot())
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, name="warmup", daemon=True)
+            self._thread.start()
+
+    @property
+    def ready(self) -> bool:
+        return all(c.state == "ready" for c in self.components if c.required)
+
+    def snapshot(self) -> Dict[str, Any]:
+        took = None
+        if self.started_at is not None and self.finished_at is not None:
+            took = round(self.finished_at - self.started_at, 3)
+        return {
+            "ready": self.ready,
+            "warmup_seconds": took,
+            "components": {
+                c.name: {"state": c.state, "required": c.required, "seconds": c.seconds, "detail": c.detail}
+                for c in self.components
+            },
+        }
+
+
+def start(warmup: Warmup, mode: Optional[str] = None) -> None:
+    mode = (mode or Config.STARTUP_WARMUP).lower()
+    if mode == "off":
+        # nothing preloaded: readiness only means "process is up"
+        for c in warmup.components:
+            c.state, c.detail = "ready", "skipped"
+        return
+    if mode == "blocking":
+        warmup.run()
+    else:
+        warmup.start()
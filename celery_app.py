@@ -1,4 +1,6 @@
+import os
 from celery import Celery
+from celery.signals import worker_init, worker_process_init, worker_ready, worker_process_shutdown
 from core.config import Config
 
 celery = Celery(
@@ -20,3 +22,31 @@ celery.conf.update(
     task_soft_time_limit=Config.CELERY_TASK_SOFT_TIME_LIMIT,
     include=["tasks"],                # <-- ensure tasks module is loaded
 )
+
+
+@worker_init.connect
+def _prefork_warm(**_):
+    # main worker process, before the pool forks: engine state shared copy-on-write by the children
+    from core import prefork
+    prefork.warm_shared_state()
+
+
+@worker_process_init.connect
+def _prefork_reset(**_):
+    # each prefork child: no Redis / HTTP connection inherited from the parent
+    from core import prefork
+    prefork.reset_after_fork()
+
+
+@worker_ready.connect
+def _start_metrics_exporter(**_):
+    # Prometheus exporter in the main worker process; prefork children need PROMETHEUS_MULTIPROC_DIR
+    if Config.METRICS_WORKER_PORT:
+        from core import metrics
+        metrics.start_exporter(Config.METRICS_WORKER_PORT)
+
+
+@worker_process_shutdown.connect
+def _metrics_process_dead(pid=None, **_):
+    from core import metrics
+    metrics.mark_process_dead(pid or os.getpid())
@@ -0,0 +1,194 @@
+# core/admission.py
+"""
+Per-API-key admission control for the engine endpoints (sync + jobs).
+
+Each key has, in Redis (shared by every gunicorn worker):
+- a token bucket (`ADMISSION_BURST` tokens, refilled at `ADMISSION_RATE` tokens/s),
+  charged with the weighted cost of the request (see `request_cost`). A request costing
+  more than the burst (big batch, long PDF) is admitted on a full bucket and leaves it
+  in debt, so the key waits for the refill;
+- lease sets (ZSETs of leases scored by expiry), one per pool:
+  `inflight` — sync runs, capped at `ADMISSION_MAX_INFLIGHT`;
+  `queued`   — async jobs, queued or running, capped at `ADMISSION_MAX_QUEUED`
+  (queuing is what the job API is for: a much higher cap).
+  Leases are released when the work ends, or expire after ADMISSION_LEASE_TTL if a
+  worker dies. Batches are only charged (per item): their window is BATCH_MAX_PARALLEL.
+Both checks run in one Lua script, against the Redis clock. A refusal carries a
+Retry-After hint (429). Redis down => fail open: availability over fairness.
+
+Per-key overrides: ADMISSION_KEY_LIMITS='{"<key id>": {"rate": 1, "burst": 40, "inflight": 8, "queued": 100}}'
+where the key id is `key_id(api_key)` (never the key itself; also used in logs).
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import math
+import uuid
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from core import metrics
+from core.config import Config
+from core.prefork import after_fork
+from core.redis_client import get_redis
+
+logger = logging.getLogger("pioui.admission")
+
+_PREFIX = "pioui:admission:"
+
+# KEYS[1] bucket hash, KEYS[2] lease zset of the pool
+# ARGV rate, burst, cost, max_leases, lease_id ("" = charge only), lease_ttl, key_ttl
+_ACQUIRE_LUA = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local max_inflight = tonumber(ARGV[4])
+local key_ttl = tonumber(ARGV[7])
+
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now)
+local inflight = redis.call('ZCARD', KEYS[2])
+if max_inflight > 0 and inflight >= max_inflight then
+  local first = redis.call('ZRANGE', KEYS[2], 0, 0, 'WITHSCORES')
+  return {0, 'inflight', tostring(inflight), tostring(tonumber(first[2]) - now)}
+end
+
+local b = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(b[1])
+local ts = tonumber(b[2])
+if tokens == nil then
+  tokens = burst
+  ts = now
+end
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+-- a cost above the burst needs a full bucket, then leaves it in debt
+local need = math.min(cost, burst)
+if tokens < need then
+  redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+  redis.call('EXPIRE', KEYS[1], key_ttl)
+  return {0, 'rate', tostring(inflight), tostring((need - tokens) / rate)}
+end
+
+tokens = tokens - cost
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], key_ttl)
+if ARGV[5] == '' then
+  return {1, 'ok', tostring(inflight), '0'}
+end
+redis.call('ZADD', KEYS[2], now + tonumber(ARGV[6]), ARGV[5])
+redis.call('EXPIRE', KEYS[2], key_ttl)
+return {1, 'ok', tostring(inflight + 1), '0'}
+"""
+
+
+def key_id(api_key: str) -> str:
+    """Stable, non-reversible id of an API key (Redis keys, logs, overrides)."""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+def request_cost(kind: str, *, pages: int = 1, images: int = 1) -> float:
+    """Weighted cost: a text PDF ~1 token, each extra page and each Pixtral image cost more."""
+    if kind == "pdf":
+        return Config.ADMISSION_COST_PDF + Config.ADMISSION_COST_PDF_PAGE * max(0, pages - 1)
+    return Config.ADMISSION_COST_IMAGE * max(1, images)
+
+
+@dataclass
+class Decision:
+    allowed: bool
+    reason: str                    # ok | rate | inflight | disabled | unavailable
+    retry_after: int = 0
+    lease: Optional[str] = None
+    key: Optional[str] = None
+    inflight: int = 0
+    pool: Optional[str] = None     # lease set of `lease` (inflight | queued)
+
+
+class AdmissionController:
+    def __init__(self, *, enabled: bool, rate: float, burst: float, max_inflight: int, lease_ttl: int,
+                 max_queued: int = 0, inflight_retry_after: int = 5,
+                 overrides: Optional[Dict[str, Dict[str, float]]] = None):
+        self.enabled = enabled
+        self.rate = rate
+        self.burst = burst
+        self.max_inflight = max_inflight
+        self.max_queued = max_queued
+        self.lease_ttl = lease_ttl
+        self.inflight_retry_after = inflight_retry_after
+        self.overrides = overrides or {}
+        self._script = None
+
+    @classmethod
+    def from_config(cls) -> "AdmissionController":
+        try:
+            overrides = json.loads(Config.ADMISSION_KEY_LIMITS or "{}")
+        except ValueError:
+            logger.error("admission_bad_key_limits: ADMISSION_KEY_LIMITS is not valid JSON, ignored")
+            overrides = {}
+        return cls(enabled=Config.ADMISSION_ENABLED, rate=Config.ADMISSION_RATE, burst=Config.ADMISSION_BURST,
+                   max_inflight=Config.ADMISSION_MAX_INFLIGHT, lease_ttl=Config.ADMISSION_LEASE_TTL,
+                   max_queued=Config.ADMISSION_MAX_QUEUED, inflight_retry_after=Config.ADMISSION_INFLIGHT_RETRY_AFTER, overrides=overrides)
+
+    def limits(self, kid: str) -> Dict[str, float]:
+        o = self.overrides.get(kid) or {}
+        return {
+            "rate": float(o.get("rate", self.rate)),
+            "burst": float(o.get("burst", self.burst)),
+            "inflight": int(o.get("inflight", self.max_inflight)),
+            "queued": int(o.get("queued", self.max_queued)),
+        }
+
+    def _acquire_script(self):
+        if self._script is None:
+            self._script = get_redis().register_script(_ACQUIRE_LUA)
+        return self._script
+
+    def reset(self) -> None:
+        # the registered script holds the parent's Redis client: re-bound lazily after fork
+        self._script = None
+
+    def acquire(self, api_key: str, cost: float, pool: Optional[str] = "inflight") -> Decision:
+        """
+        Charges `cost` and takes a lease in `pool` ("inflight": sync runs, "queued": async jobs,
+        None: charge only, no lease) for `api_key` (blocking: call from a thread).
+        """
+        kid = key_id(api_key)
+        if not self.enabled:
+            return Decision(True, "disabled", key=kid)
+        lim = self.limits(kid)
+        lease = uuid.uuid4().hex if pool else ""
+        try:
+            allowed, reason, inflight, wait = self._acquire_script()(
+                keys=[f"{_PREFIX}{kid}:bucket", f"{_PREFIX}{kid}:{pool or 'inflight'}"],
+                args=[lim["rate"], lim["burst"], cost, lim[pool] if pool else 0, lease, self.lease_ttl,
+                      max(self.lease_ttl, int(lim["burst"] / max(lim["rate"], 1e-6)) + 60)],
+            )
+        except Exception as e:
+            logger.warning("admission_unavailable (fail open): %s", e)
+            metrics.record_admission("unavailable")
+            return Decision(True, "unavailable", key=kid)
+        reason = reason.decode() if isinstance(reason, bytes) else reason
+        metrics.record_admission(reason)
+        if int(allowed) != 1:
+            retry_after = max(1, math.ceil(float(wait)))
+            if reason == "inflight":  # wait is the oldest lease's expiry: a worst case, not a hint
+                retry_after = min(retry_after, self.inflight_retry_after)
+            logger.info("admission_rejected", extra={"key_id": kid, "reason": reason, "cost": cost,
+                                                     "retry_after": retry_after})
+            return Decision(False, reason, retry_after=retry_after, key=kid, inflight=int(inflight))
+        return Decision(True, reason, lease=lease or None, key=kid, inflight=int(inflight), pool=pool)
+
+    def release(self, kid: Optional[str], lease: Optional[str], pool: Optional[str] = "inflight") -> None:
+        if not (self.enabled and kid and lease):
+            return
+        try:
+            get_redis().zrem(f"{_PREFIX}{kid}:{pool or 'inflight'}", lease)
+        except Exception as e:
+            logger.warning("admission_release_failed: %s", e)
+
+
+admission = AdmissionController.from_config()
+after_fork(admission.reset)
@@ -19,7 +19,12 @@ class Config:
 
     # Application
     SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-here")
-    MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
+    MAX_CONTENT_LENGTH = int(os.getenv("MAX_CONTENT_LENGTH", str(16 * 1024 * 1024)))  # 16MB max file size
+    MAX_PDF_PAGES = int(os.getenv("MAX_PDF_PAGES", "30"))  # page-count preflight (0 = no limit)
+    # whole request (8 images + form fields); checked on Content-Length before parsing the body
+    MAX_REQUEST_BYTES = int(os.getenv("MAX_REQUEST_BYTES", str(8 * MAX_CONTENT_LENGTH + 1024 * 1024)))
+    # single-PDF endpoints: one file + multipart headers and form fields
+    MAX_PDF_REQUEST_BYTES = int(os.getenv("MAX_PDF_REQUEST_BYTES", str(MAX_CONTENT_LENGTH + 64 * 1024)))
 
     # Allowed file extensions
     ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg'}
@@ -40,6 +45,118 @@ class Config:
     CELERY_TASK_TIME_LIMIT = int(os.getenv("CELERY_TASK_TIME_LIMIT", "600"))  # 10 min
     CELERY_TASK_SOFT_TIME_LIMIT = int(os.getenv("CELERY_TASK_SOFT_TIME_LIMIT", "540"))
 
+    # Redis (caches / shared state); defaults to the Celery broker instance
+    REDIS_URL = os.getenv("REDIS_URL", CELERY_BROKER_URL)
+    REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "2"))
+
+    # Job progress events (Redis pub/sub -> SSE / WebSocket)
+    PROGRESS_TTL = int(os.getenv("PROGRESS_TTL", "3600"))                  # last event kept for late subscribers
+    PROGRESS_HEARTBEAT = float(os.getenv("PROGRESS_HEARTBEAT", "15"))       # seconds between keep-alives
+    PROGRESS_STREAM_TIMEOUT = int(os.getenv("PROGRESS_STREAM_TIMEOUT", str(CELERY_TASK_TIME_LIMIT + 60)))
+
+    # Job status polling (api/job_results.py): coalesced AsyncResult lookups
+    JOB_STATUS_CACHE_TTL = float(os.getenv("JOB_STATUS_CACHE_TTL", "1"))       # pending / running jobs
+    JOB_RESULT_CACHE_TTL = float(os.getenv("JOB_RESULT_CACHE_TTL", "300"))     # finished jobs (decoded PDFs)
+    JOB_RESULT_CACHE_MAX_ENTRIES = int(os.getenv("JOB_RESULT_CACHE_MAX_ENTRIES", "64"))
+
+    # Result cache (identical submissions -> no LLM / rendering)
+    RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"
+    RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(128 * 1024 * 1024)))  # local LRU tier
+    RESULT_CACHE_REDIS = os.getenv("RESULT_CACHE_REDIS", "false").lower() == "true"            # shared tier
+    RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", "86400"))
+
+    # LLM response cache (services/cache/llm_cache.py): same prompt / images -> no second LLM call
+    LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+    LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "cache/llm_cache.sqlite3")                  # local tier (SQLite)
+    LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))      # LRU eviction above
+    LLM_CACHE_REDIS = os.getenv("LLM_CACHE_REDIS", "false").lower() == "true"                # shared tier
+    LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(30 * 86400)))
+
+    # Batches (/v1/batches): items fanned out over Celery with a per-batch sliding window
+    BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+    BATCH_MAX_PARALLEL = int(os.getenv("BATCH_MAX_PARALLEL", "4"))          # items of one batch running at once
+    BATCH_MAX_REQUEST_BYTES = int(os.getenv("BATCH_MAX_REQUEST_BYTES", str(1024 * 1024 * 1024)))
+    BATCH_MAX_UNZIPPED_BYTES = int(os.getenv("BATCH_MAX_UNZIPPED_BYTES", str(1024 * 1024 * 1024)))
+    BATCH_TTL = int(os.getenv("BATCH_TTL", str(CELERY_RESULT_EXPIRES)))
+
+    # Scanned PDFs: pages OCR'd concurrently by the vision model (per invoice)
+    OCR_PAGE_PARALLELISM = int(os.getenv("OCR_PAGE_PARALLELISM", "4"))
+    # Mixed PDFs: only pages without a usable text layer are rasterized and OCR'd
+    OCR_HYBRID_ENABLED = os.getenv("OCR_HYBRID_ENABLED", "true").lower() == "true"
+    OCR_PAGE_MIN_CHARS = int(os.getenv("OCR_PAGE_MIN_CHARS", "40"))           # fewer non-blank chars = no text layer
+    OCR_PAGE_MIN_IMAGE_COVERAGE = float(os.getenv("OCR_PAGE_MIN_IMAGE_COVERAGE", "0.2"))  # ... and images on >= 20% of it
+    # Local OCR tier: Tesseract first, GPT vision only for pages below the confidence threshold
+    TESSERACT_ENABLED = os.getenv("TESSERACT_ENABLED", "true").lower() == "true"
+    TESSERACT_LANG = os.getenv("TESSERACT_LANG", "fra")
+    TESSERACT_MIN_CONFIDENCE = float(os.getenv("TESSERACT_MIN_CONFIDENCE", "75"))  # mean word confidence, 0..100
+    TESSERACT_PARALLELISM = int(os.getenv("TESSERACT_PARALLELISM", str(os.cpu_count() or 2)))  # pages at once per process
+
+    # PDF text layer (services/reporting/backends/text.py)
+    TEXT_EXTRACTOR = os.getenv("TEXT_EXTRACTOR", "pymupdf")                   # pymupdf | pdfplumber
+    TEXT_EXTRACTOR_FALLBACK = os.getenv("TEXT_EXTRACTOR_FALLBACK", "pdfplumber")  # tried if the first one raises ("" = none)
+    TEXT_EXTRACT_WORKERS = int(os.getenv("TEXT_EXTRACT_WORKERS", "0"))       # processes for large PDFs (0 = in-process)
+    TEXT_EXTRACT_PARALLEL_MIN_PAGES = int(os.getenv("TEXT_EXTRACT_PARALLEL_MIN_PAGES", "24"))
+
+    # Page relevance (engine.select_relevant_pages): only the best pages go to the LLM
+    PAGE_SELECT_ENABLED = os.getenv("PAGE_SELECT_ENABLED", "true").lower() == "true"
+    PAGE_SELECT_TOP_K = int(os.getenv("PAGE_SELECT_TOP_K", "3"))           # + page 1, always kept
+    PAGE_SELECT_MIN_SCORE = float(os.getenv("PAGE_SELECT_MIN_SCORE", "15"))
+    PAGE_SELECT_FALLBACK_ALL = os.getenv("PAGE_SELECT_FALLBACK_ALL", "true").lower() == "true"  # low confidence -> all pages
+
+    # Supplier layout templates (services/reporting/templates.py): fields read from word boxes, no LLM call
+    TEMPLATES_ENABLED = os.getenv("TEMPLATES_ENABLED", "true").lower() == "true"
+    TEMPLATE_DIR = os.getenv("TEMPLATE_DIR", "assets/templates")           # one JSON per layout (scripts/learn_templates.py)
+    TEMPLATE_MAX_PAGES = int(os.getenv("TEMPLATE_MAX_PAGES", "3"))          # pages read for matching / extraction
+
+    # Regex fast path (services/reporting/fastpath.py): no LLM call when every Facture field is found
+    FASTPATH_ENABLED = os.getenv("FASTPATH_ENABLED", "true").lower() == "true"
+
+    # Prompt compaction before parse_text_with_gpt (services/reporting/compaction.py)
+    PROMPT_COMPACTION_ENABLED = os.getenv("PROMPT_COMPACTION_ENABLED", "true").lower() == "true"
+    PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "3000"))      # estimated tokens, 0 = no budget
+
+    # Images sent to vision models (services/reporting/imageprep.py): oriented, cropped, downscaled, re-encoded in memory
+    IMAGE_PREP_ENABLED = os.getenv("IMAGE_PREP_ENABLED", "true").lower() == "true"
+    IMAGE_PREP_FORMAT = os.getenv("IMAGE_PREP_FORMAT", "auto")          # auto (smaller of jpeg/png) | jpeg | webp | png
+    IMAGE_PREP_QUALITY = int(os.getenv("IMAGE_PREP_QUALITY", "85"))
+    IMAGE_PREP_GRAYSCALE = os.getenv("IMAGE_PREP_GRAYSCALE", "false").lower() == "true"
+    IMAGE_PREP_CROP = os.getenv("IMAGE_PREP_CROP", "true").lower() == "true"
+    IMAGE_PREP_PIXTRAL_MAX_SIDE = int(os.getenv("IMAGE_PREP_PIXTRAL_MAX_SIDE", "1540"))
+    IMAGE_PREP_TILE_SLACK = float(os.getenv("IMAGE_PREP_TILE_SLACK", "0.9"))  # GPT: shrink <=10% to save a tile row
+
+    # Startup (api/warmup.py): background | blocking | off — /healthz answers at once, /readyz once warm
+    STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "background")
+    # Pre-fork (core/prefork.py): build immutable engine state in the gunicorn / Celery parent, shared copy-on-write
+    PREFORK_WARM = os.getenv("PREFORK_WARM", "true").lower() == "true"
+
+    # Sync engine execution (api/app.py -> services/execution/engine_pool.py)
+    ENGINE_IO_WORKERS = int(os.getenv("ENGINE_IO_WORKERS", "4"))          # threads: extraction + LLM calls
+    ENGINE_RENDER_WORKERS = int(os.getenv("ENGINE_RENDER_WORKERS", "2"))  # processes: ReportLab (0 = render on threads)
+    ENGINE_QUEUE_MAX = int(os.getenv("ENGINE_QUEUE_MAX", "8"))            # jobs allowed to wait beyond busy threads
+    ENGINE_RETRY_AFTER = int(os.getenv("ENGINE_RETRY_AFTER", "15"))       # seconds, sent with 503 when full
+    ENGINE_RENDER_START_METHOD = os.getenv("ENGINE_RENDER_START_METHOD", "spawn")
+
+    # Admission control per API key (core/admission.py): token bucket + inflight cap, shared via Redis
+    ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+    ADMISSION_RATE = float(os.getenv("ADMISSION_RATE", "0.5"))              # cost units refilled per second
+    ADMISSION_BURST = float(os.getenv("ADMISSION_BURST", "20"))             # bucket size
+    ADMISSION_MAX_INFLIGHT = int(os.getenv("ADMISSION_MAX_INFLIGHT", "4"))  # sync runs in progress (0 = no cap)
+    ADMISSION_MAX_QUEUED = int(os.getenv("ADMISSION_MAX_QUEUED", "100"))    # queued/running jobs (0 = no cap)
+    ADMISSION_LEASE_TTL = int(os.getenv("ADMISSION_LEASE_TTL", str(CELERY_TASK_TIME_LIMIT + 300)))  # lost leases expire
+    ADMISSION_INFLIGHT_RETRY_AFTER = int(os.getenv("ADMISSION_INFLIGHT_RETRY_AFTER", "5"))  # seconds, 429 on inflight cap
+    ADMISSION_KEY_LIMITS = os.getenv("ADMISSION_KEY_LIMITS", "")           # JSON {key id: {rate, burst, inflight}}
+    ADMISSION_COST_PDF = float(os.getenv("ADMISSION_COST_PDF", "1"))               # text PDF, first page
+    ADMISSION_COST_PDF_PAGE = float(os.getenv("ADMISSION_COST_PDF_PAGE", "0.25"))  # each extra page
+    ADMISSION_COST_IMAGE = float(os.getenv("ADMISSION_COST_IMAGE", "2"))           # per image (vision model)
+
+    # Idempotent job enqueue (api/idempotency.py): Idempotency-Key header or content fingerprint -> task id
+    IDEMPOTENCY_ENABLED = os.getenv("IDEMPOTENCY_ENABLED", "true").lower() == "true"
+    IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", str(CELERY_RESULT_EXPIRES)))  # task ids are useless after that
+
+    # Metrics (core/metrics.py); multi-process: also set PROMETHEUS_MULTIPROC_DIR
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")                       # bearer token for /metrics (empty = open)
+    METRICS_WORKER_PORT = int(os.getenv("METRICS_WORKER_PORT", "0"))     # Celery exporter port (0 = off)
+
     # Security settings
     FORCE_HTTPS = os.getenv("FORCE_HTTPS", "false").lower() == "true"
     ALLOWED_HOSTS = os.getenv("ALLOWED_HOSTS", "*")  # Comma-separated list of allowed hosts
@@ -0,0 +1,298 @@
+# core/metrics.py
+"""
+Prometheus metrics for the invoice pipeline, shared by the API and the Celery workers.
+
+- pioui_stage_seconds{stage, energy_type, source_kind}        histogram per pipeline stage
+- pioui_stage_errors_total{stage, energy_type, source_kind}   stages that raised
+- pioui_llm_tokens_total{call, model, token_type, energy_type, source_kind}
+- pioui_admission_total{decision}                              admission control outcomes (core/admission.py)
+- pioui_llm_image_bytes{call, phase, ...}                      per-image bytes, phase = source | sent
+- pioui_llm_image_tokens{call, ...}                            estimated image tokens per image sent
+- pioui_llm_prompt_tokens{call, phase, ...}                     estimated prompt tokens per call, phase = raw | compacted
+- pioui_llm_prompt_tokens_saved_total{call, ...}                estimated prompt tokens removed by compaction
+- pioui_llm_pages_total{call, decision, ...}                   PDF pages sent to / skipped before the LLM
+- pioui_page_routes_total{route, ...}                           PDF pages read from the text layer / OCR'd (route = text | ocr)
+- pioui_llm_cache_total{call, outcome, ...}                      LLM response cache: hit_local | hit_redis | miss
+- pioui_template_lookups_total{outcome, ...}                    supplier layout templates: hit | partial | unknown
+- pioui_fastpath_total{outcome, ...}                             regex extraction: complete (LLM skipped) | partial
+- pioui_ocr_pages_total{engine, ...}                            OCR'd pages by engine (tesseract | gpt, low-confidence pages)
+
+`energy_type` / `source_kind` come from a contextvars context (`labels(...)`), set
+once by the endpoint or task, so the engine functions need no extra arguments.
+Thread pools must run work inside `contextvars.copy_context()` to keep them.
+
+Several processes (gunicorn -w, Celery prefork children): set PROMETHEUS_MULTIPROC_DIR
+to a shared, empty directory; `/metrics` and the worker exporter then aggregate all
+processes. Render subprocesses use `capture()` and the parent `replay()`s the samples.
+"""
+from __future__ import annotations
+
+import contextvars
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest
+
+logger = logging.getLogger("pioui.metrics")
+
+_LABELS = ("energy_type", "source_kind")
+_DEFAULT_LABELS = {"energy_type": "unknown", "source_kind": "unknown"}
+_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120, float("inf"))
+_BYTE_BUCKETS = tuple(2 ** k * 1024 for k in range(4, 15)) + (float("inf"),)  # 16 KiB .. 16 MiB
+_TOKEN_BUCKETS = (256, 512, 768, 1024, 1536, 2048, 3072, 4096, 6144, 8192, float("inf"))
+
+STAGE_SECONDS = Histogram(
+    "pioui_stage_seconds", "Duration of one invoice pipeline stage",
+    ("stage",) + _LABELS, buckets=_BUCKETS,
+)
+STAGE_ERRORS = Counter(
+    "pioui_stage_errors", "Pipeline stages that raised", ("stage",) + _LABELS,
+)
+LLM_TOKENS = Counter(
+    "pioui_llm_tokens", "LLM tokens consumed", ("call", "model", "token_type") + _LABELS,
+)
+
+LLM_IMAGE_BYTES = Histogram(
+    "pioui_llm_image_bytes", "Bytes of one image for a vision call, as uploaded and as sent",
+    ("call", "phase") + _LABELS, buckets=_BYTE_BUCKETS,
+)
+LLM_IMAGE_TOKENS = Histogram(
+    "pioui_llm_image_tokens", "Estimated input tokens of one image sent to a vision model",
+    ("call",) + _LABELS, buckets=_TOKEN_BUCKETS,
+)
+LLM_PROMPT_TOKENS = Histogram(
+    "pioui_llm_prompt_tokens", "Estimated prompt tokens of one text LLM call, before and after compaction",
+    ("call", "phase") + _LABELS, buckets=_TOKEN_BUCKETS,
+)
+LLM_PROMPT_TOKENS_SAVED = Counter(
+    "pioui_llm_prompt_tokens_saved", "Estimated prompt tokens removed by compaction", ("call",) + _LABELS,
+)
+LLM_PAGES = Counter(
+    "pioui_llm_pages", "PDF pages sent to or skipped before the LLM (page relevance)",
+    ("call", "decision") + _LABELS,
+)
+
+PAGE_ROUTES = Counter(
+    "pioui_page_routes", "PDF pages read from their text layer or rasterized for OCR",
+    ("route",) + _LABELS,
+)
+
+LLM_CACHE = Counter(
+    "pioui_llm_cache", "LLM response cache lookups: hit (local SQLite / redis, no LLM call) or miss",
+    ("call", "outcome") + _LABELS,
+)
+
+TEMPLATE_LOOKUPS = Counter(
+    "pioui_template_lookups", "Supplier layout template lookups: hit (no LLM call), partial or unknown layout",
+    ("outcome",) + _LABELS,
+)
+FASTPATH = Counter(
+    "pioui_fastpath", "Regex extractions of text PDFs: complete (no LLM call) or partial", ("outcome",) + _LABELS,
+)
+
+OCR_PAGES = Counter(
+    "pioui_ocr_pages", "Scanned pages OCR'd locally (Tesseract) or by GPT vision",
+    ("engine",) + _LABELS,
+)
+
+ADMISSION = Counter(
+    "pioui_admission", "Admission control decisions", ("decision",),
+)
+
+_labels: contextvars.ContextVar[Dict[str, str]] = contextvars.ContextVar("pioui_metric_labels",
+                                                                         default=_DEFAULT_LABELS)
+_captured: contextvars.ContextVar[Optional[List[Tuple]]] = contextvars.ContextVar("pioui_metric_capture",
+                                                                                  default=None)
+
+
+@contextmanager
+def labels(**values: Optional[str]) -> Iterator[None]:
+    """Sets energy_type / source_kind for every metric recorded inside the block."""
+    merged = dict(_labels.get())
+    merged.update({k: str(v).lower() for k, v in values.items() if k in _LABELS and v})
+    token = _labels.set(merged)
+    try:
+        yield
+    finally:
+        _labels.reset(token)
+
+
+def current_labels() -> Dict[str, str]:
+    return dict(_labels.get())
+
+
+# ——— recording ———
+def _record(sample: Tuple) -> None:
+    kind, name, value, lbl = sample  # labels were resolved when the sample was emitted
+    if kind == "stage":
+        STAGE_SECONDS.labels(stage=name, **lbl).observe(value)
+    elif kind == "error":
+        STAGE_ERRORS.labels(stage=name, **lbl).inc()
+    elif kind == "tokens":
+        LLM_TOKENS.labels(**lbl).inc(value)
+    elif kind == "image_bytes":
+        LLM_IMAGE_BYTES.labels(**lbl).observe(value)
+    elif kind == "image_tokens":
+        LLM_IMAGE_TOKENS.labels(call=name, **lbl).observe(value)
+    elif kind == "prompt_tokens":
+        LLM_PROMPT_TOKENS.labels(**lbl).observe(value)
+    elif kind == "prompt_tokens_saved":
+        LLM_PROMPT_TOKENS_SAVED.labels(call=name, **lbl).inc(value)
+    elif kind == "pages":
+        LLM_PAGES.labels(**lbl).inc(value)
+    elif kind == "page_route":
+        PAGE_ROUTES.labels(route=name, **lbl).inc(value)
+    elif kind == "llm_cache":
+        LLM_CACHE.labels(**lbl).inc(value)
+    elif kind == "template":
+        TEMPLATE_LOOKUPS.labels(outcome=name, **lbl).inc(value)
+    elif kind == "fastpath":
+        FASTPATH.labels(outcome=name, **lbl).inc(value)
+    elif kind == "ocr_engine":
+        OCR_PAGES.labels(engine=name, **lbl).inc(value)
+
+
+def _emit(kind: str, name: str, value: float, extra: Optional[Dict[str, str]] = None) -> None:
+    sample = (kind, name, value, {**_labels.get(), **(extra or {})})
+    buf = _captured.get()
+    try:
+        if buf is not None:
+            buf.append(sample)
+        else:
+            _record(sample)
+    except Exception as e:  # metrics never break the pipeline
+        logger.debug("metric_record_failed: %s", e)
+
+
+def observe_stage(stage: str, seconds: float, ok: bool = True) -> None:
+    _emit("stage", stage, seconds)
+    if not ok:
+        _emit("error", stage, 1)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Times the block as pipeline stage `name` (errors are counted, then re-raised)."""
+    t0 = time.perf_counter()
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        observe_stage(name, time.perf_counter() - t0, ok=ok)
+
+
+def record_tokens(call: str, model: str, usage) -> None:
+    """Token counts from an OpenAI / Mistral `usage` object (ignored when missing)."""
+    if usage is None:
+        return
+    for token_type, attr in (("prompt", "prompt_tokens"), ("completion", "completion_tokens")):
+        n = getattr(usage, attr, None)
+        if n:
+            _emit("tokens", call, n, extra={"call": call, "model": model, "token_type": token_type})
+
+
+def record_image(call: str, source_bytes: int, sent_bytes: int, tokens: int) -> None:
+    """Per-image budget of a vision call (services/reporting/imageprep.py)."""
+    _emit("image_bytes", call, source_bytes, extra={"call": call, "phase": "source"})
+    _emit("image_bytes", call, sent_bytes, extra={"call": call, "phase": "sent"})
+    _emit("image_tokens", call, tokens)
+
+
+def record_compaction(call: str, tokens_before: int, tokens_after: int) -> None:
+    """Prompt size of a text LLM call before / after compaction (services/reporting/compaction.py)."""
+    _emit("prompt_tokens", call, tokens_before, extra={"call": call, "phase": "raw"})
+    _emit("prompt_tokens", call, tokens_after, extra={"call": call, "phase": "compacted"})
+    if tokens_before > tokens_after:
+        _emit("prompt_tokens_saved", call, tokens_before - tokens_after)
+
+
+def record_pages(call: str, sent: int, skipped: int) -> None:
+    for decision, n in (("sent", sent), ("skipped", skipped)):
+        if n:
+            _emit("pages", call, n, extra={"call": call, "decision": decision})
+
+
+def record_page_routes(text: int, ocr: int) -> None:
+    for route, n in (("text", text), ("ocr", ocr)):
+        if n:
+            _emit("page_route", route, n)
+
+
+def record_llm_cache(call: str, outcome: str) -> None:
+    _emit("llm_cache", call, 1, extra={"call": call, "outcome": outcome})
+
+
+def record_template(outcome: str) -> None:
+    _emit("template", outcome, 1)
+
+
+def record_fastpath(outcome: str) -> None:
+    _emit("fastpath", outcome, 1)
+
+
+def record_ocr_engine(engine: str) -> None:
+    _emit("ocr_engine", engine, 1)
+
+
+def record_admission(decision: str) -> None:
+    try:
+        ADMISSION.labels(decision=decision).inc()
+    except Exception as e:
+        logger.debug("metric_record_failed: %s", e)
+
+
+# ——— cross-process hand-off (render pool) ———
+@contextmanager
+def capture() -> Iterator[List[Tuple]]:
+    """Collects the samples recorded inside the block instead of recording them (see `replay`)."""
+    buf: List[Tuple] = []
+    token = _captured.set(buf)
+    try:
+        yield buf
+    finally:
+        _captured.reset(token)
+
+
+def replay(samples: Optional[List[Tuple]]) -> None:
+    for sample in samples or ():
+        try:
+            _record(sample)
+        except Exception as e:
+            logger.debug("metric_replay_failed: %s", e)
+
+
+# ——— exposition ———
+def multiprocess_enabled() -> bool:
+    return bool(os.getenv("PROMETHEUS_MULTIPROC_DIR") or os.getenv("prometheus_multiproc_dir"))
+
+
+def _registry():
+    if multiprocess_enabled():
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    from prometheus_client import REGISTRY
+    return REGISTRY
+
+
+def render_latest() -> Tuple[bytes, str]:
+    """(body, content type) in Prometheus text format, aggregated across processes if configured."""
+    return generate_latest(_registry()), CONTENT_TYPE_LATEST
+
+
+def start_exporter(port: int, addr: str = "0.0.0.0") -> None:
+    """Standalone /metrics HTTP server (Celery workers)."""
+    from prometheus_client import start_http_server
+    start_http_server(port, addr=addr, registry=_registry())
+    logger.info("metrics_exporter_started: %s:%s", addr, port)
+
+
+def mark_process_dead(pid: int) -> None:
+    if multiprocess_enabled():
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(pid)
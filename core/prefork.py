@@ -0,0 +1,64 @@
+# core/prefork.py
+"""
+Pre-fork warm state for gunicorn (`preload_app`) and Celery prefork workers.
+
+- `warm_shared_state()` runs once in the parent, before workers are forked. It
+  only builds immutable state: engine backends imported, Poppins TTFs parsed and
+  registered, report styles, decoded logo, normalized vices index. No thread, no
+  socket. The objects are then `gc.freeze()`-d so the children's collector never
+  writes to their pages: they stay shared copy-on-write across workers.
+- `reset_after_fork()` runs in each child. Connection-holding objects (OpenAI /
+  Mistral / boto3 clients, Redis pools and the Lua scripts bound to them) are
+  dropped; each worker re-creates its own on first use or during its warm-up.
+
+Modules that cache such an object register its reset with `@after_fork`.
+
+Wiring: gunicorn.conf.py (`when_ready` / `post_fork`) and celery_app.py
+(`worker_init` / `worker_process_init`). PREFORK_WARM=false disables the parent step.
+"""
+from __future__ import annotations
+
+import gc
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, List
+
+from core.config import Config
+
+logger = logging.getLogger("pioui.prefork")
+
+_after_fork: List[Callable[[], None]] = []
+
+
+def after_fork(fn: Callable[[], None]) -> Callable[[], None]:
+    """Registers `fn` to be called in every forked child by `reset_after_fork` (decorator)."""
+    _after_fork.append(fn)
+    return fn
+
+
+def warm_shared_state() -> Dict[str, Any]:
+    """Builds the fork-safe immutable state in the current (parent) process."""
+    if not Config.PREFORK_WARM:
+        return {"skipped": True}
+    t0 = time.perf_counter()
+    from services.reporting import engine
+    info = engine.preload()
+    # everything allocated so far moves to the permanent generation: no refcount-free
+    # GC pass in a child will touch (and copy) those pages
+    gc.collect()
+    gc.freeze()
+    info.update(pid=os.getpid(), seconds=round(time.perf_counter() - t0, 3), frozen=gc.get_freeze_count())
+    logger.info("prefork_warm", extra=info)
+    return info
+
+
+def reset_after_fork() -> None:
+    """Drops, in a freshly forked child, every object holding a connection inherited from the parent."""
+    from core.redis_client import reset_redis_clients
+    reset_redis_clients()
+    for fn in list(_after_fork):
+        try:
+            fn()
+        except Exception as e:
+            logger.warning("after_fork_failed: %s: %s", getattr(fn, "__qualname__", fn), e)
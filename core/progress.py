@@ -0,0 +1,63 @@
+# core/progress.py
+"""
+Job progress events, pushed from the Celery workers to the API over Redis pub/sub.
+
+Each event is published on `pioui:progress:{task_id}` and also kept as the task's
+last event (short TTL), so a client that subscribes late still gets the current
+state right away. Stages, in order: queued, extracting, llm, rendering, uploading,
+then a terminal done / failed. Publishing never raises: progress is best effort.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import time
+from typing import Any, Dict, Optional
+
+from core.config import Config
+from core.redis_client import get_redis
+
+logger = logging.getLogger("pioui.progress")
+
+STAGES = ("queued", "extracting", "llm", "rendering", "uploading", "done", "failed")
+TERMINAL_STAGES = ("done", "failed")
+
+
+def channel(task_id: str) -> str:
+    return f"pioui:progress:{task_id}"
+
+
+def _last_key(task_id: str) -> str:
+    return f"pioui:progress:{task_id}:last"
+
+
+def make_event(task_id: str, stage: str, **data: Any) -> Dict[str, Any]:
+    return {"task_id": task_id, "stage": stage, "ts": round(time.time(), 3), **data}
+
+
+def publish(task_id: Optional[str], stage: str, **data: Any) -> None:
+    """Publishes one stage event for `task_id` (no-op without a task id)."""
+    if not task_id:
+        return
+    payload = json.dumps(make_event(task_id, stage, **data), separators=(",", ":"), default=str)
+    try:
+        pipe = get_redis().pipeline()
+        pipe.set(_last_key(task_id), payload, ex=Config.PROGRESS_TTL)
+        pipe.publish(channel(task_id), payload)
+        pipe.execute()
+    except Exception as e:
+        logger.warning("progress_publish_failed: %s %s: %s", task_id, stage, e)
+
+
+def last_event(task_id: str) -> Optional[Dict[str, Any]]:
+    try:
+        raw = get_redis().get(_last_key(task_id))
+    except Exception as e:
+        logger.warning("progress_read_failed: %s: %s", task_id, e)
+        return None
+    return json.loads(raw) if raw else None
+
+
+def stage_callback(task_id: Optional[str]):
+    """`on_stage` callable for the engine `analyze_*` functions."""
+    return lambda stage: publish(task_id, stage)
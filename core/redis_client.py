@@ -0,0 +1,34 @@
+# core/redis_client.py
+"""Shared Redis clients, created lazily (one connection pool per URL and per process)."""
+from __future__ import annotations
+
+import threading
+from typing import Dict, Optional
+
+from core.config import Config
+
+_clients: Dict[str, "object"] = {}
+_lock = threading.Lock()
+
+
+def get_redis(url: Optional[str] = None):
+    """Returns a `redis.Redis` bound to `url` (default: Config.REDIS_URL)."""
+    import redis
+
+    url = url or Config.REDIS_URL
+    with _lock:
+        cli = _clients.get(url)
+        if cli is None:
+            cli = redis.Redis.from_url(
+                url,
+                socket_timeout=Config.REDIS_SOCKET_TIMEOUT,
+                socket_connect_timeout=Config.REDIS_SOCKET_TIMEOUT,
+            )
+            _clients[url] = cli
+        return cli
+
+
+def reset_redis_clients() -> None:
+    """Drops cached clients (call after fork: sockets must not be shared between processes)."""
+    with _lock:
+        _clients.clear()
@@ -0,0 +1,36 @@
+# gunicorn.conf.py
+"""
+Gunicorn settings for the API (Dockerfile: `gunicorn -c gunicorn.conf.py api.app:app`).
+
+preload_app: the master imports api.app and builds the engine's immutable state
+(core/prefork.py) once; workers are forked from it and share those pages
+copy-on-write instead of each importing and parsing everything again. Each
+worker then drops the connections it inherited and starts its own warm-up
+(LLM clients, render processes) — see `post_fork`.
+"""
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() == "true"
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+
+
+def when_ready(server):
+    # master, app already loaded (preload_app), before the first fork
+    if preload_app:
+        from core import prefork
+        info = prefork.warm_shared_state()
+        server.log.info("prefork warm state: %s", info)
+
+
+def post_fork(server, worker):
+    from core import prefork
+    prefork.reset_after_fork()
+
+
+def child_exit(server, worker):
+    from core import metrics
+    metrics.mark_process_dead(worker.pid)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+bench_delivery.py — response size & serialization time: Base64-in-JSON vs multipart/mixed vs ZIP.
+
+Usage (from the repo root):
+  python scripts/bench_delivery.py                       # synthetic 250 KB PDFs
+  python scripts/bench_delivery.py full.pdf anon.pdf     # real reports (e.g. saved from the API)
+  python scripts/bench_delivery.py --size 600000 -n 500
+
+"encode" is our side (build the HTTP body), "decode" is the client side (get the PDF bytes back).
+"""
+import argparse
+import base64
+import email.parser
+import email.policy
+import io
+import json
+import os
+import sys
+import time
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.delivery import encode_json, encode_multipart, encode_zip, report_meta  # noqa: E402
+
+
+def _timeit(fn, n: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - t0) * 1000.0 / n
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("pdfs", nargs="*", help="non-anonymous and anonymous PDF (optional)")
+    ap.add_argument("--size", type=int, default=250_000, help="synthetic PDF size in bytes")
+    ap.add_argument("-n", type=int, default=200, help="iterations per measurement")
+    args = ap.parse_args()
+
+    if len(args.pdfs) >= 2:
+        non_anon, anon = (open(p, "rb").read() for p in args.pdfs[:2])
+    else:
+        # compressed PDF streams are close to incompressible: random bytes are a fair stand-in
+        non_anon, anon = b"%PDF-1.4\n" + os.urandom(args.size), b"%PDF-1.4\n" + os.urandom(args.size)
+
+    ids = {"user_id": 123, "invoice_id": 456, "external_ref": "ABC-2025-09"}
+    highlights = ["Économies potentielles : jusqu’à ~120 €/an.", "Vices cachés majeurs : RAS."]
+
+    def enc_json():
+        return json.dumps(encode_json(highlights=highlights, non_anon=non_anon, anon=anon, **ids)).encode()
+
+    def enc_multipart():
+        meta = report_meta(highlights=highlights, non_anon=non_anon, anon=anon, **ids)
+        return encode_multipart(meta, non_anon, anon)
+
+    def enc_zip():
+        meta = report_meta(highlights=highlights, non_anon=non_anon, anon=anon, **ids)
+        return encode_zip(meta, non_anon, anon)
+
+    json_body = enc_json()
+    mp_body, boundary = enc_multipart()
+    zip_body = enc_zip()
+
+    def dec_json():
+        d = json.loads(json_body)
+        return base64.b64decode(d["non_anonymous_report_base64"]), base64.b64decode(d["anonymous_report_base64"])
+
+    def dec_multipart():
+        head = f'Content-Type: multipart/mixed; boundary="{boundary}"\r\n\r\n'.encode()
+        msg = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(head + mp_body)
+        return [p.get_payload(decode=True) for p in msg.iter_parts()]
+
+    def dec_zip():
+        with zipfile.ZipFile(io.BytesIO(zip_body)) as zf:
+            return [zf.read(n) for n in zf.namelist()]
+
+    raw = len(non_anon) + len(anon)
+    print(f"PDF payload: {raw} bytes (2 reports), n={args.n}\n")
+    print(f"{'mode':<16}{'bytes':>12}{'vs raw':>9}{'encode ms':>12}{'decode ms':>12}")
+    for name, body, enc, dec in (
+        ("json+base64", json_body, enc_json, dec_json),
+        ("multipart/mixed", mp_body, enc_multipart, dec_multipart),
+        ("zip (stored)", zip_body, enc_zip, dec_zip),
+    ):
+        print(f"{name:<16}{len(body):>12}{len(body) / raw:>8.1%}{_timeit(enc, args.n):>12.3f}{_timeit(dec, args.n):>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
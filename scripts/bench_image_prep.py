@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+bench_image_prep.py — per-image budget before / after services/reporting/imageprep.py.
+
+Usage (from the repo root):
+  python scripts/bench_image_prep.py                          # synthetic 200-dpi scan page + 12 MP photo
+  python scripts/bench_image_prep.py photo.jpg page.png --profile pixtral --grayscale
+
+"before" is what was sent until now: the raw file, Base64-encoded (tokens: what the
+provider bills after its own resize). "after" is the prepared image. Tokens are the
+estimates from imageprep.estimate_tokens.
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.reporting import imageprep  # noqa: E402
+
+
+def synthetic_inputs():
+    from PIL import Image, ImageDraw
+
+    page = Image.new("RGB", (1654, 2339), "white")
+    d = ImageDraw.Draw(page)
+    for y in range(250, 2100, 36):
+        d.text((160, y), f"Consommation {y} kWh  -  Total TTC 98,68 EUR  -  PDL 1234567890", fill="black")
+    png = io.BytesIO()
+    page.save(png, "PNG")
+
+    # phone photo: 4032x3024 landscape sensor, EXIF orientation 6 (rotated 90 degrees), grey desk around the sheet
+    photo = Image.new("RGB", (4032, 3024), (96, 92, 88))
+    sheet = page.resize((2100, 2970)).rotate(90, expand=True)
+    photo.paste(sheet, (500, 30))
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    jpg = io.BytesIO()
+    photo.save(jpg, "JPEG", quality=92, exif=exif.tobytes())
+    return [("scan-page-200dpi.png", png.getvalue()), ("photo-12mp.jpg", jpg.getvalue())]
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("images", nargs="*")
+    ap.add_argument("--profile", choices=sorted(imageprep.PROFILES), default="openai")
+    ap.add_argument("--format", default=None, help="auto | jpeg | webp | png (default IMAGE_PREP_FORMAT)")
+    ap.add_argument("--quality", type=int, default=None)
+    ap.add_argument("--grayscale", action="store_true")
+    args = ap.parse_args()
+
+    from PIL import Image
+
+    inputs = [(os.path.basename(p), open(p, "rb").read()) for p in args.images] or synthetic_inputs()
+    prof = imageprep.PROFILES[args.profile]
+    print(f"profile {args.profile}: long side <= {prof.max_long}, short side <= {prof.max_short}")
+    for name, data in inputs:
+        with Image.open(io.BytesIO(data)) as im:
+            raw_size = im.size
+        t0 = time.perf_counter()
+        out = imageprep.prepare_image(data, args.profile, fmt=args.format, quality=args.quality,
+                                      grayscale=args.grayscale or None)
+        ms = (time.perf_counter() - t0) * 1000
+        before_tokens = imageprep.estimate_tokens(imageprep.target_size(raw_size, prof), prof)
+        print(f"{name}")
+        print(f"  before  {raw_size[0]:5d}x{raw_size[1]:<5d} {len(data) / 1024:8.0f} KiB  "
+              f"Base64 {len(data) * 4 / 3 / 1024:8.0f} KiB  ~{before_tokens:5d} tokens")
+        print(f"  after   {out.size[0]:5d}x{out.size[1]:<5d} {len(out.data) / 1024:8.0f} KiB  "
+              f"Base64 {len(out.data) * 4 / 3 / 1024:8.0f} KiB  ~{out.tokens:5d} tokens  ({out.mime}, {ms:.0f} ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+bench_page_selection.py — which pages of a PDF go to the LLM, and how much prompt is saved
+by page selection, then by prompt compaction (services/reporting/compaction.py).
+
+Usage (from the repo root):
+  python scripts/bench_page_selection.py invoice1.pdf invoice2.pdf ...
+  python scripts/bench_page_selection.py --top-k 2 --min-score 20 samples/*.pdf
+  python scripts/bench_page_selection.py --budget 1500 samples/*.pdf   # PROMPT_TOKEN_BUDGET
+
+Text-layer PDFs only (scanned pages are scored on their OCR text at run time).
+Tokens are estimated at ~4 characters per token for French text.
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "bench-page-selection")
+
+from services.reporting import compaction, engine  # noqa: E402
+from services.reporting.backends import text as text_backend  # noqa: E402
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("pdfs", nargs="+")
+    ap.add_argument("--top-k", type=int, default=None, help="default PAGE_SELECT_TOP_K")
+    ap.add_argument("--min-score", type=float, default=None, help="default PAGE_SELECT_MIN_SCORE")
+    ap.add_argument("--budget", type=int, default=None, help="default PROMPT_TOKEN_BUDGET (0 = none)")
+    args = ap.parse_args()
+
+    total_all = total_sent = total_compact = 0
+    for path in args.pdfs:
+        pages = text_backend.extract_pages_text(path)
+        if not any(pages):
+            print(f"{path}: no text layer, skipped")
+            continue
+        keep, confident = engine.select_relevant_pages(pages, top_k=args.top_k, min_score=args.min_score)
+        n_all = sum(len(p) for p in pages)
+        n_sent = sum(len(pages[i]) for i in keep)
+        compact = compaction.compact_text("\n".join(pages[i] for i in keep if pages[i]), budget=args.budget)
+        total_all += n_all
+        total_sent += n_sent
+        total_compact += compact.tokens_after
+        print(f"{path}: {len(keep)}/{len(pages)} pages, ~{n_sent // 4} / ~{n_all // 4} prompt tokens, "
+              f"~{compact.tokens_after} after compaction{'' if confident else '  (low confidence)'}")
+    if total_all:
+        print(f"\ntotal: ~{total_sent // 4} / ~{total_all // 4} tokens sent ({100 - 100 * total_sent / total_all:.0f}% saved), "
+              f"~{total_compact} after compaction ({100 - 400 * total_compact / total_all:.0f}% saved)")
+
+
+if __name__ == "__main__":
+    main()
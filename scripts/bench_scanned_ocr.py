@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+bench_scanned_ocr.py — OCR fallback of a scanned PDF: wall time vs per-invoice parallelism.
+
+Usage (from the repo root):
+  python scripts/bench_scanned_ocr.py                        # synthetic 6-page scan, 2 s per vision call
+  python scripts/bench_scanned_ocr.py scan.pdf --latency 4 --parallel 1 2 4 8
+
+The vision model is simulated (sleep `--latency` seconds, +/-30% jitter, per page) so the
+numbers isolate our side: page rendering, PNG encoding and scheduling. With enough
+parallelism the wall time approaches the slowest single page plus the rendering of the first.
+"serial" is the original behaviour: every page rasterized first, PNG-encoded, then one
+call at a time.
+"pages alive" is the largest number of rendered page images held at once.
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "bench-scanned-ocr")
+
+from core.config import Config  # noqa: E402
+from services.reporting import engine, imageprep  # noqa: E402
+from services.reporting.backends import vision  # noqa: E402
+
+
+def synthetic_scan(pages: int) -> bytes:
+    """A PDF made of full-page raster images (no text layer), like a scanner output."""
+    from PIL import Image, ImageDraw
+    images = []
+    for i in range(pages):
+        im = Image.new("RGB", (1654, 2339), "white")
+        d = ImageDraw.Draw(im)
+        for y in range(200, 2200, 40):
+            d.text((150, y), f"Page {i + 1} - ligne {y} - consommation 1234 kWh - total 98,68 EUR", fill="black")
+        images.append(im)
+    buf = io.BytesIO()
+    images[0].save(buf, "PDF", save_all=True, append_images=images[1:], resolution=200)
+    return buf.getvalue()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("pdf", nargs="?", help="scanned PDF (default: synthetic)")
+    ap.add_argument("--pages", type=int, default=6, help="pages of the synthetic scan")
+    ap.add_argument("--latency", type=float, default=2.0, help="simulated seconds per vision call")
+    ap.add_argument("--parallel", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = ap.parse_args()
+
+    data = open(args.pdf, "rb").read() if args.pdf else synthetic_scan(args.pages)
+    rng = random.Random(42)
+
+    lock = threading.Lock()
+    alive = {"now": 0, "max": 0}
+
+    def fake_ocr(image) -> str:
+        time.sleep(args.latency * rng.uniform(0.7, 1.3))
+        return f"{len(bytes(getattr(image, 'data', image)))} octets"
+
+    render = engine._backend("text").iter_pdf_pages
+
+    def counted_pages(pdf, dpi=200, pages=None):
+        # a page counts as alive from its rendering until it has been prepared for the model
+        for page in render(pdf, dpi=dpi, pages=pages):
+            with lock:
+                alive["now"] += 1
+                alive["max"] = max(alive["max"], alive["now"])
+            yield page
+
+    def counted_prepare(page, profile):
+        out = prepare(page, profile)
+        with lock:
+            alive["now"] -= 1
+        return out
+
+    prepare = imageprep.prepare
+    vision.ocr_invoice_with_gpt = fake_ocr
+    Config.TESSERACT_ENABLED = False  # every page goes to the (simulated) vision model
+
+    t0 = time.perf_counter()
+    pages = engine.rasterize_pdf_pages(data, dpi=200)
+    for page in pages:
+        fake_ocr(imageprep._png(page))
+    print(f"serial       wall {time.perf_counter() - t0:6.2f} s   pages alive {len(pages):3d}")
+    del pages
+
+    engine._backend("text").iter_pdf_pages = counted_pages
+    imageprep.prepare = counted_prepare
+    for cap in args.parallel:
+        alive.update(now=0, max=0)
+        t0 = time.perf_counter()
+        engine.ocr_scanned_pdf(data, dpi=200, max_parallel=cap)
+        print(f"parallel {cap:2d}  wall {time.perf_counter() - t0:6.2f} s   pages alive {alive['max']:3d}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+bench_text_extraction.py — PDF text layer: ms per page per extractor, and what changes for the regex parsers.
+
+Usage (from the repo root):
+  python scripts/bench_text_extraction.py uploads/                  # every *.pdf of a directory
+  python scripts/bench_text_extraction.py a.pdf b.pdf -n 5 --workers 4
+
+Per file, each extractor of services/reporting/backends/text.py is timed (best of -n
+runs, in-process). The candidate (default pymupdf) is then compared with the reference
+(default pdfplumber) on what the engine actually reads from the text:
+  - PDL / PCE numbers, kWh and TTC matches (page selection hints);
+  - page_relevance scores and the pages select_relevant_pages keeps;
+  - detect_energy_signals decision and derive_consumptions_from_text (30-day period).
+"sim" is the difflib ratio of the two texts (1.0 = identical); a lower value with no
+listed difference is line wrapping / spacing only.
+With --workers, the candidate is also timed with process-parallel page extraction.
+"""
+import argparse
+import difflib
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "bench-text-extraction")
+
+from core.config import Config  # noqa: E402
+from services.reporting import engine  # noqa: E402
+from services.reporting.backends import text as text_backend  # noqa: E402
+
+
+def pdf_paths(args) -> list:
+    out = []
+    for p in args:
+        if os.path.isdir(p):
+            out += sorted(os.path.join(p, f) for f in os.listdir(p) if f.lower().endswith(".pdf"))
+        else:
+            out.append(p)
+    return out
+
+
+def best_ms(fn, runs: int) -> float:
+    best = float("inf")
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+
+def parsed_view(pages: list) -> dict:
+    """What the regex side of the engine sees in this text."""
+    joined = "\n".join(t for t in pages if t)
+    return {
+        "pdl/pce": sorted(set(engine._PDL_PCE_RX.findall(joined))),
+        "kwh hits": len(engine._KWH_RX.findall(joined)),
+        "ttc hits": len(engine._TTC_RX.findall(joined)),
+        "relevance": [round(engine.page_relevance(t)) for t in pages],
+        "pages kept": engine.select_relevant_pages(pages)[0],
+        "energies": sorted(engine.detect_energy_signals(joined)["decision"]),
+        "kwh elec": engine.derive_consumptions_from_text(joined, "electricite", 30),
+        "kwh gaz": engine.derive_consumptions_from_text(joined, "gaz", 30),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("pdfs", nargs="+", help="PDF files or directories")
+    ap.add_argument("-n", "--runs", type=int, default=3)
+    ap.add_argument("--candidate", default="pymupdf", choices=sorted(text_backend.EXTRACTORS))
+    ap.add_argument("--reference", default="pdfplumber", choices=sorted(text_backend.EXTRACTORS))
+    ap.add_argument("--workers", type=int, default=0, help="also time process-parallel extraction")
+    args = ap.parse_args()
+
+    names = [args.candidate, args.reference]
+    totals = {n: 0.0 for n in names}
+    total_pages = n_diff = 0
+    for path in pdf_paths(args.pdfs):
+        data = open(path, "rb").read()
+        texts, line = {}, []
+        for name in names:
+            ex = text_backend.EXTRACTORS[name]
+            texts[name] = ex.pages(data)
+            ms = best_ms(lambda: ex.pages(data), args.runs)
+            totals[name] += ms
+            line.append(f"{name} {ms / max(1, len(texts[name])):6.1f} ms/page")
+        n_pages = len(texts[args.reference])
+        total_pages += n_pages
+        if args.workers:
+            Config.TEXT_EXTRACT_WORKERS, Config.TEXT_EXTRACT_PARALLEL_MIN_PAGES = args.workers, 1
+            ms = best_ms(lambda: text_backend.extract_pages_text(data, args.candidate), args.runs)
+            line.append(f"{args.candidate} x{args.workers} {ms / max(1, n_pages):6.1f} ms/page")
+        cand, ref = texts[args.candidate], texts[args.reference]
+        sim = difflib.SequenceMatcher(None, "\n".join(cand), "\n".join(ref), autojunk=False).ratio()
+        print(f"{path} ({n_pages} p.): " + "   ".join(line) + f"   sim {sim:.3f}")
+        vc, vr = parsed_view(cand), parsed_view(ref)
+        diffs = [k for k in vr if vc[k] != vr[k]]
+        n_diff += bool(diffs)
+        for k in diffs:
+            print(f"    {k:10} {args.candidate}: {vc[k]}   {args.reference}: {vr[k]}")
+
+    if total_pages:
+        print(f"\n{total_pages} pages: " + "   ".join(f"{n} {totals[n] / total_pages:.1f} ms/page" for n in names)
+              + f"   {n_diff} file(s) with a difference for the parsers")
+
+
+if __name__ == "__main__":
+    main()
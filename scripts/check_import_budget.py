@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+check_import_budget.py — import-time regression check (`python -X importtime`).
+
+Usage (from the repo root):
+  python scripts/check_import_budget.py              # exit 1 if a budget is exceeded
+  python scripts/check_import_budget.py --scale 2    # slow CI runner: budgets x2
+  python scripts/check_import_budget.py -v           # also list the 10 slowest imports
+
+Two checks per entry point, each in a fresh interpreter:
+- forbidden modules: heavy backends (LLM SDKs, ReportLab, pdfplumber, boto3) must not
+  be imported at module load — they are loaded on first use. Deterministic.
+- time budget: cumulative import time of the module (best of -n runs), in ms.
+"""
+import argparse
+import os
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY = ("openai", "instructor", "mistralai", "reportlab", "pdfplumber", "pdf2image", "boto3", "botocore")
+
+# module -> (budget ms, forbidden top-level packages)
+BUDGETS: Dict[str, Tuple[float, Tuple[str, ...]]] = {
+    "services.reporting.engine": (250, HEAVY),
+    "tasks": (700, HEAVY),
+    "celery_app": (600, HEAVY),
+    "api.app": (1200, HEAVY),
+    "services.reporting.backends.text": (800, HEAVY),
+    # instructor itself pulls mistralai and boto3 (provider modules)
+    "services.reporting.backends.vision": (2500, ("reportlab", "pdfplumber", "pdf2image")),
+    "services.reporting.backends.tesseract": (500, HEAVY),
+    "services.reporting.backends.pixtral": (1500, tuple(m for m in HEAVY if m != "mistralai")),
+    "services.reporting.backends.render": (1500, tuple(m for m in HEAVY if m != "reportlab")),
+}
+
+
+def importtime(module: str) -> List[Tuple[str, int, int]]:
+    """[(module, self us, cumulative us)] as reported by -X importtime in a fresh interpreter."""
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    env.setdefault("OPENAI_API_KEY", "import-budget-check")
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                         cwd=ROOT, env=env, capture_output=True, text=True)
+    if out.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{out.stderr[-2000:]}")
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def check(module: str, budget_ms: float, forbidden: Tuple[str, ...], runs: int, verbose: bool) -> List[str]:
+    errors = []
+    best_ms, rows = None, []
+    for _ in range(runs):
+        rows = importtime(module)
+        total = next((cum for name, _, cum in rows if name == module), 0) / 1000.0
+        best_ms = total if best_ms is None else min(best_ms, total)
+    loaded = {name.split(".")[0] for name, _, _ in rows}
+    leaked = sorted(set(forbidden) & loaded)
+    status = "ok" if best_ms <= budget_ms and not leaked else "FAIL"
+    print(f"{status:4}  {module:<38} {best_ms:8.1f} ms / {budget_ms:6.0f} ms"
+          + (f"   heavy imports: {', '.join(leaked)}" if leaked else ""))
+    if verbose:
+        for name, self_us, _ in sorted(rows, key=lambda r: -r[1])[:10]:
+            print(f"        {self_us / 1000.0:8.1f} ms  {name}")
+    if leaked:
+        errors.append(f"{module} imports {', '.join(leaked)} at load time")
+    if best_ms > budget_ms:
+        errors.append(f"{module} takes {best_ms:.0f} ms to import (budget {budget_ms:.0f} ms)")
+    return errors
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("modules", nargs="*", help="subset of the checked modules")
+    ap.add_argument("-n", type=int, default=3, help="runs per module (the best one counts)")
+    ap.add_argument("--scale", type=float, default=1.0, help="multiply every time budget")
+    ap.add_argument("-v", "--verbose", action="store_true")
+    args = ap.parse_args()
+
+    errors = []
+    for module, (budget_ms, forbidden) in BUDGETS.items():
+        if args.modules and module not in args.modules:
+            continue
+        errors += check(module, budget_ms * args.scale, forbidden, args.n, args.verbose)
+    if errors:
+        print("\n".join(["", "Import budget exceeded:"] + [f"  - {e}" for e in errors]))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
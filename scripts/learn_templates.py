@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+learn_templates.py — generate supplier layout templates from invoices the LLM parsed successfully.
+
+Usage (from the repo root):
+  python scripts/learn_templates.py factures/                    # facture.pdf + facture.json (parsed output)
+  python scripts/learn_templates.py --llm factures/*.pdf          # parse_text_with_gpt when there is no JSON
+  python scripts/learn_templates.py --min-samples 3 --dry-run factures/
+
+The parse of each PDF is read from the JSON next to it (the engine's `parsed` object,
+or an API response holding one), or produced by parse_text_with_gpt with --llm.
+Invoices without a single energy, a TTC total and kWh are skipped.
+
+PDFs are grouped by layout key (services/reporting/templates.py). A group with at
+least --min-samples invoices gives one template: field boxes merged over the samples,
+fields or anchors that disagree dropped. It is written to TEMPLATE_DIR (--out) only
+if it reads every required field of every sample exactly as the LLM did.
+"""
+import argparse
+import json
+import os
+import sys
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "learn-templates")
+
+from core.config import Config  # noqa: E402
+from services.reporting import engine, templates  # noqa: E402
+from services.reporting.backends import text as text_backend  # noqa: E402
+
+
+def pdf_paths(args) -> list:
+    out = []
+    for p in args:
+        if os.path.isdir(p):
+            out += sorted(os.path.join(p, f) for f in os.listdir(p) if f.lower().endswith(".pdf"))
+        else:
+            out.append(p)
+    return out
+
+
+def load_parsed(path: str, use_llm: bool):
+    sidecar = os.path.splitext(path)[0] + ".json"
+    if os.path.exists(sidecar):
+        with open(sidecar, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data.get("parsed", data) if isinstance(data, dict) else None
+    if not use_llm:
+        return None
+    from services.reporting.backends import vision
+    pages = text_backend.extract_pages_text(path)
+    keep, _ = engine.select_relevant_pages(pages)
+    return json.loads(vision.parse_text_with_gpt("\n".join(pages[i] for i in keep if pages[i]).strip()))
+
+
+def usable(parsed) -> bool:
+    energies = (parsed or {}).get("energies") or []
+    return len(energies) == 1 and bool(energies[0].get("total_ttc")) and bool(energies[0].get("conso_kwh"))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("pdfs", nargs="+", help="PDF files or directories")
+    ap.add_argument("--llm", action="store_true", help="parse with GPT the PDFs that have no JSON")
+    ap.add_argument("--min-samples", type=int, default=2, help="invoices of a layout needed for a template")
+    ap.add_argument("--out", default=Config.TEMPLATE_DIR, help="default TEMPLATE_DIR")
+    ap.add_argument("--dry-run", action="store_true", help="report only, write nothing")
+    args = ap.parse_args()
+
+    groups = defaultdict(list)  # layout key -> [(path, layout, parsed, template)]
+    for path in pdf_paths(args.pdfs):
+        try:
+            parsed = load_parsed(path, args.llm)
+        except Exception as e:
+            print(f"{path}: parse failed ({type(e).__name__}: {e}), skipped")
+            continue
+        if not usable(parsed):
+            print(f"{path}: no usable parse (single energy, TTC and kWh), skipped")
+            continue
+        layout = text_backend.page_layout(path, max_pages=Config.TEMPLATE_MAX_PAGES)
+        t, missing = templates.learn(layout, parsed)
+        if t is None:
+            print(f"{path}: no text layer or several energies, skipped")
+            continue
+        print(f"{path}: layout {t.key} ({t.supplier}, {t.energy})"
+              f"{'' if not missing else ', not found: ' + ', '.join(missing)}")
+        groups[t.key].append((path, layout, parsed, t))
+
+    written = 0
+    for key, samples in groups.items():
+        if len(samples) < args.min_samples:
+            print(f"\nlayout {key}: {len(samples)} sample(s) < --min-samples {args.min_samples}, no template")
+            continue
+        combined = templates.combine([s[3] for s in samples])
+        absent = [p for p in combined.required if p not in combined.fields and p not in combined.constants]
+        errors = {path: templates.check(combined, layout, parsed) for path, layout, parsed, _ in samples}
+        failed = {p: e for p, e in errors.items() if e}
+        print(f"\nlayout {key} ({combined.supplier}, {combined.energy}): {len(samples)} samples, "
+              f"{len(combined.fields)} fields, {sum(a['fixed'] for a in combined.anchors.values())} fixed anchors")
+        if absent:
+            print(f"  no rule for: {', '.join(absent)} -> no template")
+            continue
+        for p, e in failed.items():
+            print(f"  {p}: read differently: {', '.join(e)}")
+        if failed:
+            print("  -> no template")
+            continue
+        if args.dry_run:
+            print(f"  -> would write {os.path.join(args.out, templates.template_filename(combined))}")
+        else:
+            print(f"  -> {templates.save(combined, args.out)}")
+            written += 1
+    print(f"\n{written} template(s) written")
+
+
+if __name__ == "__main__":
+    main()
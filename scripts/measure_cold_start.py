@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+measure_cold_start.py — API cold start: import time, time to /healthz and time to /readyz.
+
+Usage (from the repo root, .env loaded as for uvicorn):
+  python scripts/measure_cold_start.py                      # 3 runs, STARTUP_WARMUP=background
+  python scripts/measure_cold_start.py -n 5 --warmup blocking
+  python scripts/measure_cold_start.py --import-only
+
+Each run starts a fresh `uvicorn api.app:app` on a free port and polls until
+/healthz (process serving) and /readyz (engine, fonts, LLM clients, render pool
+warm) answer 200. Spaces / Redis are optional for /readyz, so a dev box without
+them still gets a number.
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _ok(url: str) -> bool:
+    try:
+        with urllib.request.urlopen(url, timeout=1) as r:
+            return r.status == 200
+    except (urllib.error.URLError, OSError):
+        return False
+
+
+def import_time(module: str = "api.app") -> float:
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def one_run(warmup: str, timeout: float) -> tuple:
+    port = _free_port()
+    env = dict(os.environ, STARTUP_WARMUP=warmup, PYTHONPATH=ROOT)
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api.app:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    healthz = readyz = None
+    try:
+        while time.perf_counter() - t0 < timeout:
+            if proc.poll() is not None:
+                raise RuntimeError(f"uvicorn exited with code {proc.returncode}")
+            now = time.perf_counter() - t0
+            if healthz is None and _ok(f"http://127.0.0.1:{port}/healthz"):
+                healthz = now
+            if healthz is not None and _ok(f"http://127.0.0.1:{port}/readyz"):
+                readyz = time.perf_counter() - t0
+                break
+            time.sleep(0.02)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+    return healthz, readyz
+
+
+def _fmt(values) -> str:
+    values = [v for v in values if v is not None]
+    if not values:
+        return "timeout"
+    return f"median {statistics.median(values):6.2f}s  min {min(values):6.2f}s  max {max(values):6.2f}s"
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("-n", type=int, default=3, help="number of cold starts")
+    ap.add_argument("--warmup", default="background", choices=("background", "blocking", "off"))
+    ap.add_argument("--timeout", type=float, default=120.0, help="seconds to wait for /readyz")
+    ap.add_argument("--import-only", action="store_true", help="only measure `import api.app` / engine")
+    args = ap.parse_args()
+
+    for module in ("api.app", "services.reporting.engine", "tasks"):
+        print(f"import {module:<28} {_fmt([import_time(module) for _ in range(args.n)])}")
+    if args.import_only:
+        return
+
+    runs = [one_run(args.warmup, args.timeout) for _ in range(args.n)]
+    print(f"STARTUP_WARMUP={args.warmup}")
+    print(f"  /healthz 200 after        {_fmt([h for h, _ in runs])}")
+    print(f"  /readyz  200 after        {_fmt([r for _, r in runs])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+measure_prefork.py — per-worker memory and first-request latency, with and without pre-fork warm state.
+
+Usage (from the repo root, Linux only: reads /proc/<pid>/smaps_rollup):
+  python scripts/measure_prefork.py            # 2 workers, both modes
+  python scripts/measure_prefork.py -w 4 --mode warm
+
+Mimics gunicorn's preload_app: a fresh parent imports api.app, then
+- warm: runs core.prefork.warm_shared_state() (engine backends, fonts, styles,
+  logo, vices index) before forking;
+- cold: forks right away (each worker loads the engine on its first request).
+Every child calls reset_after_fork(), times its first report render (synthetic
+invoice, no LLM call) and reports its USS (private pages) and PSS.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _smaps_kb(pid: int) -> dict:
+    out = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 3 and parts[2] == "kB":
+                out[parts[0].rstrip(":")] = int(parts[1])
+    return out
+
+
+def _first_request() -> float:
+    from services.reporting import engine
+    parsed = {"client": {"name": "Jean Test", "address": "1 rue de la Paix 75001 Paris", "zipcode": "75001"},
+              "periode": {"de": "01/01/2024", "a": "31/01/2024", "jours": 30},
+              "energies": [{"type": "electricite", "fournisseur": "EDF", "offre": "Tarif Bleu", "option": "Base",
+                            "puissance_kVA": 6, "conso_kwh": 300, "total_ttc": 80}]}
+    t0 = time.perf_counter()
+    params = engine.params_from_energy(parsed, parsed["energies"][0], "")
+    curr = engine.current_annual_total(params)
+    sections = [{"params": params, "rows": engine.make_base_offers(params, curr) + engine.make_hphc_offers(params, curr)}]
+    engine.build_pdfs(parsed, sections, [], variants="both")
+    return time.perf_counter() - t0
+
+
+def _parent(mode: str, workers: int) -> None:
+    """Runs in a fresh interpreter: import the app, optionally warm, fork the workers."""
+    import api.app  # noqa: F401  (what gunicorn's preload_app does)
+    from core import prefork
+    if mode == "warm":
+        prefork.warm_shared_state()
+    children = []
+    for _ in range(workers):
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(r)
+            prefork.reset_after_fork()
+            first = _first_request()
+            mem = _smaps_kb(os.getpid())
+            os.write(w, json.dumps({"first_request_s": first,
+                                    "uss_kb": mem.get("Private_Clean", 0) + mem.get("Private_Dirty", 0),
+                                    "pss_kb": mem.get("Pss", 0)}).encode())
+            os.close(w)
+            time.sleep(1.0)  # stay alive while the siblings measure: shared pages stay shared
+            os._exit(0)
+        os.close(w)
+        children.append((pid, r))
+    results = []
+    for pid, r in children:
+        with os.fdopen(r) as f:
+            results.append(json.loads(f.read()))
+        os.waitpid(pid, 0)
+    print(json.dumps(results))
+
+
+def run(mode: str, workers: int) -> list:
+    env = dict(os.environ, PYTHONPATH=ROOT, ENGINE_RENDER_WORKERS="0")
+    env.setdefault("OPENAI_API_KEY", "measure-prefork")
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), "--as-parent", mode, "-w", str(workers)],
+                         cwd=ROOT, env=env, capture_output=True, text=True)
+    if out.returncode != 0:
+        raise RuntimeError(f"{mode} run failed:\n{out.stderr[-2000:]}")
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("-w", "--workers", type=int, default=2)
+    ap.add_argument("--mode", choices=("both", "warm", "cold"), default="both")
+    ap.add_argument("--as-parent", choices=("warm", "cold"), help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.as_parent:
+        _parent(args.as_parent, args.workers)
+        return
+    for mode in (("cold", "warm") if args.mode == "both" else (args.mode,)):
+        res = run(mode, args.workers)
+        first = statistics.median(r["first_request_s"] for r in res)
+        uss = statistics.median(r["uss_kb"] for r in res) / 1024
+        pss = statistics.median(r["pss_kb"] for r in res) / 1024
+        print(f"{mode:5} x{args.workers}  first request {first * 1000:8.1f} ms   USS {uss:7.1f} MiB   PSS {pss:7.1f} MiB  (median per worker)")
+
+
+if __name__ == "__main__":
+    main()
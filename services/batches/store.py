@@ -0,0 +1,195 @@
+# services/batches/store.py
+"""
+Redis state for /v1/batches: one batch = N items (a PDF or a group of images),
+each processed by `process_batch_item_task` with its own Celery task id.
+
+Keys (all expire after BATCH_TTL):
+- pioui:batch:{id}          hash  — batch header (params, counters, status, webhook)
+- pioui:batch:{id}:items    hash  — index -> item JSON (spec + status + result metadata)
+- pioui:batch:{id}:pending  list  — indexes not dispatched yet
+- pioui:batch:{id}:done     hash  — index -> final status (HSETNX: an item is counted once)
+
+Parallelism is a sliding window: `max_parallel` items are dispatched at creation,
+then every finished item pops and dispatches the next one. An item redelivered by
+Celery (acks_late) or recorded by the watchdog (`sweep_batch_item_task`, worker killed)
+is counted only once. The item that brings `done` to `total` marks the batch complete
+(HSETNX, so exactly once) and the single batch webhook is sent from there.
+"""
+from __future__ import annotations
+
+import json
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from core.config import Config
+from core.redis_client import get_redis
+
+_PREFIX = "pioui:batch:"
+
+ITEM_QUEUED = "queued"
+ITEM_RUNNING = "running"
+ITEM_SUCCEEDED = "succeeded"
+ITEM_FAILED = "failed"
+
+
+def _k(batch_id: str, suffix: str = "") -> str:
+    return f"{_PREFIX}{batch_id}{suffix}"
+
+
+def _s(v) -> str:
+    return v.decode("utf-8") if isinstance(v, bytes) else v
+
+
+class BatchStore:
+    def __init__(self, *, ttl: int):
+        self.ttl = ttl
+
+    @classmethod
+    def from_config(cls) -> "BatchStore":
+        return cls(ttl=Config.BATCH_TTL)
+
+    @property
+    def r(self):
+        return get_redis()
+
+    # ——— creation ———
+    def create(self, items: List[Dict[str, Any]], *, params: Dict[str, Any], max_parallel: int,
+               webhook_url: Optional[str] = None, external_ref: Optional[str] = None) -> Dict[str, Any]:
+        """
+        `items`: [{'name', 'kind': 'pdf'|'images', 'paths': [...]}, ...].
+        Task ids are generated here so the item listing is complete before anything runs.
+        Returns the header; dispatching is left to the caller (`next_pending`).
+        """
+        batch_id = uuid.uuid4().hex
+        header = {
+            "batch_id": batch_id,
+            "status": "running",
+            "total": len(items),
+            "done": 0,
+            "succeeded": 0,
+            "failed": 0,
+            "max_parallel": max_parallel,
+            "params": json.dumps(params),
+            "webhook_url": webhook_url or "",
+            "external_ref": external_ref or "",
+            "created_at": time.time(),
+        }
+        encoded = {}
+        for i, it in enumerate(items):
+            encoded[str(i)] = json.dumps({
+                "index": i,
+                "name": it["name"],
+                "kind": it["kind"],
+                "paths": it["paths"],
+                "task_id": uuid.uuid4().hex,
+                "status": ITEM_QUEUED,
+            })
+        pipe = self.r.pipeline()
+        pipe.hset(_k(batch_id), mapping=header)
+        if encoded:
+            pipe.hset(_k(batch_id, ":items"), mapping=encoded)
+            pipe.rpush(_k(batch_id, ":pending"), *range(len(items)))
+        for suffix in ("", ":items", ":pending"):
+            pipe.expire(_k(batch_id, suffix), self.ttl)
+        pipe.execute()
+        return header
+
+    # ——— reads ———
+    def header(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        raw = self.r.hgetall(_k(batch_id))
+        if not raw:
+            return None
+        h = {_s(k): _s(v) for k, v in raw.items()}
+        for f in ("total", "done", "succeeded", "failed", "max_parallel"):
+            h[f] = int(h.get(f, 0))
+        h["params"] = json.loads(h.get("params") or "{}")
+        h["created_at"] = float(h["created_at"])
+        if h.get("completed_at"):
+            h["completed_at"] = float(h["completed_at"])
+        return h
+
+    def item(self, batch_id: str, index: int) -> Optional[Dict[str, Any]]:
+        raw = self.r.hget(_k(batch_id, ":items"), str(index))
+        return json.loads(raw) if raw else None
+
+    def items(self, batch_id: str, offset: int = 0, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        total = self.r.hlen(_k(batch_id, ":items"))
+        end = total if limit is None else min(total, offset + limit)
+        fields = [str(i) for i in range(offset, end)]
+        if not fields:
+            return []
+        return [json.loads(v) for v in self.r.hmget(_k(batch_id, ":items"), fields) if v]
+
+    # ——— item lifecycle (called from the workers) ———
+    def _save_item(self, batch_id: str, item: Dict[str, Any]) -> None:
+        self.r.hset(_k(batch_id, ":items"), str(item["index"]), json.dumps(item))
+
+    def next_pending(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        idx = self.r.lpop(_k(batch_id, ":pending"))
+        return self.item(batch_id, int(idx)) if idx is not None else None
+
+    def is_done(self, batch_id: str, index: int) -> bool:
+        return bool(self.r.hexists(_k(batch_id, ":done"), str(index)))
+
+    def mark_running(self, batch_id: str, item: Dict[str, Any]) -> None:
+        item.update(status=ITEM_RUNNING, started_at=time.time())
+        self._save_item(batch_id, item)
+
+    def mark_done(self, batch_id: str, item: Dict[str, Any], *, ok: bool,
+                  result: Optional[Dict[str, Any]] = None, error: Optional[str] = None) -> Tuple[bool, bool]:
+        """
+        Stores the item outcome, once. Returns (recorded, completed): `recorded` is False
+        when the item already had an outcome (redelivery, watchdog), `completed` is True
+        for the call that completes the batch.
+        """
+        status = ITEM_SUCCEEDED if ok else ITEM_FAILED
+        if not self.r.hsetnx(_k(batch_id, ":done"), str(item["index"]), status):
+            return False, False
+        self.r.expire(_k(batch_id, ":done"), self.ttl)
+        item.update(status=status, finished_at=time.time())
+        item.pop("paths", None)
+        if result:
+            item.update(result)
+        if error:
+            item["error"] = error
+        self._save_item(batch_id, item)
+
+        pipe = self.r.pipeline()
+        pipe.hincrby(_k(batch_id), "succeeded" if ok else "failed", 1)
+        pipe.hincrby(_k(batch_id), "done", 1)
+        pipe.hget(_k(batch_id), "total")
+        _, done, total = pipe.execute()
+        if int(done) < int(total or 0):
+            return True, False
+        # exactly one caller wins the completion
+        if not self.r.hsetnx(_k(batch_id), "completed_at", time.time()):
+            return True, False
+        header = self.header(batch_id)
+        self.r.hset(_k(batch_id), "status", "completed" if header["failed"] == 0 else "completed_with_errors")
+        return True, True
+
+    # ——— aggregate view ———
+    def summary(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        h = self.header(batch_id)
+        if h is None:
+            return None
+        pending = self.r.llen(_k(batch_id, ":pending"))
+        running = max(0, h["total"] - h["done"] - pending)
+        return {
+            "batch_id": batch_id,
+            "status": h["status"],
+            "total": h["total"],
+            "queued": pending,
+            "running": running,
+            "succeeded": h["succeeded"],
+            "failed": h["failed"],
+            "progress": round(h["done"] / h["total"], 3) if h["total"] else 1.0,
+            "max_parallel": h["max_parallel"],
+            "external_ref": h["external_ref"] or None,
+            "created_at": h["created_at"],
+            "completed_at": h.get("completed_at"),
+        }
+
+
+batch_store = BatchStore.from_config()
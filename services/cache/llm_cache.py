@@ -0,0 +1,227 @@
+# services/cache/llm_cache.py
+"""
+Persistent cache of LLM extraction responses (`parse_text_with_gpt`, `ocr_invoice_with_gpt`,
+`pixtral_extract_invoice`).
+
+The three calls run at temperature 0 (seed 42 for OpenAI): the same prompt gives the
+same answer. Celery's `autoretry_for` replays the whole task when only the webhook
+failed, and the same invoice is often analyzed again under another upload; both now
+reuse the stored response instead of paying for the call again.
+
+Key: call + model + prompt version (hash of the system prompt / instructions / schema,
+so a prompt change invalidates old entries) + sha256 of the normalized prompt text or of
+the image bytes actually sent (data URLs after imageprep).
+
+Tiers:
+- local: SQLite file (LLM_CACHE_PATH) shared by the processes of one host, WAL mode,
+  LRU eviction above LLM_CACHE_MAX_BYTES, entries older than LLM_CACHE_TTL ignored
+- redis (optional, LLM_CACHE_REDIS=true): shared between hosts, with TTL
+Only successful responses are stored. SQLite / Redis errors are logged and treated as
+misses: the cache never fails an extraction. A local tier that cannot be opened (read-only
+filesystem, directory not creatable) is switched off for the process after the first error.
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional, Union
+
+from core import metrics
+from core.config import Config
+
+logger = logging.getLogger("pioui.llm_cache")
+
+_KEY_PREFIX = "pioui:llm:v1:"
+_LOCAL_ERRORS = (sqlite3.Error, OSError)
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS llm_cache ("
+    " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+    " created REAL NOT NULL, accessed REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS llm_cache_accessed ON llm_cache (accessed)",
+)
+
+
+def normalize_text(text: str) -> str:
+    """Whitespace-insensitive form of a prompt: blanks collapsed, empty lines dropped."""
+    return "\n".join(" ".join(line.split()) for line in (text or "").splitlines() if line.strip())
+
+
+def prompt_version(*parts: str) -> str:
+    """Short hash of everything that shapes the answer besides the document (prompts, schema)."""
+    return hashlib.sha256("\x00".join(parts).encode("utf-8")).hexdigest()[:12]
+
+
+def make_key(*, call: str, model: str, version: str, payload: Union[str, bytes]) -> str:
+    data = payload if isinstance(payload, bytes) else normalize_text(payload).encode("utf-8")
+    return f"{_KEY_PREFIX}{call}:{model}:{version}:{hashlib.sha256(data).hexdigest()}"
+
+
+class LLMCache:
+    """Two-tier cache of raw LLM responses (JSON strings)."""
+
+    def __init__(self, *, path: str, max_bytes: int, ttl: int, use_redis: bool, enabled: bool = True):
+        self.enabled = enabled
+        self.path = path
+        self.max_bytes = max(0, max_bytes)
+        self.ttl = ttl
+        self.use_redis = use_redis
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._local_off = False
+        self._counters = {"local_hits": 0, "redis_hits": 0, "misses": 0, "stores": 0,
+                          "evictions": 0, "sqlite_errors": 0, "redis_errors": 0}
+
+    @classmethod
+    def from_config(cls) -> "LLMCache":
+        return cls(path=Config.LLM_CACHE_PATH, max_bytes=Config.LLM_CACHE_MAX_BYTES, ttl=Config.LLM_CACHE_TTL,
+                   use_redis=Config.LLM_CACHE_REDIS, enabled=Config.LLM_CACHE_ENABLED)
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += n
+
+    # ——— local tier (one connection per thread and per process: never shared across fork) ———
+    def _db(self) -> sqlite3.Connection:
+        con = getattr(self._local, "con", None)
+        if con is None or self._local.pid != os.getpid():
+            try:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                con = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+                con.execute("PRAGMA journal_mode=WAL")
+                con.execute("PRAGMA synchronous=NORMAL")
+                for stmt in _SCHEMA:
+                    con.execute(stmt)
+            except _LOCAL_ERRORS as e:
+                self._local_off = True
+                logger.warning("llm_cache_local_tier_disabled: %s: %s", self.path, e)
+                raise
+            self._local.con, self._local.pid = con, os.getpid()
+        return con
+
+    def _local_failed(self, e: Exception) -> None:
+        self._count("sqlite_errors")
+        logger.warning("llm_cache_sqlite_error: %s", e)
+
+    def _local_get(self, key: str) -> Optional[str]:
+        if self._local_off:
+            return None
+        now = time.time()
+        try:
+            con = self._db()
+            row = con.execute("SELECT value, created FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if self.ttl and row[1] < now - self.ttl:
+                con.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                return None
+            con.execute("UPDATE llm_cache SET accessed = ? WHERE key = ?", (now, key))
+            return row[0]
+        except _LOCAL_ERRORS as e:
+            self._local_failed(e)
+            return None
+
+    def _local_put(self, key: str, value: str) -> None:
+        size = len(value.encode("utf-8"))
+        if size > self.max_bytes or self._local_off:
+            return
+        now = time.time()
+        try:
+            con = self._db()
+            con.execute("INSERT OR REPLACE INTO llm_cache (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                        (key, value, size, now, now))
+            self._evict(con, now)
+        except _LOCAL_ERRORS as e:
+            self._local_failed(e)
+
+    def _evict(self, con: sqlite3.Connection, now: float) -> None:
+        if self.ttl:
+            con.execute("DELETE FROM llm_cache WHERE created < ?", (now - self.ttl,))
+        total = con.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess, victims = total - self.max_bytes, []
+        for key, size in con.execute("SELECT key, size FROM llm_cache ORDER BY accessed"):
+            victims.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        con.executemany("DELETE FROM llm_cache WHERE key = ?", victims)
+        self._count("evictions", len(victims))
+
+    # ——— redis tier ———
+    def _redis_get(self, key: str) -> Optional[str]:
+        from core.redis_client import get_redis
+        try:
+            raw = get_redis().get(key)
+        except Exception as e:
+            self._count("redis_errors")
+            logger.warning("llm_cache_redis_error: %s", e)
+            return None
+        return raw.decode("utf-8") if raw is not None else None
+
+    def _redis_put(self, key: str, value: str) -> None:
+        from core.redis_client import get_redis
+        try:
+            get_redis().set(key, value.encode("utf-8"), ex=self.ttl or None)
+        except Exception as e:
+            self._count("redis_errors")
+            logger.warning("llm_cache_redis_error: %s", e)
+
+    # ——— public API ———
+    def get(self, key: str, call: str) -> Optional[str]:
+        if not self.enabled:
+            return None
+        value = self._local_get(key)
+        if value is not None:
+            self._count("local_hits")
+            metrics.record_llm_cache(call, "hit_local")
+            return value
+        if self.use_redis:
+            value = self._redis_get(key)
+            if value is not None:
+                self._count("redis_hits")
+                metrics.record_llm_cache(call, "hit_redis")
+                self._local_put(key, value)
+                return value
+        self._count("misses")
+        metrics.record_llm_cache(call, "miss")
+        return None
+
+    def put(self, key: str, value: str) -> None:
+        if not self.enabled or not value:
+            return
+        self._count("stores")
+        self._local_put(key, value)
+        if self.use_redis:
+            self._redis_put(key, value)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            c: Dict[str, Any] = dict(self._counters)
+        lookups = c["local_hits"] + c["redis_hits"] + c["misses"]
+        entries = size = None
+        if self.enabled and not self._local_off:
+            try:
+                entries, size = self._db().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+            except _LOCAL_ERRORS as e:
+                logger.warning("llm_cache_sqlite_error: %s", e)
+        c.update(
+            enabled=self.enabled,
+            local_tier=not self._local_off,
+            redis_tier=self.use_redis,
+            path=self.path,
+            entries=entries,
+            bytes=size,
+            max_bytes=self.max_bytes,
+            hit_rate=round((c["local_hits"] + c["redis_hits"]) / lookups, 3) if lookups else 0.0,
+        )
+        return c
+
+
+llm_cache = LLMCache.from_config()
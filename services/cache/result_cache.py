@@ -0,0 +1,186 @@
+# services/cache/result_cache.py
+"""
+Content-addressed cache of full engine results (extraction + sections + rendered PDFs).
+
+The PHP backend often resubmits the same bytes (retries, re-uploads, re-runs after a
+UI timeout). Entries are keyed on sha256(upload bytes) + the normalized engine
+parameters, so an identical submission skips the LLM and the rendering entirely.
+
+Tiers:
+- local: size-bounded LRU (bytes), per process
+- redis (optional, RESULT_CACHE_REDIS=true): shared between API workers and Celery, with TTL
+Redis errors are logged and treated as misses: the cache never fails a request.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional
+
+from core.config import Config
+
+logger = logging.getLogger("pioui.result_cache")
+
+_KEY_PREFIX = "pioui:result:v1:"
+
+
+def sha256_hex(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def make_key(*, kind: str, digests: Iterable[str], energy_mode: Optional[str], confidence_min: float,
+             strict: bool, variants: str) -> str:
+    """
+    Cache key for one submission. `digests` are the sha256 of each uploaded file, in order.
+    Parameters the engine ignores are dropped (auto mode ignores confidence/strict,
+    dual ignores strict) so equivalent requests share an entry. The energy mode is
+    normalized by the engine itself; a value it does not recognise is kept raw in the key.
+    """
+    from services.reporting.engine import normalize_energy_mode  # engine stays out of the API import path
+    mode = normalize_energy_mode(energy_mode)
+    if mode == "invalid":
+        mode = f"invalid:{energy_mode}"
+    conf = round(float(confidence_min), 3)
+    params = {"mode": mode, "variants": (variants or "both").lower()}
+    if mode in ("gaz", "electricite"):
+        params.update(conf=conf, strict=bool(strict))
+    elif mode == "dual":
+        params["conf"] = conf
+    content = hashlib.sha256("\n".join(digests).encode("ascii")).hexdigest()
+    return f"{_KEY_PREFIX}{kind}:{content}:{json.dumps(params, sort_keys=True, separators=(',', ':'))}"
+
+
+def _entry_size(entry: Dict[str, Any]) -> int:
+    size = len(entry.get("non_anon") or b"") + len(entry.get("anon") or b"")
+    return size + len(_dump_meta(entry))
+
+
+def _dump_meta(entry: Dict[str, Any]) -> bytes:
+    meta = {k: entry.get(k) for k in ("parsed", "sections", "combined_dual", "highlights")}
+    return json.dumps(meta, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+class ResultCache:
+    """Two-tier cache of engine results: {'parsed', 'sections', 'combined_dual', 'highlights', 'non_anon', 'anon'}."""
+
+    def __init__(self, *, max_bytes: int, use_redis: bool, ttl: int, enabled: bool = True):
+        self.enabled = enabled
+        self.max_bytes = max(0, max_bytes)
+        self.use_redis = use_redis
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._lru: "OrderedDict[str, tuple[int, Dict[str, Any]]]" = OrderedDict()
+        self._bytes = 0
+        self._counters = {"local_hits": 0, "redis_hits": 0, "misses": 0, "stores": 0,
+                          "evictions": 0, "redis_errors": 0}
+
+    @classmethod
+    def from_config(cls) -> "ResultCache":
+        return cls(max_bytes=Config.RESULT_CACHE_MAX_BYTES, use_redis=Config.RESULT_CACHE_REDIS,
+                   ttl=Config.RESULT_CACHE_TTL, enabled=Config.RESULT_CACHE_ENABLED)
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._counters[name] += 1
+
+    # ——— local tier ———
+    def _local_get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            item = self._lru.get(key)
+            if item is None:
+                return None
+            self._lru.move_to_end(key)
+            return item[1]
+
+    def _local_put(self, key: str, entry: Dict[str, Any]) -> None:
+        size = _entry_size(entry)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._lru.pop(key, None)
+            if old is not None:
+                self._bytes -= old[0]
+            self._lru[key] = (size, entry)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._lru:
+                _k, (s, _e) = self._lru.popitem(last=False)
+                self._bytes -= s
+                self._counters["evictions"] += 1
+
+    # ——— redis tier ———
+    def _redis_get(self, key: str) -> Optional[Dict[str, Any]]:
+        from core.redis_client import get_redis
+        try:
+            raw = get_redis().hgetall(key)
+        except Exception as e:
+            self._count("redis_errors")
+            logger.warning("result_cache_redis_error: %s", e)
+            return None
+        if not raw or b"meta" not in raw:
+            return None
+        entry = json.loads(raw[b"meta"].decode("utf-8"))
+        entry["non_anon"] = raw.get(b"full")
+        entry["anon"] = raw.get(b"anon")
+        return entry
+
+    def _redis_put(self, key: str, entry: Dict[str, Any]) -> None:
+        from core.redis_client import get_redis
+        mapping = {"meta": _dump_meta(entry)}
+        if entry.get("non_anon") is not None:
+            mapping["full"] = entry["non_anon"]
+        if entry.get("anon") is not None:
+            mapping["anon"] = entry["anon"]
+        try:
+            pipe = get_redis().pipeline()
+            pipe.delete(key)
+            pipe.hset(key, mapping=mapping)
+            pipe.expire(key, self.ttl)
+            pipe.execute()
+        except Exception as e:
+            self._count("redis_errors")
+            logger.warning("result_cache_redis_error: %s", e)
+
+    # ——— public API (blocking when the redis tier is on: call from a thread) ———
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        if not self.enabled:
+            return None
+        entry = self._local_get(key)
+        if entry is not None:
+            self._count("local_hits")
+            return entry
+        if self.use_redis:
+            entry = self._redis_get(key)
+            if entry is not None:
+                self._count("redis_hits")
+                self._local_put(key, entry)
+                return entry
+        self._count("misses")
+        return None
+
+    def put(self, key: str, entry: Dict[str, Any]) -> None:
+        if not self.enabled:
+            return
+        self._count("stores")
+        self._local_put(key, entry)
+        if self.use_redis:
+            self._redis_put(key, entry)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            c = dict(self._counters)
+            lookups = c["local_hits"] + c["redis_hits"] + c["misses"]
+            c.update(
+                enabled=self.enabled,
+                redis_tier=self.use_redis,
+                entries=len(self._lru),
+                bytes=self._bytes,
+                max_bytes=self.max_bytes,
+                hit_rate=round((c["local_hits"] + c["redis_hits"]) / lookups, 3) if lookups else 0.0,
+            )
+            return c
+
+
+result_cache = ResultCache.from_config()
@@ -0,0 +1,243 @@
+# services/execution/engine_pool.py
+"""
+Bounded execution layer for the synchronous invoice endpoints.
+
+The engine mixes blocking network calls (OpenAI / Mistral) with CPU-bound
+ReportLab rendering; running it inline in an `async def` endpoint freezes the
+whole Uvicorn worker (healthz included). Here:
+- extraction + LLM stages run on a thread pool (I/O bound),
+- PDF rendering runs on a process pool (CPU bound, outside the GIL),
+- admission is bounded: past `io_workers + queue_max` jobs in flight we refuse
+  right away (EngineBusyError -> 503 + Retry-After) instead of letting requests
+  queue into client timeouts.
+"""
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from core import metrics
+from core.config import Config
+
+logger = logging.getLogger("pioui.engine_pool")
+
+
+class EngineBusyError(RuntimeError):
+    """Raised when the admission queue is full; carries the Retry-After hint (seconds)."""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Engine queue is full")
+        self.retry_after = retry_after
+
+
+def _render_pdfs(parsed: dict, sections: list, combined_dual: list, variants: str = "both",
+                 labels: Optional[Dict[str, str]] = None) -> Tuple[Optional[bytes], Optional[bytes], list]:
+    # Module-level so it can be pickled to the render processes.
+    # Metric samples are handed back to the parent (render children have no exporter).
+    from services.reporting.backends.render import build_pdfs
+    with metrics.labels(**(labels or {})), metrics.capture() as samples:
+        non_anon, anon = build_pdfs(parsed, sections, combined_dual, variants=variants)
+    return non_anon, anon, samples
+
+
+def _warm_render_process() -> int:
+    # Imports the engine and registers the fonts in a render child (first render is then fast).
+    import os
+    from services.reporting.backends.render import ensure_fonts
+    ensure_fonts()
+    return os.getpid()
+
+
+class EnginePool:
+    """Thread pool (LLM stages) + process pool (rendering) behind a bounded admission counter."""
+
+    def __init__(self, *, io_workers: int, render_workers: int, queue_max: int,
+                 retry_after: int, start_method: str = "spawn"):
+        self.io_workers = max(1, io_workers)
+        self.render_workers = max(0, render_workers)  # 0 => render on the I/O threads
+        self.queue_max = max(0, queue_max)
+        self.retry_after = max(1, retry_after)
+        self._start_method = start_method
+
+        self._lock = threading.Lock()
+        self._io: Optional[ThreadPoolExecutor] = None
+        self._render: Optional[ProcessPoolExecutor] = None
+
+        self._inflight = 0        # admitted jobs (running or waiting)
+        self._io_busy = 0         # jobs currently in extraction / LLM
+        self._render_pending = 0  # jobs submitted for rendering (queued or running)
+        self._render_inline = 0   # jobs rendering on the I/O threads (render_workers == 0)
+        self._rejected_total = 0
+        self._completed_total = 0
+        self._failed_total = 0
+
+    @classmethod
+    def from_config(cls) -> "EnginePool":
+        return cls(
+            io_workers=Config.ENGINE_IO_WORKERS,
+            render_workers=Config.ENGINE_RENDER_WORKERS,
+            queue_max=Config.ENGINE_QUEUE_MAX,
+            retry_after=Config.ENGINE_RETRY_AFTER,
+            start_method=Config.ENGINE_RENDER_START_METHOD,
+        )
+
+    @property
+    def capacity(self) -> int:
+        return self.io_workers + self.queue_max
+
+    # ——— pools (created lazily: importing the app must not spawn anything) ———
+    def _ensure_pools(self) -> None:
+        with self._lock:
+            if self._io is None:
+                self._io = ThreadPoolExecutor(max_workers=self.io_workers, thread_name_prefix="engine-io")
+            if self._render is None and self.render_workers > 0:
+                ctx = multiprocessing.get_context(self._start_method)
+                self._render = ProcessPoolExecutor(max_workers=self.render_workers, mp_context=ctx)
+
+    def _reset_render_pool(self) -> None:
+        with self._lock:
+            pool, self._render = self._render, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def warm(self, timeout: float = 120.0) -> int:
+        """Starts the pools and pre-loads the engine in every render process (blocking)."""
+        self._ensure_pools()
+        with self._lock:
+            render = self._render
+        if render is None:
+            return 0
+        # ProcessPoolExecutor spawns all its workers on the first submissions
+        futures = [render.submit(_warm_render_process) for _ in range(self.render_workers)]
+        return len({f.result(timeout=timeout) for f in futures})
+
+    def shutdown(self) -> None:
+        with self._lock:
+            io, self._io = self._io, None
+            render, self._render = self._render, None
+        if io is not None:
+            io.shutdown(wait=False, cancel_futures=True)
+        if render is not None:
+            render.shutdown(wait=False, cancel_futures=True)
+
+    # ——— admission ———
+    def _try_admit(self) -> bool:
+        with self._lock:
+            if self._inflight >= self.capacity:
+                self._rejected_total += 1
+                return False
+            self._inflight += 1
+            return True
+
+    def _release(self, ok: bool) -> None:
+        with self._lock:
+            self._inflight -= 1
+            if ok:
+                self._completed_total += 1
+            else:
+                self._failed_total += 1
+
+    def _track(self, attr: str, delta: int) -> None:
+        with self._lock:
+            setattr(self, attr, getattr(self, attr) + delta)
+
+    def _run_tracked(self, attr: str, fn: Callable, *args, **kwargs):
+        # Runs on the worker thread: counts the job only once it holds a thread.
+        self._track(attr, 1)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self._track(attr, -1)
+
+    def _render_running(self) -> int:
+        # Render children report nothing back before they finish; the process pool hands
+        # pending jobs to its workers in order, so at most `render_workers` of them run.
+        if self.render_workers == 0:
+            return self._render_inline
+        return min(self._render_pending, self.render_workers)
+
+    # ——— public API ———
+    async def run(self, analyze: Callable[..., Tuple[dict, list, list, List[str]]],
+                  *args: Any, variants: str = "both", **kwargs: Any) -> Dict[str, Any]:
+        """
+        Runs `analyze(*args, **kwargs)` (an engine `analyze_*` function) on the I/O pool,
+        then renders the requested `variants` on the render pool. Raises EngineBusyError when full.
+        Returns {'parsed', 'sections', 'combined_dual', 'highlights', 'non_anon', 'anon'}.
+        """
+        if not self._try_admit():
+            logger.warning("engine_pool_full", extra=self.stats())
+            raise EngineBusyError(self.retry_after)
+        ok = False
+        try:
+            self._ensure_pools()
+            loop = asyncio.get_running_loop()
+            # copy_context: the engine records metrics with the caller's labels
+            ctx = contextvars.copy_context()
+            parsed, sections, combined_dual, highlights = await loop.run_in_executor(
+                self._io, partial(ctx.run, self._run_tracked, "_io_busy", analyze, *args, **kwargs)
+            )
+            non_anon, anon = await self._render_async(loop, parsed, sections, combined_dual, variants)
+            ok = True
+            return {
+                "parsed": parsed,
+                "sections": sections,
+                "combined_dual": combined_dual,
+                "highlights": highlights,
+                "non_anon": non_anon,
+                "anon": anon,
+            }
+        finally:
+            self._release(ok)
+
+    async def _render_async(self, loop, parsed, sections, combined_dual,
+                            variants: str) -> Tuple[Optional[bytes], Optional[bytes]]:
+        self._track("_render_pending", 1)
+        job = partial(_render_pdfs, parsed, sections, combined_dual, variants, metrics.current_labels())
+        try:
+            if self._render is None:
+                non_anon, anon, samples = await loop.run_in_executor(
+                    self._io, partial(self._run_tracked, "_render_inline", job)
+                )
+            else:
+                try:
+                    non_anon, anon, samples = await loop.run_in_executor(self._render, job)
+                except BrokenProcessPool:
+                    # A render child died (OOM, segfault): rebuild the pool for the next requests.
+                    logger.error("engine_render_pool_broken")
+                    self._reset_render_pool()
+                    raise
+            metrics.replay(samples)
+            return non_anon, anon
+        finally:
+            self._track("_render_pending", -1)
+
+    def stats(self) -> Dict[str, Any]:
+        """Occupancy snapshot, used to size gunicorn `-w` against the pools."""
+        with self._lock:
+            render_busy = self._render_running()
+            waiting = max(0, self._inflight - self._io_busy - render_busy)
+            return {
+                "io_workers": self.io_workers,
+                "render_workers": self.render_workers,
+                "queue_max": self.queue_max,
+                "capacity": self.capacity,
+                "inflight": self._inflight,
+                "io_busy": self._io_busy,
+                "render_busy": render_busy,
+                "render_queued": max(0, self._render_pending - render_busy),
+                "waiting": waiting,
+                "utilization": round(self._inflight / self.capacity, 3) if self.capacity else 0.0,
+                "rejected_total": self._rejected_total,
+                "completed_total": self._completed_total,
+                "failed_total": self._failed_total,
+            }
+
+
+engine_pool = EnginePool.from_config()
@@ -0,0 +1,10 @@
+# services/reporting/backends/__init__.py
+"""
+Heavy engine backends, each imported on first use (see `services.reporting.engine`):
+- text     — PyMuPDF text layer (pdfplumber as error fallback), word boxes, pypdfium2 page rasterization
+- vision   — OpenAI (+ Instructor): GPT OCR of page images, structured parse of the text
+- tesseract — pytesseract: local OCR of scanned pages (text + confidence)
+- pixtral  — Mistral Pixtral: invoice images -> JSON
+- render   — ReportLab: Poppins fonts, styles, PDF reports
+Storage (boto3) lives in `services.storage.spaces`, also imported lazily.
+"""
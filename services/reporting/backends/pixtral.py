@@ -0,0 +1,188 @@
+# services/reporting/backends/pixtral.py
+"""Mistral Pixtral: 1 à 8 images de facture -> JSON normalisé (même forme que l'extraction GPT)."""
+import threading
+from typing import List
+
+from mistralai import Mistral
+
+from core import metrics
+from core.config import Config
+from core.prefork import after_fork
+from services.cache.llm_cache import llm_cache, make_key as llm_cache_key, prompt_version
+from services.reporting import imageprep
+from services.reporting.sources import InvoiceSource
+
+_client_lock = threading.Lock()
+_mistral_client = None
+
+def get_mistral_client():
+    global _mistral_client
+    if _mistral_client is None:
+        with _client_lock:
+            if _mistral_client is None:
+                _mistral_client = Mistral(api_key=Config.MISTRAL_API_KEY)
+    return _mistral_client
+
+@after_fork
+def reset_mistral_client():
+    global _mistral_client
+    _mistral_client = None
+
+_PIXTRAL_SYSTEM = (
+    "You extract structured data from French electricity/gas invoices. "
+    "Return ONLY a JSON object (no prose, no markdown). "
+    "If something is not visible, return an empty string for that field."
+)
+
+_PIXTRAL_USER_INSTRUCTIONS = """\
+From these image(s) of a French utility invoice, return this JSON:
+
+{
+  "type_facture": "electricite|gaz|dual",
+  "client": {"name":"", "address":"", "zipcode":""},
+  "periode": {"de":"JJ/MM/AAAA", "a":"JJ/MM/AAAA", "jours":""},
+  "energies": [
+    {
+      "type":"electricite|gaz",
+      "fournisseur":"",
+      "offre":"",
+      "option":"Base|Heures Creuses|HP/HC",
+      "puissance_kVA":"",
+      "conso_kwh_total":"",
+      "conso_hc_kwh":"",
+      "conso_hp_kwh":"",
+      "prix_hc_eur_kwh":"",
+      "prix_hp_eur_kwh":"",
+      "abonnement_ttc":"",
+      "total_ttc":""
+    }
+  ]
+}
+
+Rules:
+- Copy numbers as printed (e.g., '98,68 €', '0,1894'); do not invent values.
+- Use empty string "" for any unknown field.
+- Use French field names exactly as shown.
+"""
+
+# version de prompt des clés du cache LLM
+_PIXTRAL_VERSION = prompt_version(_PIXTRAL_SYSTEM, _PIXTRAL_USER_INSTRUCTIONS)
+
+def _fr_num(s):
+    import re
+    if not isinstance(s, str): return None
+    x = re.sub(r"[^\d,.\-]", "", s)
+    if "," in x and "." in x: x = x.replace(".", "").replace(",", ".")
+    elif "," in x: x = x.replace(",", ".")
+    try: return float(x)
+    except: return None
+
+def _extract_json_loose(s: str) -> dict:
+    import json, re
+    try:
+        return json.loads(s)
+    except Exception:
+        m = re.search(r"\{.*\}", s, flags=re.S)
+        if not m:
+            raise
+        return json.loads(m.group(0))
+
+def normalize_pixtral_json(data: dict) -> dict:
+    """Coerce fields to what the pipeline expects."""
+    import re
+
+    # periode.jours -> int if str
+    j = (data.get("periode") or {}).get("jours")
+    if isinstance(j, str):
+        m = re.search(r"\d+", j)
+        data["periode"]["jours"] = int(m.group(0)) if m else None
+
+    # fill zipcode if missing (extract from address)
+    cli = data.get("client") or {}
+    if (cli.get("zipcode") in (None, "")) and cli.get("address"):
+        m = re.search(r"\b\d{5}\b", cli["address"])
+        if m:
+            cli["zipcode"] = m.group(0)
+            data["client"] = cli
+
+    energies = data.get("energies") or []
+    for e in energies:
+        # Normalize option
+        opt = (e.get("option") or "").strip().lower()
+        if opt in {"heures creuses", "hp/hc", "heures pleines/creuses", "heures pleines et creuses", "hc/hp", "hp hc"}:
+            e["option"] = "HP/HC"
+        elif opt in {"base", "option base"}:
+            e["option"] = "Base"
+
+        # Numbers => floats
+        for k in ("conso_kwh_total","conso_hc_kwh","conso_hp_kwh",
+                  "prix_hc_eur_kwh","prix_hp_eur_kwh",
+                  "abonnement_ttc","total_ttc"):
+            if k in e and isinstance(e[k], str):
+                e[k] = _fr_num(e[k])
+
+        # puissance -> int
+        if isinstance(e.get("puissance_kVA"), str):
+            m = re.search(r"\d+", e["puissance_kVA"])
+            e["puissance_kVA"] = int(m.group(0)) if m else None
+
+        # Add legacy key  pipeline expects
+        if e.get("conso_kwh") is None and e.get("conso_kwh_total") is not None:
+            e["conso_kwh"] = e["conso_kwh_total"]
+
+        # Fix total kWh if inconsistent with HP/HC
+        hp = e.get("conso_hp_kwh") or 0
+        hc = e.get("conso_hc_kwh") or 0
+        if (hp or hc):
+            s = (hp or 0) + (hc or 0)
+            tot = e.get("conso_kwh_total")
+            if tot is None or (s and abs(s - tot) / max(s, 1) > 0.2) or (tot and tot > 20000):
+                e["conso_kwh_total"] = s
+                e["conso_kwh"] = s
+
+    data["energies"] = energies
+    return data
+
+def pixtral_extract_invoice(images: List[InvoiceSource],
+                            model: str = "pixtral-large-latest",
+                            energy_hint: str | None = None) -> dict:
+    """
+    Call Mistral Pixtral on 1..8 images (paths, bytes or file-likes) and return normalized JSON.
+    The raw answer is cached (services/cache/llm_cache.py) on model, prompt version, hint and image bytes.
+    """
+    if not Config.MISTRAL_API_KEY:
+        raise RuntimeError("Set MISTRAL_API_KEY in your environment or Config.")
+    if len(images) > 8:
+        raise ValueError("Pixtral accepts up to 8 images per request.")
+
+    content = [{"type": "text", "text": _PIXTRAL_USER_INSTRUCTIONS}]
+    if energy_hint and energy_hint != "auto":
+        content.insert(0, {"type": "text", "text": f"Type attendu: {energy_hint}."})
+
+    # Images orientées, recadrées et réduites en mémoire avant l'envoi (imageprep)
+    for img in images:
+        content.append({"type": "image_url", "image_url": imageprep.to_data_url(img, "pixtral", call="pixtral")})
+
+    payload = "\n".join([energy_hint or "auto"] + [c["image_url"] for c in content if c["type"] == "image_url"])
+    key = llm_cache_key(call="pixtral", model=model, version=_PIXTRAL_VERSION, payload=payload.encode("utf-8"))
+    cached = llm_cache.get(key, call="pixtral")
+    if cached is not None:
+        return normalize_pixtral_json(_extract_json_loose(cached))
+
+    with metrics.stage("pixtral"):
+        resp = get_mistral_client().chat.complete(
+            model=model,
+            messages=[
+                {"role": "system", "content": _PIXTRAL_SYSTEM},
+                {"role": "user", "content": content},
+            ],
+            response_format={"type": "json_object"},
+            temperature=0,
+            max_tokens=2200,
+        )
+    print("[Mistral] usage:", getattr(resp, "usage", None))
+    metrics.record_tokens("pixtral", model, getattr(resp, "usage", None))
+    raw = resp.choices[0].message.content
+    parsed = _extract_json_loose(raw)
+    llm_cache.put(key, raw)  # réponse lisible seulement ; normalisée à chaque lecture
+    return normalize_pixtral_json(parsed)
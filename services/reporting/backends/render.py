@@ -0,0 +1,505 @@
+# services/reporting/backends/render.py
+"""ReportLab: polices Poppins, styles Pioui et génération des rapports PDF (complet / anonymisé)."""
+import io
+import os
+import threading
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple
+
+from reportlab.lib.pagesizes import A4
+from reportlab.lib import colors
+from reportlab.lib.units import cm
+from reportlab.lib.enums import TA_RIGHT
+from reportlab.platypus import (
+    SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, HRFlowable
+)
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.pdfgen import canvas as rl_canvas
+from reportlab.lib.utils import ImageReader
+
+from core import metrics
+from services.reporting.engine import (
+    PALETTE, PIOUI, FONT_DIR, LOGO_PATH, normalize_variants, current_annual_total, vices_caches_for,
+    _fmt_euro, _fmt_kwh,
+)
+
+# ───────────────── ✍️ Font Registration (Poppins) ✍️ ─────────────────
+def register_poppins_fonts():
+    try:
+        fonts_to_register = {
+            'Poppins': 'Poppins-Regular.ttf',
+            'Poppins-Bold': 'Poppins-Bold.ttf',
+            'Poppins-Italic': 'Poppins-Italic.ttf',
+            'Poppins-BoldItalic': 'Poppins-BoldItalic.ttf',
+        }
+        for name, filename in fonts_to_register.items():
+            pdfmetrics.registerFont(TTFont(name, os.path.join(FONT_DIR, filename)))
+        pdfmetrics.registerFontFamily(
+            'Poppins', normal='Poppins', bold='Poppins-Bold',
+            italic='Poppins-Italic', boldItalic='Poppins-BoldItalic'
+        )
+        print("[INFO] Famille de polices Poppins enregistrée avec succès.")
+        return True
+    except Exception as e:
+        print(f"[AVERTISSEMENT] Impossible d'enregistrer les polices Poppins. Retour à Helvetica. Erreur : {e}")
+        return False
+
+# Enregistrées au premier rendu (ou par le warm-up), pas à l'import du module
+IS_POPPINS_AVAILABLE: Optional[bool] = None
+BASE_FONT = "Helvetica"
+BOLD_FONT = "Helvetica-Bold"
+_fonts_lock = threading.Lock()
+
+def ensure_fonts() -> bool:
+    global IS_POPPINS_AVAILABLE, BASE_FONT, BOLD_FONT
+    if IS_POPPINS_AVAILABLE is None:
+        with _fonts_lock:
+            if IS_POPPINS_AVAILABLE is None:
+                ok = register_poppins_fonts()
+                BASE_FONT = "Poppins" if ok else "Helvetica"
+                BOLD_FONT = "Poppins-Bold" if ok else "Helvetica-Bold"
+                IS_POPPINS_AVAILABLE = ok
+    return IS_POPPINS_AVAILABLE
+
+# ───────────────── Styles & PDF Helpers ─────────────────
+def get_pioui_styles() -> Dict[str, ParagraphStyle]:
+    ensure_fonts()
+    styles = getSampleStyleSheet()
+    styles["BodyText"].fontName = BASE_FONT
+    styles["Italic"].fontName = "Poppins-Italic" if IS_POPPINS_AVAILABLE else "Helvetica-Oblique"
+
+    common_props = {"wordWrap": 'CJK', "splitLongWords": True}
+
+    styles.add(ParagraphStyle(
+        name="H1", fontName=BOLD_FONT, fontSize=22, leading=28,
+        textColor=colors.HexColor(PALETTE["primary_blue"]), spaceAfter=16, **common_props
+    ))
+    styles.add(ParagraphStyle(
+        name="H2", fontName=BOLD_FONT, fontSize=14, leading=18,
+        textColor=colors.HexColor(PALETTE["text_dark"]), spaceAfter=8, **common_props
+    ))
+    styles.add(ParagraphStyle(
+        name="Body", fontName=BASE_FONT, fontSize=10, leading=14,
+        textColor=colors.HexColor(PALETTE["text_dark"]), **common_props
+    ))
+    styles.add(ParagraphStyle(
+        name="Muted", fontName=BASE_FONT, fontSize=9, leading=12,
+        textColor=colors.HexColor(PALETTE["text_muted"]), **common_props
+    ))
+    styles.add(ParagraphStyle(
+        name="ItalicMuted", parent=styles["Muted"],
+        fontName="Poppins-Italic" if IS_POPPINS_AVAILABLE else "Helvetica-Oblique"
+    ))
+    styles.add(ParagraphStyle(
+        name="BodyRight", parent=styles["Body"], alignment=TA_RIGHT
+    ))
+    styles.add(ParagraphStyle(
+        name="FooterText", fontName=BASE_FONT, fontSize=8, leading=11,
+        textColor=colors.white, **common_props
+    ))
+    styles.add(ParagraphStyle(  # Small yellow badge text
+        name="Badge", fontName=BOLD_FONT, fontSize=9.2, leading=12,
+        textColor=colors.HexColor(PALETTE["dark_navy"])
+    ))
+    return styles
+
+# Styles et logo : construits une fois par processus (avant fork via preload_assets),
+# en lecture seule ensuite — partagés copy-on-write entre workers
+_shared_styles: Optional[Dict[str, ParagraphStyle]] = None
+_logo: Optional[ImageReader] = None
+_logo_loaded = False
+
+def shared_styles() -> Dict[str, ParagraphStyle]:
+    global _shared_styles
+    if _shared_styles is None:
+        _shared_styles = get_pioui_styles()
+    return _shared_styles
+
+LOGO_SIZE = (95, 35)  # points, dans l'en-tête
+_LOGO_PX_PER_PT = 4   # ~290 dpi : net à l'impression, bien moins lourd que le PNG source (2114x846)
+
+def logo_image() -> Optional[ImageReader]:
+    """
+    Logo décodé et réduit une seule fois (None si absent ou illisible). Sans cela, ReportLab
+    recompresse et réencode le PNG pleine résolution dans chaque document.
+    """
+    global _logo, _logo_loaded
+    if not _logo_loaded:
+        try:
+            _logo = None
+            if LOGO_PATH and os.path.exists(LOGO_PATH):
+                from PIL import Image
+                with Image.open(LOGO_PATH) as im:
+                    im = im.convert("RGBA").resize(
+                        (LOGO_SIZE[0] * _LOGO_PX_PER_PT, LOGO_SIZE[1] * _LOGO_PX_PER_PT), Image.LANCZOS)
+                _logo = ImageReader(im)
+        except Exception as e:
+            print(f"[AVERTISSEMENT] Logo illisible ({LOGO_PATH}) : {e}")
+            _logo = None
+        _logo_loaded = True
+    return _logo
+
+def preload_assets() -> Dict[str, Any]:
+    """Polices, styles et logo prêts (appelé par engine.preload avant le fork des workers)."""
+    fonts = ensure_fonts()
+    shared_styles()
+    return {"poppins": fonts, "logo": logo_image() is not None}
+
+def draw_header_footer(title_right=""):
+    def _draw(canv: rl_canvas.Canvas, doc):
+        canv.saveState()
+        width, height = A4
+
+        # === Header ===
+        canv.setFillColor(colors.HexColor(PALETTE["dark_navy"]))
+        canv.rect(0, height - 50, width, 50, stroke=0, fill=1)
+        # Yellow accent bar
+        canv.setFillColor(colors.HexColor(PALETTE["brand_yellow"]))
+        canv.rect(0, height - 52, 160, 2, stroke=0, fill=1)
+
+        if LOGO_PATH and os.path.exists(LOGO_PATH):
+            try:
+                logo = logo_image()
+                if logo is None:
+                    raise ValueError("logo illisible")
+                canv.drawImage(logo, 2 * cm, height - 40, width=LOGO_SIZE[0], height=LOGO_SIZE[1], mask="auto")
+            except Exception:
+                canv.setFillColor(colors.white)
+                canv.setFont(BOLD_FONT, 12)
+                canv.drawString(2 * cm, height - 32, "Pioui")
+
+        canv.setFillColor(colors.black)
+        canv.setFont(BASE_FONT, 10)
+        canv.drawRightString(width - 2 * cm, height - 28, "Rapport Comparatif Énergie")
+        canv.setFont(BASE_FONT, 8)
+        canv.setFillColor(colors.HexColor(PALETTE["text_muted"]))
+        canv.drawRightString(width - 2 * cm, height - 40, title_right)
+
+        # === Footer ===
+        canv.setFillColor(colors.HexColor(PALETTE["dark_navy"]))
+        canv.rect(0, 0, width, 70, stroke=0, fill=1)
+        # Yellow thin line above footer content
+        canv.setFillColor(colors.HexColor(PALETTE["brand_yellow"]))
+        canv.rect(0, 68, width, 2, stroke=0, fill=1)
+
+        # Footer content
+        y_pos = 55
+        canv.setFillColor(colors.HexColor("#1E293B"))
+        canv.setFont(BASE_FONT, 8)
+        canv.drawString(2 * cm, y_pos, PIOUI["url"])
+        canv.drawCentredString(width / 2, y_pos, PIOUI["name"])
+        canv.drawRightString(width - 2 * cm, y_pos, f"Page {doc.page}")
+
+        y_pos -= 15
+        canv.setFillColor(colors.HexColor(PALETTE["text_muted"]))
+        canv.drawString(2 * cm, y_pos, PIOUI["email"])
+        canv.drawCentredString(width / 2, y_pos, PIOUI["addr"])
+
+        y_pos -= 15
+        canv.setFillColor(colors.HexColor(PALETTE["text_muted"]))
+        canv.drawCentredString(width / 2, y_pos, PIOUI["tel"])
+
+        y_pos -= 8
+        canv.setStrokeColor(colors.HexColor(PALETTE["border_light"]))
+        canv.line(2 * cm, y_pos, width - 2 * cm, y_pos)
+        y_pos -= 12
+        canv.setFont(BASE_FONT, 7)
+        canv.drawCentredString(width / 2, y_pos, PIOUI["copyright"])
+        canv.restoreState()
+    return _draw
+
+def create_modern_table(rows, col_widths_pts, numeric_cols=None, zebra=True):
+    numeric_cols = set(numeric_cols or [])
+    table = Table(rows, colWidths=col_widths_pts, repeatRows=1)
+
+    style = [
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor(PALETTE["table_header"])),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.HexColor(PALETTE["text_dark"])),
+        ('FONTNAME', (0, 0), (-1, 0), BOLD_FONT),
+        ('FONTSIZE', (0, 0), (-1, 0), 9.5),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
+        ('TOPPADDING', (0, 0), (-1, 0), 8),
+        # Yellow underline under header
+        ('LINEBELOW', (0, 0), (-1, 0), 1.5, colors.HexColor(PALETTE["brand_yellow"])),
+
+        ('FONTNAME', (0, 1), (-1, -1), BASE_FONT),
+        ('FONTSIZE', (0, 1), (-1, -1), 9),
+        ('TEXTCOLOR', (0, 1), (-1, -1), colors.HexColor(PALETTE["text_dark"])),
+        ('VALIGN', (0, 0), (-1, -1), "MIDDLE"),
+        ('TOPPADDING', (0, 1), (-1, -1), 6),
+        ('BOTTOMPADDING', (0, 1), (-1, -1), 6),
+        ('LEFTPADDING', (0, 0), (-1, -1), 6),
+        ('RIGHTPADDING', (0, 0), (-1, -1), 6),
+        ('GRID', (0,0), (-1,-1), 0.25, colors.HexColor(PALETTE["border_light"])),
+    ]
+
+    if zebra and len(rows) > 2:
+        for r in range(1, len(rows)):
+            if r % 2 == 1:
+                style.append(('BACKGROUND', (0, r), (-1, r), colors.HexColor(PALETTE["bg_light"])))
+
+    for c in numeric_cols:
+        style.append(("ALIGN", (c, 1), (c, -1), "RIGHT"))
+
+    table.setStyle(TableStyle(style))
+    return table
+
+# ───────────────── PDF Builder ─────────────────
+def build_pdfs(parsed: dict, sections: List[Dict[str, Any]], combined_dual: List[Dict[str, Any]],
+               variants: str = "both") -> Tuple[Optional[bytes], Optional[bytes]]:
+    """
+    Generates the PDF reports in memory and returns them as byte strings.
+    Only the requested `variants` are rendered; the other one is returned as None.
+
+    Returns:
+        (non_anonymous_pdf_bytes | None, anonymous_pdf_bytes | None)
+    """
+    variants = normalize_variants(variants)
+    ensure_fonts()
+
+    def render(anonymous: bool):
+        buffer = io.BytesIO()
+
+        doc = SimpleDocTemplate(
+            buffer,
+            pagesize=A4,
+            leftMargin=2 * cm, rightMargin=2 * cm,
+            topMargin=2.5 * cm + 50,
+            bottomMargin=2.0 * cm + 60
+        )
+        s = shared_styles()
+        story = []
+        W = doc.width
+
+        def cw(*ratios):
+            total = float(sum(ratios))
+            return [W * (r / total) for r in ratios]
+
+        H1 = lambda x: Paragraph(x, s["H1"])
+        H2 = lambda x: Paragraph(x, s["H2"])
+        P  = lambda x: Paragraph(x if isinstance(x, str) else "—", s["Body"])
+        PR = lambda x: Paragraph(x if isinstance(x, str) else "—", s["BodyRight"])
+        PM = lambda x: Paragraph(x if isinstance(x, str) else "—", s["Muted"])
+
+        client = parsed.get("client") or {}
+        right_title = client.get("name") or ""
+        on_page = draw_header_footer(title_right=right_title)
+
+        story.append(H1("Votre Rapport Comparatif"))
+
+        story.append(P(f"<b>Client :</b> {client.get('name') or '—'}"))
+        if client.get("address"):
+            story.append(PM(client["address"]))
+        story.append(Paragraph(f"<i>Généré le {date.today().strftime('%d/%m/%Y')}</i>", s["ItalicMuted"]))
+        story.append(Spacer(1, 10))
+        story.append(HRFlowable(width="100%", color=colors.HexColor(PALETTE["border_light"]), thickness=1))
+        story.append(Spacer(1, 10))
+
+        # — Période
+        periode = parsed.get("periode") or {}
+        p_de, p_a, p_j = periode.get("de"), periode.get("a"), periode.get("jours")
+        if p_de and p_a:
+            story.append(H2("Période de facturation analysée"))
+            story.append(P(f"Du <b>{p_de}</b> au <b>{p_a}</b> (soit {p_j or '~'} jours)"))
+            story.append(Spacer(1, 12))
+
+        # — Sections per energy type
+        for sec in sections:
+            # Reset provider letter mapping for each energy type section
+            provider_letter_map = {}
+            letter_counter = 0
+            
+            params = sec["params"]
+            rows = sec["rows"]
+            if not rows:
+                continue
+            energy_label = "Électricité" if params["energy"] == "electricite" else "Gaz"
+
+            # 1) Offre actuelle
+            story.append(H1(f"Analyse {energy_label}"))
+            story.append(H2("Votre offre actuelle"))
+
+            p_de_sec = params.get("period_start_date")
+            p_a_sec = params.get("period_end_date")
+            p_j_sec = params.get("period_days")
+            if p_de_sec and p_a_sec and p_j_sec:
+                story.append(P(f"<i>Période analysée : Du <b>{p_de_sec}</b> au <b>{p_a_sec}</b> (soit {p_j_sec} jours)</i>"))
+                story.append(Spacer(1, 6))
+
+            conso_period = params.get("period_kwh")
+            total_period = params.get("total_ttc_period")
+            avg_price = (total_period / conso_period) if (total_period and conso_period) else None
+            annual_now = current_annual_total(params)
+
+            head = [P("Fournisseur"), P("Offre"), P("Puissance"), P("Option"), P("Conso. (période)"),
+                    PR("Total TTC (période)"), PR("Prix moyen (€/kWh)"), PR("Estimation annuelle actuelle")]
+            row = [P(f"<b>{params.get('fournisseur') or '—'}</b>"), P(params.get('offre') or '—'),
+                   P(str(params.get('kva')) if params["energy"] == "electricite" else "—"),
+                   P(params.get('option') if params["energy"] == "electricite" else "—"), P(_fmt_kwh(conso_period)),
+                   PR(_fmt_euro(total_period)), PR(f"{avg_price:.4f} €/kWh" if avg_price else "—"),
+                   PR(_fmt_euro(annual_now))]
+            story.append(create_modern_table([head, row], cw(1.3, 1.8, 0.9, 0.9, 1.2, 1.2, 1.2, 1.6),
+                                             numeric_cols={4, 5, 6, 7}, zebra=False))
+            story.append(Spacer(1, 12))
+
+            # 2) Comparatif
+            story.append(H2(f"Comparatif des offres {energy_label}"))
+            if anonymous:
+                # Créer des maps locales pour chaque type d'offre, basées sur leur ordre d'apparition
+                base_offers = [o for o in rows if o.get("option") in (None, "Base")]
+                hphc_offers = [o for o in rows if o.get("option") == "HP/HC"]
+                base_map = {o['provider']: f"Fournisseur Alternatif {chr(65 + i)}" for i, o in
+                            enumerate(base_offers[:3])}
+                hphc_map = {o['provider']: f"Fournisseur Alternatif {chr(65 + i)}" for i, o in
+                            enumerate(hphc_offers[:3])}
+
+            def get_anon_name(provider_name, offer_option):
+                if not anonymous: return provider_name or "—"
+                # Choisit la bonne map (base ou hphc) en fonction de l'option de l'offre
+                current_map = hphc_map if offer_option == "HP/HC" else base_map
+                return current_map.get(provider_name, provider_name or "—")
+
+            if params["energy"] == "electricite":
+                base = [o for o in rows if o.get("option") in (None, "Base")]
+                hphc = [o for o in rows if o.get("option") == "HP/HC"]
+
+                def map_b(o):
+                    return [P(get_anon_name(o["provider"], "Base")), P(o["offer_name"]),
+                            PR(f"{o['price_kwh_ttc']:.4f} €/kWh"), PR(_fmt_euro(o["abonnement_annuel_ttc"])),
+                            PR(f"<b>{_fmt_euro(o['total_annuel_estime'])}</b>")]
+
+                if base:
+                    # Reset provider letter mapping for Base table
+                    provider_letter_map = {}
+                    letter_counter = 0
+                    
+                    story.append(P("<b> Option Base</b>"))
+                    thead = [P("Fournisseur"), P("Offre"), PR("Prix kWh TTC"), PR("Abonnement / an"),
+                             PR("Total estimé / an")]
+                    story.append(create_modern_table([thead] + [map_b(o) for o in base[:3]], cw(1.2, 2.0, 1.0, 1.2, 1.2),
+                                                     numeric_cols={2, 3, 4}))
+                    story.append(Spacer(1, 6))
+
+                def map_h(o):
+                    return [P(get_anon_name(o["provider"], "HP/HC")), P(o["offer_name"]),
+                            PR(f"{o['price_hp_ttc']:.4f} / {o['price_hc_ttc']:.4f} €/kWh"),
+                            PR(_fmt_euro(o["abonnement_annuel_ttc"])),
+                            PR(f"<b>{_fmt_euro(o['total_annuel_estime'])}</b>")]
+
+                if hphc:
+                    story.append(P("<b> Option Heures Pleines / Heures Creuses</b>"))
+                    thead2 = [P("Fournisseur"), P("Offre"), PR("Prix HP / HC"), PR("Abonnement / an"),
+                              PR("Total estimé / an")]
+                    story.append(create_modern_table([thead2] + [map_h(o) for o in hphc[:3]], cw(1.2, 1.8, 1.4, 1.2, 1.2),
+                                                     numeric_cols={2, 3, 4}))
+                    story.append(Spacer(1, 8))
+            else:  # Gaz
+                def map_g(o):
+                    return [P(get_anon_name(o["provider"], "Base")), P(o["offer_name"]),
+                            PR(f"{o['price_kwh_ttc']:.4f} €/kWh"), PR(_fmt_euro(o["abonnement_annuel_ttc"])),
+                            PR(f"<b>{_fmt_euro(o['total_annuel_estime'])}</b>")]
+
+                thead = [P("Fournisseur"), P("Offre"), PR("Prix kWh TTC"), PR("Abonnement / an"),
+                         PR("Total estimé / an")]
+                story.append(create_modern_table([thead] + [map_g(o) for o in rows[:3]], cw(1.2, 2.0, 1.0, 1.2, 1.2),
+                                                 numeric_cols={2, 3, 4}))
+                story.append(Spacer(1, 8))
+
+            # 3) Vices cachés
+            story.append(H2("Points de vigilance (Vices cachés)"))
+            story.append(PM("Analyse sur l’offre actuelle et les alternatives proposées."))
+            story.append(Spacer(1, 4))
+            bullets = vices_caches_for(params["energy"], params.get("fournisseur"), params.get("offre"))
+            for b in bullets:
+                story.append(Paragraph(f"• {b}", s["Body"]))
+            story.append(Spacer(1, 10))
+
+            badge = Table([[Paragraph("Attention aux clauses et indexations", s["Badge"])]], colWidths=[W])
+            badge.setStyle(TableStyle([
+                ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor(PALETTE["brand_yellow"])),
+                ('LEFTPADDING', (0, 0), (-1, -1), 8),
+                ('RIGHTPADDING', (0, 0), (-1, -1), 8),
+                ('TOPPADDING', (0, 0), (-1, -1), 4),
+                ('BOTTOMPADDING', (0, 0), (-1, -1), 4),
+            ]))
+            story.append(badge)
+            story.append(Spacer(1, 12))
+
+            # 4) Reco
+            story.append(H2("Notre recommandation"))
+            best = min(rows, key=lambda x: x["total_annuel_estime"]) if rows else None
+            curr = annual_now
+            if best and curr and best.get("total_annuel_estime"):
+                delta = curr - best["total_annuel_estime"]
+                if delta > 0:
+                    # ✅ MODIFIÉ : La recommandation utilise la même logique pour trouver le nom anonymisé correct
+                    reco_provider_name = get_anon_name(best['provider'], best.get('option'))
+                    reco_text = Paragraph(
+                        f"Économisez jusqu'à <font size='14' color='{PALETTE['saving_red']}'><b>{_fmt_euro(delta)}</b></font> "
+                        f"par an en passant chez <b>{reco_provider_name}</b> avec l'offre <b>{best['offer_name']}</b>."
+                        f" Pour approfondir cette recommandation et obtenir un conseil personnalisé, "
+                        f"nos experts sont joignables au <b>{PIOUI['tel']}</b>.", s["Body"]
+                    )
+                else:
+                    reco_text = Paragraph("Votre offre actuelle semble compétitive. Aucune économie nette identifiée.", s["Body"])
+            else:
+                reco_text = Paragraph("Données insuffisantes pour une recommandation chiffrée fiable.", s["Body"])
+
+            reco_box = Table([[reco_text]], colWidths=[W])
+            reco_box.setStyle(TableStyle([
+                ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor(PALETTE["bg_light"])),
+                ('BOX', (0, 0), (-1, -1), 1, colors.HexColor(PALETTE["border_light"])),
+                ('LEFTPADDING', (0, 0), (-1, -1), 12),
+                ('RIGHTPADDING', (0, 0), (-1, -1), 12),
+                ('TOPPADDING', (0, 0), (-1, -1), 12),
+                ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
+            ]))
+            story.append(reco_box)
+            story.append(Spacer(1, 12))
+            story.append(HRFlowable(width="100%", color=colors.HexColor(PALETTE["border_light"]), thickness=1))
+            story.append(Spacer(1, 12))
+
+        # Pack Dual (optional)
+        if combined_dual:
+            # ✅ MODIFIÉ : Création d'une map locale pour le pack dual
+            dual_map = {}
+            if anonymous:
+                dual_map = {o['provider']: f"Fournisseur Alternatif {chr(65 + i)}" for i, o in
+                            enumerate(combined_dual[:3])}
+
+            story.append(H1("Pack Dual (Électricité + Gaz)"))
+
+            def map_d(o):
+                provider_name = dual_map.get(o["provider"], o["provider"]) if anonymous else o["provider"]
+                return [P(provider_name), P(o["offer_name"]), PR(f"<b>{_fmt_euro(o['total_annuel_estime'])}</b>")]
+
+            thead = [P("Fournisseur"), P("Offres combinées"), PR("Total estimé (élec+gaz)")]
+            story.append(create_modern_table([thead] + [map_d(o) for o in combined_dual[:3]], cw(1.3, 3.0, 1.2),
+                                             numeric_cols={2}))
+            story.append(Spacer(1, 10))
+
+        # Méthodo
+        story.append(H2("Méthodologie & Fiabilité des données"))
+        story.append(Paragraph(
+            "Les données de ce rapport proviennent de votre facture, d’offres publiques de référence, et de barèmes officiels. Les comparaisons sont estimées à partir d’hypothèses réalistes pour illustrer des économies potentielles.",
+            s["Muted"]))
+        story.append(Spacer(1, 6))
+        story.append(Paragraph(
+            "<b>Rapport indépendant</b>, sans publicité ni affiliation. Son seul but : identifier vos économies possibles.",
+            s["Muted"]))
+
+        doc.build(story, onFirstPage=on_page, onLaterPages=on_page)
+        pdf_bytes = buffer.getvalue()
+        buffer.close()
+        return pdf_bytes
+
+    non_anon_bytes = anon_bytes = None
+    if variants in ("full", "both"):
+        with metrics.stage("render_full"):
+            non_anon_bytes = render(anonymous=False)
+    if variants in ("anon", "both"):
+        with metrics.stage("render_anon"):
+            anon_bytes = render(anonymous=True)
+    return non_anon_bytes, anon_bytes
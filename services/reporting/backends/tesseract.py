@@ -0,0 +1,60 @@
+# services/reporting/backends/tesseract.py
+"""
+OCR local Tesseract (pack de langue "fra") : premier niveau de l'OCR des pages scannées.
+Chaque page donne un texte et une confiance moyenne (0..100, mots pondérés par leur
+longueur) ; le moteur n'envoie à GPT vision que les pages sous TESSERACT_MIN_CONFIDENCE.
+Un appel = un processus `tesseract` : les pages d'une facture tournent en parallèle sur
+les cœurs, au plus TESSERACT_PARALLELISM à la fois par processus Python.
+"""
+import os
+import threading
+from typing import Optional, Tuple
+
+import pytesseract
+
+from core import metrics
+from core.config import Config
+
+# une page = un processus tesseract mono-thread ; le parallélisme se fait entre pages
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+pytesseract.pytesseract.tesseract_cmd = Config.TESSERACT_CMD
+
+_slots = threading.BoundedSemaphore(max(1, Config.TESSERACT_PARALLELISM))
+_available: Optional[bool] = None
+_available_lock = threading.Lock()
+
+def tesseract_available() -> bool:
+    """Binaire tesseract présent avec la langue TESSERACT_LANG (vérifié une fois par processus)."""
+    global _available
+    if _available is None:
+        with _available_lock:
+            if _available is None:
+                try:
+                    langs = set(pytesseract.get_languages(config=""))
+                    missing = [l for l in Config.TESSERACT_LANG.split("+") if l not in langs]
+                    if missing:
+                        print(f"[AVERTISSEMENT] Tesseract sans la langue {'+'.join(missing)} : OCR local désactivé.")
+                    _available = not missing
+                except Exception as e:
+                    print(f"[AVERTISSEMENT] Tesseract indisponible ({type(e).__name__}: {e}) : OCR local désactivé.")
+                    _available = False
+    return _available
+
+def ocr_page_with_tesseract(image, dpi: int = 200) -> Tuple[str, float]:
+    """(texte, confiance moyenne 0..100) d'une page PIL ; lignes dans l'ordre de lecture de Tesseract."""
+    config = f"--psm 3 --dpi {dpi}"
+    with _slots, metrics.stage("ocr_tesseract"):
+        data = pytesseract.image_to_data(image.convert("L"), lang=Config.TESSERACT_LANG, config=config,
+                                         output_type=pytesseract.Output.DICT)
+    lines, weight, score = {}, 0, 0.0
+    for i, word in enumerate(data["text"]):
+        word = (word or "").strip()
+        conf = float(data["conf"][i])
+        if not word or conf < 0:
+            continue
+        key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        lines.setdefault(key, []).append(word)
+        weight += len(word)
+        score += conf * len(word)
+    text = "\n".join(" ".join(words) for words in lines.values())
+    return text, (score / weight if weight else 0.0)
@@ -0,0 +1,221 @@
+# services/reporting/backends/text.py
+"""
+Couche texte des PDF et rendu des pages en images.
+
+Extraction du texte derrière une interface `TextExtractor` :
+- "pymupdf" (défaut) : mots PyMuPDF regroupés en lignes comme le fait pdfplumber
+  (même ordre de lecture, mêmes lignes pour les regex du moteur), ~20x plus rapide ;
+- "pdfplumber" : l'extracteur historique, utilisé en secours si PyMuPDF échoue
+  (TEXT_EXTRACTOR_FALLBACK) ou choisi globalement (TEXT_EXTRACTOR=pdfplumber).
+Au-delà de TEXT_EXTRACT_PARALLEL_MIN_PAGES pages, les plages de pages sont réparties
+sur TEXT_EXTRACT_WORKERS processus (0 = toujours dans le processus courant).
+Rendu des pages : pypdfium2.
+"""
+import io
+import multiprocessing
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Sequence
+
+from core import metrics
+from core.config import Config
+from core.prefork import after_fork
+from services.reporting.sources import InvoiceSource, read_source_bytes
+
+
+class TextExtractor(ABC):
+    """Texte de chaque page d'un PDF ("" pour une page sans texte)."""
+    name = ""
+
+    @abstractmethod
+    def page_count(self, data: bytes) -> int:
+        ...
+
+    @abstractmethod
+    def pages(self, data: bytes, start: int = 0, stop: Optional[int] = None) -> List[str]:
+        ...
+
+
+class PyMuPDFExtractor(TextExtractor):
+    name = "pymupdf"
+
+    def __init__(self, y_tolerance: float = 3.0):
+        self.y_tolerance = y_tolerance
+
+    def page_count(self, data: bytes) -> int:
+        import pymupdf
+        with pymupdf.open(stream=data, filetype="pdf") as doc:
+            return doc.page_count
+
+    def pages(self, data: bytes, start: int = 0, stop: Optional[int] = None) -> List[str]:
+        import pymupdf
+        with pymupdf.open(stream=data, filetype="pdf") as doc:
+            stop = doc.page_count if stop is None else min(stop, doc.page_count)
+            return [self._page_text(doc[i]) for i in range(start, stop)]
+
+    def _page_text(self, page) -> str:
+        # mots (x0, y0, x1, y1, texte, ...) -> lignes par ligne de base, de gauche à droite
+        words = sorted(page.get_text("words"), key=lambda w: (w[3], w[0]))
+        lines, current, base = [], [], None
+        for w in words:
+            if base is not None and abs(w[3] - base) > self.y_tolerance:
+                lines.append(current)
+                current, base = [], None
+            current.append(w)
+            base = w[3] if base is None else base
+        if current:
+            lines.append(current)
+        return "\n".join(" ".join(w[4] for w in sorted(line, key=lambda w: w[0])) for line in lines)
+
+
+class PdfplumberExtractor(TextExtractor):
+    name = "pdfplumber"
+
+    def page_count(self, data: bytes) -> int:
+        import pdfplumber
+        with pdfplumber.open(io.BytesIO(data)) as doc:
+            return len(doc.pages)
+
+    def pages(self, data: bytes, start: int = 0, stop: Optional[int] = None) -> List[str]:
+        import pdfplumber
+        with pdfplumber.open(io.BytesIO(data)) as doc:
+            return [p.extract_text() or "" for p in doc.pages[start:stop]]
+
+
+EXTRACTORS: Dict[str, TextExtractor] = {e.name: e for e in (PyMuPDFExtractor(), PdfplumberExtractor())}
+
+def get_extractor(name: Optional[str] = None) -> TextExtractor:
+    name = (name or Config.TEXT_EXTRACTOR).lower()
+    if name not in EXTRACTORS:
+        raise ValueError(f"TEXT_EXTRACTOR inconnu : {name!r} (choix : {', '.join(EXTRACTORS)})")
+    return EXTRACTORS[name]
+
+# ───────────────── Extraction parallèle (gros PDF) ─────────────────
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+def _page_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            ctx = multiprocessing.get_context(Config.ENGINE_RENDER_START_METHOD)
+            _pool = ProcessPoolExecutor(max_workers=Config.TEXT_EXTRACT_WORKERS, mp_context=ctx)
+        return _pool
+
+@after_fork
+def reset_page_pool():
+    # le pool du parent n'appartient pas au worker forké
+    global _pool
+    _pool = None
+
+def _extract_range(name: str, data: bytes, start: int, stop: int) -> List[str]:
+    return EXTRACTORS[name].pages(data, start, stop)
+
+def _pages_parallel(extractor: TextExtractor, data: bytes, n_pages: int) -> List[str]:
+    workers = Config.TEXT_EXTRACT_WORKERS
+    step = -(-n_pages // workers)
+    ranges = [(i, min(i + step, n_pages)) for i in range(0, n_pages, step)]
+    futures = [_page_pool().submit(_extract_range, extractor.name, data, a, b) for a, b in ranges]
+    return [t for f in futures for t in f.result()]
+
+def _extract(extractor: TextExtractor, data: bytes) -> List[str]:
+    if Config.TEXT_EXTRACT_WORKERS > 0 and Config.TEXT_EXTRACT_PARALLEL_MIN_PAGES > 0:
+        n_pages = extractor.page_count(data)
+        if n_pages >= Config.TEXT_EXTRACT_PARALLEL_MIN_PAGES:
+            try:
+                return _pages_parallel(extractor, data, n_pages)
+            except Exception as e:
+                reset_page_pool()
+                # ex. worker Celery prefork (processus démon : pas de sous-processus) -> en série
+                print(f"[AVERTISSEMENT] Extraction parallèle indisponible ({type(e).__name__}: {e}), en série.")
+    return extractor.pages(data)
+
+def extract_pages_text(pdf: InvoiceSource, extractor: Optional[str] = None) -> List[str]:
+    """Text layer of each page ("" for a page without text); [] if the PDF cannot be read."""
+    t0 = time.perf_counter()
+    data = read_source_bytes(pdf)
+    primary = get_extractor(extractor)
+    fallback = (Config.TEXT_EXTRACTOR_FALLBACK or "").lower()
+    chain = [primary] + ([EXTRACTORS[fallback]] if fallback in EXTRACTORS and fallback != primary.name else [])
+    for ex in chain:
+        try:
+            pages = _extract(ex, data)
+            metrics.observe_stage("text_extraction", time.perf_counter() - t0)
+            return pages
+        except Exception as e:
+            print(f"[AVERTISSEMENT] Extraction texte {ex.name} échouée : {type(e).__name__}: {e}")
+    metrics.observe_stage("text_extraction", time.perf_counter() - t0, ok=False)
+    return []
+
+def extract_text_from_pdf(pdf: InvoiceSource, extractor: Optional[str] = None) -> str:
+    return "\n".join(t for t in extract_pages_text(pdf, extractor) if t).strip()
+
+def image_coverage(pdf: InvoiceSource) -> List[float]:
+    """Part de chaque page couverte par des images (0..1) ; [] si le PDF ne peut pas être lu."""
+    try:
+        import pymupdf
+        with pymupdf.open(stream=read_source_bytes(pdf), filetype="pdf") as doc:
+            out = []
+            for page in doc:
+                area = abs(page.rect) or 1.0
+                covered = sum(abs(pymupdf.Rect(info["bbox"]) & page.rect) for info in page.get_image_info())
+                out.append(min(1.0, covered / area))
+            return out
+    except Exception as e:
+        print(f"[AVERTISSEMENT] Couverture image des pages indisponible : {type(e).__name__}: {e}")
+        return []
+
+def page_layout(pdf: InvoiceSource, max_pages: Optional[int] = None) -> Dict:
+    """
+    Mise en page pour les gabarits fournisseur (services/reporting/templates.py) : producteur
+    et créateur du PDF, polices de la page 1 (sans préfixe de sous-ensemble "ABCDEF+") et,
+    pour les `max_pages` premières pages, taille et mots [x0, y0, x1, y1, texte] en points.
+    """
+    import pymupdf
+    with pymupdf.open(stream=read_source_bytes(pdf), filetype="pdf") as doc:
+        meta = doc.metadata or {}
+        n = doc.page_count if max_pages is None else min(max_pages, doc.page_count)
+        pages = []
+        for i in range(n):
+            page = doc[i]
+            words = [[round(w[0], 1), round(w[1], 1), round(w[2], 1), round(w[3], 1), w[4]]
+                     for w in page.get_text("words")]
+            pages.append({"width": page.rect.width, "height": page.rect.height, "words": words})
+        fonts = sorted({f[3].split("+", 1)[-1] for f in doc[0].get_fonts()}) if n else []
+    return {"producer": meta.get("producer") or "", "creator": meta.get("creator") or "",
+            "fonts": fonts, "pages": pages}
+
+# PDFium n'est pas thread-safe : un rendu à la fois par processus (les appels LLM, eux, restent parallèles)
+_pdfium_lock = threading.Lock()
+
+def iter_pdf_pages(pdf: InvoiceSource, dpi: int = 200, pages: Optional[Sequence[int]] = None) -> Iterator:
+    """
+    PIL images of the pages, rendered one at a time (pypdfium2, in memory). Only the page
+    being yielded is held here: the caller decides how many are alive at once.
+    `pages`: 0-based indices to render, in that order (default: all).
+    """
+    import pypdfium2 as pdfium
+
+    data = read_source_bytes(pdf)
+    with _pdfium_lock:
+        doc = pdfium.PdfDocument(data)
+    try:
+        for i in (range(len(doc)) if pages is None else pages):
+            t0 = time.perf_counter()
+            with _pdfium_lock:
+                page = doc[i]
+                try:
+                    image = page.render(scale=dpi / 72).to_pil().convert("RGB")
+                finally:
+                    page.close()
+            metrics.observe_stage("rasterize", time.perf_counter() - t0)
+            yield image
+    finally:
+        with _pdfium_lock:
+            doc.close()
+
+def rasterize_pdf_pages(pdf: InvoiceSource, dpi: int = 200) -> list:
+    """PIL images of every page, rendered in memory (prefer `iter_pdf_pages` for large scans)."""
+    return list(iter_pdf_pages(pdf, dpi=dpi))
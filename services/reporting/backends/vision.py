@@ -0,0 +1,168 @@
+# services/reporting/backends/vision.py
+"""OpenAI (patché Instructor): OCR GPT d'une image de facture et extraction structurée du texte."""
+import json
+import threading
+import time
+from typing import List, Optional
+
+import instructor
+from openai import OpenAI
+from pydantic import BaseModel, Field, field_validator
+
+from core import metrics
+from core.config import Config
+from core.prefork import after_fork
+from services.cache.llm_cache import llm_cache, make_key as llm_cache_key, prompt_version
+from services.reporting import compaction, imageprep
+
+# Définir la structure de sortie avec Pydantic
+class ClientInfo(BaseModel):
+    name: Optional[str] = Field(..., description="Nom complet du client titulaire du contrat.")
+    address: Optional[str] = Field(..., description="Adresse de facturation complète.")
+    zipcode: Optional[str] = Field(..., description="Code postal de l'adresse de facturation.")
+
+class Periode(BaseModel):
+    de: Optional[str] = Field(..., description="Date de début au format JJ/MM/AAAA.")
+    a: Optional[str] = Field(..., description="Date de fin au format JJ/MM/AAAA.")
+    jours: Optional[int] = Field(..., description="Nombre total de jours dans la période.")
+
+class EnergyDetails(BaseModel):
+    type: str = Field(..., description="Le type d'énergie : 'electricite' ou 'gaz'.")
+    periode: Optional[Periode] = Field(..., description="La période de facturation pour la CONSOMMATION réelle de cette énergie, et non la période de l'abonnement.")
+    fournisseur: Optional[str] = Field(..., description="Le nom du fournisseur d'énergie.")
+    offre: Optional[str] = Field(..., description="Le nom commercial de l'offre.")
+    option: Optional[str] = Field(None, description="Pour l'électricité : 'Base' ou 'HP/HC'.")
+    puissance_kVA: Optional[int] = Field(None, description="La puissance souscrite en kVA pour l'électricité.")
+    conso_kwh: Optional[float] = Field(None, description="La consommation totale en kWh pour la période. Peut être null si non trouvée.")
+    total_ttc: Optional[float] = Field(..., description="Le montant total TTC pour cette énergie pour la période.")
+
+    @field_validator("conso_kwh", "total_ttc")
+    def required_field(cls, v):
+        if v is None:
+            # Ce message sera envoyé au LLM en cas d'échec !
+            raise ValueError("Ce champ est manquant. Retrouvez sa valeur dans le document.")
+        return v
+
+
+class Facture(BaseModel):
+    client: ClientInfo
+    periode_globale: Optional[Periode] = Field(..., description="La période de bilan annuel si présente, sinon la période principale.")
+    energies: List[EnergyDetails]
+
+# ───────────────── Client (créé au premier appel ou par le warm-up) ─────────────────
+_client_lock = threading.Lock()
+_llm_client = None
+
+def get_llm_client():
+    """Client OpenAI patché par Instructor (un seul par processus, partagé entre threads)."""
+    global _llm_client
+    if _llm_client is None:
+        with _client_lock:
+            if _llm_client is None:
+                _llm_client = instructor.patch(OpenAI(api_key=Config.OPENAI_API_KEY))
+    return _llm_client
+
+@after_fork
+def reset_llm_client():
+    # le pool httpx du parent ne doit pas être partagé : chaque worker recrée son client
+    global _llm_client
+    _llm_client = None
+
+# ───────────────── GPT extractors ─────────────────
+_MODEL = "gpt-4o-mini"
+_OCR_SYSTEM = "Assistant d'analyse de factures énergie. Retourne UNIQUEMENT un JSON valide (un objet)."
+_OCR_USER = "Même consignes que précédemment. Image ci-dessous."
+_PARSE_SYSTEM = "Tu es un expert en extraction de données sur les factures d'énergie. Extrais les informations demandées en te basant sur le schéma Pydantic fourni.  Si un champ est marqué comme obligatoire et que tu ne le trouves pas, cherche plus attentivement."
+
+# Version de prompt des clés du cache LLM : changer une consigne ou le schéma invalide les réponses stockées
+_OCR_VERSION = prompt_version(_OCR_SYSTEM, _OCR_USER)
+_PARSE_VERSION = prompt_version(_PARSE_SYSTEM, json.dumps(Facture.model_json_schema(), sort_keys=True))
+
+def ocr_invoice_with_gpt(image) -> str:
+    """
+    `image` : source (chemin, octets, fichier), image PIL ou imageprep.PreparedImage.
+    Réponse reprise du cache LLM si la même image (après imageprep) a déjà été lue.
+    """
+    url = imageprep.to_data_url(image, "openai", call="ocr_gpt")
+    key = llm_cache_key(call="ocr_gpt", model=_MODEL, version=_OCR_VERSION, payload=url.encode("ascii"))
+    cached = llm_cache.get(key, call="ocr_gpt")
+    if cached is not None:
+        return cached
+    with metrics.stage("ocr_gpt"):
+        resp = get_llm_client().chat.completions.create(
+            model=_MODEL,
+            messages=[
+                {"role": "system", "content": _OCR_SYSTEM},
+                {"role": "user", "content": _OCR_USER},
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "image_url",
+                            "image_url": {"url": url}
+                        }
+                    ],
+                },
+            ],
+            temperature=0.0,
+            seed=42,
+            response_format={"type": "json_object"},
+        )
+    metrics.record_tokens("ocr_gpt", _MODEL, getattr(resp, "usage", None))
+    content = resp.choices[0].message.content
+    try:
+        json.loads(content)
+        llm_cache.put(key, content)
+    except (TypeError, ValueError):
+        pass  # réponse invalide : pas mise en cache
+    return content
+
+def parse_text_with_gpt(text: str, known: Optional[dict] = None) -> str: # La fonction retournera toujours un str JSON pour la compatibilité
+    """
+    Analyse le texte de la facture en utilisant Instructor et Pydantic pour garantir
+    une sortie JSON structurée et correcte. Le texte est d'abord compacté (compaction.py :
+    lignes répétées, mentions légales, tableaux de relevés, budget PROMPT_TOKEN_BUDGET).
+    `known` : champs déjà extraits par les regex (fastpath.py), donnés au modèle comme acquis ;
+    il ne cherche que les autres. Les réponses valides sont gardées dans le cache LLM
+    (services/cache/llm_cache.py), clé : modèle, version du prompt, texte normalisé.
+    """
+    text = compaction.compact_for_llm(text, call="parse_gpt")
+    hint = ""
+    if known:
+        hint = ("\n\nChamps déjà extraits du texte (fiables, à reprendre tels quels ; "
+                f"complète uniquement les autres) :\n{json.dumps(known, ensure_ascii=False)}")
+    user_prompt = f"Voici le texte de la facture à analyser:\n\n---\n{text}\n---{hint}"
+    key = llm_cache_key(call="parse_gpt", model=_MODEL, version=_PARSE_VERSION, payload=user_prompt)
+    cached = llm_cache.get(key, call="parse_gpt")
+    if cached is not None:
+        return cached
+    t0 = time.perf_counter()
+    try:
+        facture_model = get_llm_client().chat.completions.create(
+            model=_MODEL,
+            response_model=Facture, # C'est ici que la magie opère
+            max_retries=1,
+            messages=[
+                {"role": "system", "content": _PARSE_SYSTEM},
+                {"role": "user", "content": user_prompt}
+            ],
+            temperature=0.0,
+            seed=42,
+        )
+        metrics.observe_stage("parse_gpt", time.perf_counter() - t0)
+        # Instructor attache la réponse brute (usage tokens) au modèle
+        metrics.record_tokens("parse_gpt", _MODEL,
+                              getattr(getattr(facture_model, "_raw_response", None), "usage", None))
+        # Convertit le modèle Pydantic en dictionnaire puis en string JSON
+        # On renomme 'periode_globale' en 'periode' pour garder la compatibilité avec le reste du code
+        parsed_dict = facture_model.model_dump()
+        parsed_dict['periode'] = parsed_dict.pop('periode_globale', None)
+        result = json.dumps(parsed_dict, indent=2)
+        llm_cache.put(key, result)
+        return result
+
+    except Exception as e:
+        metrics.observe_stage("parse_gpt", time.perf_counter() - t0, ok=False)
+        print(f"[ERREUR] Échec de l'analyse Instructor/Pydantic après les tentatives : {e}")
+        # Retourne un JSON vide ou une structure de secours
+        return json.dumps({"client": {}, "periode": {}, "energies": []})
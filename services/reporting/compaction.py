@@ -0,0 +1,192 @@
+# services/reporting/compaction.py
+"""
+Prompt compaction for `parse_text_with_gpt`: the invoice text is shrunk before the
+structured-extraction call, so prompt size no longer grows with document length.
+
+Line by line, in document order ("=== PAGE n ===" markers are always kept):
+
+  collapse whitespace -> drop separator-only lines -> drop lines already seen
+  (headers / footers repeated on every page) -> drop legal boilerplate -> collapse
+  long runs of numeric table rows (meter readings) to their first and last rows
+
+Key lines — PDL/PCE, kWh, amounts, dates and periods, kVA, HP/HC, the fields of the
+`Facture` schema, and the first lines of the document (client name) — are never
+dropped by these rules. If the result is still above
+PROMPT_TOKEN_BUDGET, plain lines are dropped from the last page upwards (the top of
+page 1, client and summary, goes last), then key lines the same way.
+
+Tokens are estimated at ~4 characters per token (French text). Before / after counts
+go to `metrics.record_compaction` and the log line `prompt_compaction`.
+"""
+from __future__ import annotations
+
+import logging
+import re
+from dataclasses import dataclass
+from typing import List, Optional
+
+from core import metrics
+from core.config import Config
+
+logger = logging.getLogger("pioui.compaction")
+
+_CHARS_PER_TOKEN = 4
+_PAGE_MARKER = re.compile(r"^=== PAGE \d+ ===$")
+_SEPARATOR = re.compile(r"^[\W_]+$")
+_KEY_LINE = re.compile(
+    r"\b\d{14}\b|\bpdl\b|\bpce\b|\bprm\b|kwh|\bkva\b|€|\beur\b|\bttc\b|\bht\b|"
+    r"\d+[.,]\d{2}\b|\b\d{1,2}[/.]\d{1,2}[/.]\d{2,4}\b|\bdu\s+\d{1,2}|"
+    r"heures?\s+(?:pleines|creuses)|\bhp\b|\bhc\b|option|puissance|consommation|abonnement|"
+    r"p[ée]riode|offre|fournisseur|client|titulaire|adresse|\b\d{5}\b|total|montant|"
+    r"[ée]lectricit[ée]|\bgaz\b",
+    re.I,
+)
+_BOILERPLATE = re.compile(
+    r"conditions\s+g[ée]n[ée]rales|\barticle\s+\d+|mandat\s+de\s+pr[ée]l[èe]vement|\bsepa\b|"
+    r"titre\s+interbancaire|m[ée]diateur|donn[ée]es\s+personnelles|\brgpd\b|\bcnil\b|"
+    r"capital\s+(?:social\s+)?de|\brcs\b|\bsiren\b|\bsiret\b|n°\s*tva|tva\s+intracom|"
+    r"\bwww\.|https?://|@\w+\.\w+|r[ée]clamation|litige|conform[ée]ment|en\s+application\s+de",
+    re.I,
+)
+_AMOUNT_LINE = re.compile(r"€|\beur\b|\bttc\b|\bht\b|\btva\b|total|montant|\b\d{14}\b", re.I)
+_STRONG_KEY = re.compile(r"\b\d{14}\b|kwh|\bttc\b", re.I)  # kept even inside boilerplate
+_WORD = re.compile(r"[^\W\d_]{2,}")
+_NUMBER = re.compile(r"\d")
+
+_HEAD_LINES = 15             # first lines of the document (client, supplier, summary) count as key
+_DEDUP_MIN_CHARS = 12        # shorter lines ("Total", "HP") are labels, repeated on purpose
+_PROSE_MIN_CHARS = 100       # boilerplate paragraph line: long, no key token
+_TABLE_RUN_MIN = 6           # numeric rows in a row before collapsing
+_TABLE_RUN_KEEP = 2          # rows kept at each end of a collapsed run
+
+
+@dataclass
+class CompactText:
+    text: str
+    tokens_before: int
+    tokens_after: int
+    lines_before: int
+    lines_after: int
+
+    @property
+    def tokens_saved(self) -> int:
+        return max(self.tokens_before - self.tokens_after, 0)
+
+
+@dataclass
+class _Line:
+    text: str
+    page: int
+    key: bool
+    marker: bool = False
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + _CHARS_PER_TOKEN - 1) // _CHARS_PER_TOKEN
+
+
+def _is_table_row(line: str) -> bool:
+    # "12/01/2024  45 678  45 912  234" or "Relevé 12 345 12 579": digits, at most two words;
+    # summary rows (amounts, totals, PDL/PCE) are never part of a collapsed run
+    return (len(_NUMBER.findall(line)) >= 4 and len(_WORD.findall(line)) <= 2
+            and not _AMOUNT_LINE.search(line))
+
+
+def _filter_lines(text: str) -> List[_Line]:
+    out: List[_Line] = []
+    seen = set()
+    page = 0
+    for raw in text.splitlines():
+        line = " ".join(raw.split())
+        if not line or _SEPARATOR.match(line):
+            continue
+        if _PAGE_MARKER.match(line):
+            page += 1
+            out.append(_Line(line, page, key=True, marker=True))
+            continue
+        folded = line.casefold()
+        if len(line) >= _DEDUP_MIN_CHARS and folded in seen:
+            continue
+        seen.add(folded)
+        key = bool(_KEY_LINE.search(line)) or sum(not l.marker for l in out) < _HEAD_LINES
+        if _BOILERPLATE.search(line) and not (_STRONG_KEY.search(line) and len(line) < _PROSE_MIN_CHARS):
+            continue
+        if not key and len(line) >= _PROSE_MIN_CHARS:
+            continue
+        out.append(_Line(line, page, key=key))
+    return out
+
+
+def _collapse_tables(lines: List[_Line]) -> List[_Line]:
+    out: List[_Line] = []
+    i = 0
+    while i < len(lines):
+        j = i
+        while j < len(lines) and not lines[j].marker and _is_table_row(lines[j].text):
+            j += 1
+        if j - i >= _TABLE_RUN_MIN:
+            run = lines[i:j]
+            omitted = len(run) - 2 * _TABLE_RUN_KEEP
+            out += run[:_TABLE_RUN_KEEP]
+            out.append(_Line(f"[… {omitted} lignes de tableau omises]", run[0].page, key=False, marker=True))
+            out += run[-_TABLE_RUN_KEEP:]
+            i = j
+        else:
+            out.append(lines[i])
+            i += 1
+    return out
+
+
+def _fit_budget(lines: List[_Line], budget: int) -> List[_Line]:
+    total = sum(estimate_tokens(l.text) + 1 for l in lines)
+    if total <= budget:
+        return lines
+    drop = set()
+    # plain lines first, then key lines; each pass from the last page / line upwards
+    for want_key in (False, True):
+        for idx in range(len(lines) - 1, -1, -1):
+            line = lines[idx]
+            if line.marker or line.key != want_key:
+                continue
+            drop.add(idx)
+            total -= estimate_tokens(line.text) + 1
+            if total <= budget:
+                return [l for i, l in enumerate(lines) if i not in drop]
+    return [l for i, l in enumerate(lines) if i not in drop]
+
+
+def _drop_empty_pages(lines: List[_Line]) -> List[_Line]:
+    # a page whose every line was a repeat of an earlier page leaves only its marker
+    return [l for i, l in enumerate(lines)
+            if not (_PAGE_MARKER.match(l.text) and (i + 1 == len(lines) or _PAGE_MARKER.match(lines[i + 1].text)))]
+
+
+def compact_text(text: str, budget: Optional[int] = None) -> CompactText:
+    """Compacted prompt text and its token estimates; `budget` defaults to PROMPT_TOKEN_BUDGET (0 = none)."""
+    budget = Config.PROMPT_TOKEN_BUDGET if budget is None else budget
+    lines = _collapse_tables(_filter_lines(text or ""))
+    if budget > 0:
+        lines = _fit_budget(lines, budget)
+    lines = _drop_empty_pages(lines)
+    out = "\n".join(l.text for l in lines)
+    return CompactText(text=out, tokens_before=estimate_tokens(text or ""), tokens_after=estimate_tokens(out),
+                       lines_before=len((text or "").splitlines()), lines_after=len(lines))
+
+
+def compact_for_llm(text: str, call: str) -> str:
+    """`text` compacted for LLM call `call` (unchanged when PROMPT_COMPACTION_ENABLED is off or on error)."""
+    if not Config.PROMPT_COMPACTION_ENABLED or not text:
+        return text
+    try:
+        result = compact_text(text)
+    except Exception as e:  # compaction must never cost an extraction
+        logger.warning("prompt_compaction_failed: %s", e)
+        return text
+    if not result.text.strip():
+        return text
+    metrics.record_compaction(call, result.tokens_before, result.tokens_after)
+    logger.info("prompt_compaction", extra={
+        "call": call, "tokens_before": result.tokens_before, "tokens_after": result.tokens_after,
+        "tokens_saved": result.tokens_saved, "lines_before": result.lines_before, "lines_after": result.lines_after,
+    })
+    return result.text
@@ -14,38 +14,21 @@ Generates 2 stylish PDF reports (non-anonymous & anonymous) from an energy bill.
 """
 import base64, mimetypes, pathlib
 import os, json, random, datetime
+import contextvars
+import importlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime as dt
-from typing import List, Dict, Any, Tuple, Optional
-import instructor
-from mistralai import Mistral
-from pydantic import BaseModel, Field, field_validator
-from typing import List, Optional
-# --- OpenAI ---
-from openai import OpenAI
+from typing import List, Dict, Any, Tuple, Optional, Callable, Sequence
 from core.config import Config
 import re
-client = OpenAI(api_key=Config.OPENAI_API_KEY)
 import io
-# --- PDF / OCR ---
-import pdfplumber
-from pdf2image import convert_from_path
 import math
-# --- ReportLab ---
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
-from reportlab.lib.units import cm
-from reportlab.lib.enums import TA_RIGHT, TA_CENTER, TA_LEFT
-from reportlab.platypus import (
-    SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, HRFlowable, Image as RLImage
-)
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.pdfgen import canvas as rl_canvas
-from openai import OpenAI
-import instructor
-from core.config import Config
 from pathlib import Path
+from services.reporting.sources import InvoiceSource, read_source_bytes
+from core import metrics
+# Les dépendances lourdes (pdfplumber, openai/instructor, mistralai, reportlab) sont dans
+# services/reporting/backends/ et ne sont importées qu'au premier usage (voir `_backend`).
 
 
 # ───────────────── 🎨 Pioui Branding & Styling 🎨 ─────────────────
@@ -78,6 +61,45 @@ ASSETS_DIR = PKG_ROOT / "assets"
 FONT_DIR   = ASSETS_DIR / "fonts"
 LOGO_PATH  = ASSETS_DIR / "logo" / "pioui.png"
 
+# ───────────────── Backends (importés au premier usage) ─────────────────
+_BACKEND_EXPORTS = {
+    "text": ("extract_pages_text", "extract_text_from_pdf", "iter_pdf_pages", "rasterize_pdf_pages", "page_layout"),
+    "vision": ("get_llm_client", "ocr_invoice_with_gpt", "parse_text_with_gpt",
+               "ClientInfo", "Periode", "EnergyDetails", "Facture"),
+    "pixtral": ("get_mistral_client", "pixtral_extract_invoice", "normalize_pixtral_json"),
+    "tesseract": ("ocr_page_with_tesseract", "tesseract_available"),
+    "render": ("ensure_fonts", "register_poppins_fonts", "IS_POPPINS_AVAILABLE", "BASE_FONT", "BOLD_FONT",
+               "get_pioui_styles", "draw_header_footer", "create_modern_table", "build_pdfs"),
+}
+_LAZY_ATTRS = {attr: backend for backend, attrs in _BACKEND_EXPORTS.items() for attr in attrs}
+
+def _backend(name: str):
+    """Module services.reporting.backends.<name> (importé une seule fois, au premier appel)."""
+    return importlib.import_module(f"services.reporting.backends.{name}")
+
+def __getattr__(name: str):
+    # PEP 562: `engine.build_pdfs`, `from services.reporting.engine import ocr_invoice_with_gpt`... restent valides
+    backend = _LAZY_ATTRS.get(name)
+    if backend is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(_backend(backend), name)
+
+def preload() -> Dict[str, Any]:
+    """
+    Charge tout l'état immuable du moteur : backends, polices, styles, logo, index des vices.
+    Appelé dans le processus parent avant le fork des workers (core/prefork.py) : aucun
+    client réseau n'est créé ici, ils le sont dans chaque worker.
+    """
+    for name in _BACKEND_EXPORTS:
+        _backend(name)
+    info = _backend("render").preload_assets()
+    info["vices_providers"] = sum(len(v) for v in _vices_index().values())
+    if Config.TEMPLATES_ENABLED:
+        info["templates"] = len(_templates().get_registry())
+    info["tesseract"] = bool(Config.TESSERACT_ENABLED and _backend("tesseract").tesseract_available())
+    info["backends"] = list(_BACKEND_EXPORTS)
+    return info
+
 # SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 # LOGO_PATH = os.path.join(SCRIPT_DIR, "logo", "pioui.png")
 # FONT_DIR = os.path.join(SCRIPT_DIR, "fonts")
@@ -279,71 +301,6 @@ def compose_marketing_highlights(parsed: dict,
 
     return lines[:total_max]
 
-def _image_to_data_url(path: str) -> str:
-    mime = mimetypes.guess_type(path)[0] or "image/png"
-    with open(path, "rb") as f:
-        b64 = base64.b64encode(f.read()).decode("ascii")
-    return f"data:%s;base64,%s" % (mime, b64)
-
-# DÃ©finir la structure de sortie avec Pydantic
-class ClientInfo(BaseModel):
-    name: Optional[str] = Field(..., description="Nom complet du client titulaire du contrat.")
-    address: Optional[str] = Field(..., description="Adresse de facturation complète.")
-    zipcode: Optional[str] = Field(..., description="Code postal de l'adresse de facturation.")
-
-class Periode(BaseModel):
-    de: Optional[str] = Field(..., description="Date de début au format JJ/MM/AAAA.")
-    a: Optional[str] = Field(..., description="Date de fin au format JJ/MM/AAAA.")
-    jours: Optional[int] = Field(..., description="Nombre total de jours dans la période.")
-
-class EnergyDetails(BaseModel):
-    type: str = Field(..., description="Le type d'énergie : 'electricite' ou 'gaz'.")
-    periode: Optional[Periode] = Field(..., description="La période de facturation pour la CONSOMMATION réelle de cette énergie, et non la période de l'abonnement.")
-    fournisseur: Optional[str] = Field(..., description="Le nom du fournisseur d'énergie.")
-    offre: Optional[str] = Field(..., description="Le nom commercial de l'offre.")
-    option: Optional[str] = Field(None, description="Pour l'électricité : 'Base' ou 'HP/HC'.")
-    puissance_kVA: Optional[int] = Field(None, description="La puissance souscrite en kVA pour l'électricité.")
-    conso_kwh: Optional[float] = Field(None, description="La consommation totale en kWh pour la période. Peut être null si non trouvée.")
-    total_ttc: Optional[float] = Field(..., description="Le montant total TTC pour cette énergie pour la période.")
-
-    @field_validator("conso_kwh", "total_ttc")
-    def required_field(cls, v):
-        if v is None:
-            # Ce message sera envoyé au LLM en cas d'échec !
-            raise ValueError("Ce champ est manquant. Retrouvez sa valeur dans le document.")
-        return v
-
-
-class Facture(BaseModel):
-    client: ClientInfo
-    periode_globale: Optional[Periode] = Field(..., description="La période de bilan annuel si présente, sinon la période principale.")
-    energies: List[EnergyDetails]
-
-client = instructor.patch(OpenAI(api_key=Config.OPENAI_API_KEY))
-# ───────────────── ✍️ Font Registration (Poppins) ✍️ ─────────────────
-def register_poppins_fonts():
-    try:
-        fonts_to_register = {
-            'Poppins': 'Poppins-Regular.ttf',
-            'Poppins-Bold': 'Poppins-Bold.ttf',
-            'Poppins-Italic': 'Poppins-Italic.ttf',
-            'Poppins-BoldItalic': 'Poppins-BoldItalic.ttf',
-        }
-        for name, filename in fonts_to_register.items():
-            pdfmetrics.registerFont(TTFont(name, os.path.join(FONT_DIR, filename)))
-        pdfmetrics.registerFontFamily(
-            'Poppins', normal='Poppins', bold='Poppins-Bold',
-            italic='Poppins-Italic', boldItalic='Poppins-BoldItalic'
-        )
-        print("[INFO] Famille de polices Poppins enregistrée avec succès.")
-        return True
-    except Exception as e:
-        print(f"[AVERTISSEMENT] Impossible d'enregistrer les polices Poppins. Retour à Helvetica. Erreur : {e}")
-        return False
-
-IS_POPPINS_AVAILABLE = register_poppins_fonts()
-BASE_FONT = "Poppins" if IS_POPPINS_AVAILABLE else "Helvetica"
-BOLD_FONT = "Poppins-Bold" if IS_POPPINS_AVAILABLE else "Helvetica-Bold"
 
 # ───────────────── Utilities ─────────────────
 def _to_float(x, default=None):
@@ -448,71 +405,6 @@ def annualize(value_for_period: Optional[float], days: Optional[int]) -> Optiona
         return None
     return value_for_period * (365.0 / days)
 
-def extract_text_from_pdf(pdf_path: str) -> str:
-    try:
-        out = ""
-        with pdfplumber.open(pdf_path) as pdf:
-            for p in pdf.pages:
-                t = p.extract_text()
-                if t:
-                    out += t + "\n"
-        return out.strip()
-    except Exception:
-        return ""
-
-# ───────────────── GPT extractors ─────────────────
-def ocr_invoice_with_gpt(image_path: str) -> str:
-    system = "Assistant d'analyse de factures énergie. Retourne UNIQUEMENT un JSON valide (un objet)."
-    user_prompt = "Même consignes que précédemment. Image ci-dessous."
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": system},
-            {"role": "user", "content": user_prompt},
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "image_url",
-                        "image_url": {"url": _image_to_data_url(image_path)}
-                    }
-                ],
-            },
-        ],
-        temperature=0.0,
-        seed=42,
-        response_format={"type": "json_object"},
-    )
-    return resp.choices[0].message.content
-
-def parse_text_with_gpt(text: str) -> str: # La fonction retournera toujours un str JSON pour la compatibilité
-    """
-    Analyse le texte de la facture en utilisant Instructor et Pydantic pour garantir
-    une sortie JSON structurée et correcte.
-    """
-    try:
-        facture_model = client.chat.completions.create(
-            model="gpt-4o-mini",
-            response_model=Facture, # C'est ici que la magie opère
-            max_retries=1,
-            messages=[
-                {"role": "system", "content": "Tu es un expert en extraction de données sur les factures d'énergie. Extrais les informations demandées en te basant sur le schéma Pydantic fourni.  Si un champ est marqué comme obligatoire et que tu ne le trouves pas, cherche plus attentivement."},
-                {"role": "user", "content": f"Voici le texte de la facture à analyser:\n\n---\n{text}\n---"}
-            ],
-            temperature=0.0,
-            seed=42,
-        )
-        # Convertit le modèle Pydantic en dictionnaire puis en string JSON
-        # On renomme 'periode_globale' en 'periode' pour garder la compatibilité avec le reste du code
-        parsed_dict = facture_model.model_dump()
-        parsed_dict['periode'] = parsed_dict.pop('periode_globale', None)
-        return json.dumps(parsed_dict, indent=2)
-
-    except Exception as e:
-        print(f"[ERREUR] Échec de l'analyse Instructor/Pydantic après les tentatives : {e}")
-        # Retourne un JSON vide ou une structure de secours
-        return json.dumps({"client": {}, "periode": {}, "energies": []})
-
 # ───────────────── Data processing ─────────────────
 def params_from_energy(global_json: dict, energy_obj: dict, raw_text: str) -> dict:
     zipcode = ((global_json.get("client") or {}).get("zipcode")) or "75001"
@@ -979,6 +871,26 @@ VICES_DB = {
     },
 }
 # ───────────────── Vices cachés (ASCII, no emoji) ─────────────────
+_VICES_INDEX: Optional[Dict[str, list]] = None
+
+def _vices_index() -> Dict[str, list]:
+    """
+    VICES_DB avec clés fournisseurs et motifs d'offres déjà normalisés (construit une fois,
+    avant fork en production) : {énergie: [(fournisseur_norm, règles, [(motifs_norm, règle_offre)])]}.
+    """
+    global _VICES_INDEX
+    if _VICES_INDEX is None:
+        _VICES_INDEX = {
+            energy: [
+                (_norm(prov_key), rules,
+                 [([n for n in (_norm(p) for p in rule.get("name_patterns", [])) if n], rule)
+                  for rule in rules.get("offers", [])])
+                for prov_key, rules in db.items()
+            ]
+            for energy, db in VICES_DB.items()
+        }
+    return _VICES_INDEX
+
 def vices_caches_for(energy: str, fournisseur: Optional[str], offre: Optional[str], n_items: int = 6) -> list[str]:
     """
     Retourne exactement `n_items` vices cachés.
@@ -992,21 +904,21 @@ def vices_caches_for(energy: str, fournisseur: Optional[str], offre: Optional[st
     # 1) spécifiques (fournisseur/offre)
     specifics: list[str] = []
     f_norm, o_norm = _norm(fournisseur or ""), _norm(offre or "")
-    provider_db = None
-    db = VICES_DB.get(energy_key, {})
+    provider = None
 
     if f_norm:
-        for prov_key, prov_rules in db.items():
-            if _norm(prov_key) in f_norm or f_norm in _norm(prov_key):
-                provider_db = prov_rules
+        for entry in _vices_index().get(energy_key, []):
+            if entry[0] in f_norm or f_norm in entry[0]:
+                provider = entry
                 break
 
-    if provider_db:
+    if provider:
+        _, provider_db, offers = provider
         # vices généraux du fournisseur
         specifics.extend(provider_db.get("provider_vices", []))
         # vices spécifiques si l'offre matche
-        for rule in provider_db.get("offers", []):
-            if _match_any(offre, rule.get("name_patterns", [])):
+        for patterns, rule in offers:
+            if any(p in o_norm for p in patterns):
                 specifics.extend(rule.get("offer_vices", []))
 
     # 2) pool générique garanti à 6
@@ -1031,144 +943,6 @@ def vices_caches_for(energy: str, fournisseur: Optional[str], offre: Optional[st
     # 5) tronque à n_items
     return merged[:n_items]
 
-# ───────────────── Styles & PDF Helpers ─────────────────
-def get_pioui_styles() -> Dict[str, ParagraphStyle]:
-    styles = getSampleStyleSheet()
-    styles["BodyText"].fontName = BASE_FONT
-    styles["Italic"].fontName = "Poppins-Italic" if IS_POPPINS_AVAILABLE else "Helvetica-Oblique"
-
-    common_props = {"wordWrap": 'CJK', "splitLongWords": True}
-
-    styles.add(ParagraphStyle(
-        name="H1", fontName=BOLD_FONT, fontSize=22, leading=28,
-        textColor=colors.HexColor(PALETTE["primary_blue"]), spaceAfter=16, **common_props
-    ))
-    styles.add(ParagraphStyle(
-        name="H2", fontName=BOLD_FONT, fontSize=14, leading=18,
-        textColor=colors.HexColor(PALETTE["text_dark"]), spaceAfter=8, **common_props
-    ))
-    styles.add(ParagraphStyle(
-        name="Body", fontName=BASE_FONT, fontSize=10, leading=14,
-        textColor=colors.HexColor(PALETTE["text_dark"]), **common_props
-    ))
-    styles.add(ParagraphStyle(
-        name="Muted", fontName=BASE_FONT, fontSize=9, leading=12,
-        textColor=colors.HexColor(PALETTE["text_muted"]), **common_props
-    ))
-    styles.add(ParagraphStyle(
-        name="ItalicMuted", parent=styles["Muted"],
-        fontName="Poppins-Italic" if IS_POPPINS_AVAILABLE else "Helvetica-Oblique"
-    ))
-    styles.add(ParagraphStyle(
-        name="BodyRight", parent=styles["Body"], alignment=TA_RIGHT
-    ))
-    styles.add(ParagraphStyle(
-        name="FooterText", fontName=BASE_FONT, fontSize=8, leading=11,
-        textColor=colors.white, **common_props
-    ))
-    styles.add(ParagraphStyle(  # Small yellow badge text
-        name="Badge", fontName=BOLD_FONT, fontSize=9.2, leading=12,
-        textColor=colors.HexColor(PALETTE["dark_navy"])
-    ))
-    return styles
-
-def draw_header_footer(title_right=""):
-    def _draw(canv: rl_canvas.Canvas, doc):
-        canv.saveState()
-        width, height = A4
-
-        # === Header ===
-        canv.setFillColor(colors.HexColor(PALETTE["dark_navy"]))
-        canv.rect(0, height - 50, width, 50, stroke=0, fill=1)
-        # Yellow accent bar
-        canv.setFillColor(colors.HexColor(PALETTE["brand_yellow"]))
-        canv.rect(0, height - 52, 160, 2, stroke=0, fill=1)
-
-        if LOGO_PATH and os.path.exists(LOGO_PATH):
-            try:
-                logo = RLImage(LOGO_PATH, width=95, height=35)
-                logo.drawOn(canv, 2 * cm, height - 40)
-            except Exception:
-                canv.setFillColor(colors.white)
-                canv.setFont(BOLD_FONT, 12)
-                canv.drawString(2 * cm, height - 32, "Pioui")
-
-        canv.setFillColor(colors.black)
-        canv.setFont(BASE_FONT, 10)
-        canv.drawRightString(width - 2 * cm, height - 28, "Rapport Comparatif Énergie")
-        canv.setFont(BASE_FONT, 8)
-        canv.setFillColor(colors.HexColor(PALETTE["text_muted"]))
-        canv.drawRightString(width - 2 * cm, height - 40, title_right)
-
-        # === Footer ===
-        canv.setFillColor(colors.HexColor(PALETTE["dark_navy"]))
-        canv.rect(0, 0, width, 70, stroke=0, fill=1)
-        # Yellow thin line above footer content
-        canv.setFillColor(colors.HexColor(PALETTE["brand_yellow"]))
-        canv.rect(0, 68, width, 2, stroke=0, fill=1)
-
-        # Footer content
-        y_pos = 55
-        canv.setFillColor(colors.HexColor("#1E293B"))
-        canv.setFont(BASE_FONT, 8)
-        canv.drawString(2 * cm, y_pos, PIOUI["url"])
-        canv.drawCentredString(width / 2, y_pos, PIOUI["name"])
-        canv.drawRightString(width - 2 * cm, y_pos, f"Page {doc.page}")
-
-        y_pos -= 15
-        canv.setFillColor(colors.HexColor(PALETTE["text_muted"]))
-        canv.drawString(2 * cm, y_pos, PIOUI["email"])
-        canv.drawCentredString(width / 2, y_pos, PIOUI["addr"])
-
-        y_pos -= 15
-        canv.setFillColor(colors.HexColor(PALETTE["text_muted"]))
-        canv.drawCentredString(width / 2, y_pos, PIOUI["tel"])
-
-        y_pos -= 8
-        canv.setStrokeColor(colors.HexColor(PALETTE["border_light"]))
-        canv.line(2 * cm, y_pos, width - 2 * cm, y_pos)
-        y_pos -= 12
-        canv.setFont(BASE_FONT, 7)
-        canv.drawCentredString(width / 2, y_pos, PIOUI["copyright"])
-        canv.restoreState()
-    return _draw
-
-def create_modern_table(rows, col_widths_pts, numeric_cols=None, zebra=True):
-    numeric_cols = set(numeric_cols or [])
-    table = Table(rows, colWidths=col_widths_pts, repeatRows=1)
-
-    style = [
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor(PALETTE["table_header"])),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.HexColor(PALETTE["text_dark"])),
-        ('FONTNAME', (0, 0), (-1, 0), BOLD_FONT),
-        ('FONTSIZE', (0, 0), (-1, 0), 9.5),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 8),
-        ('TOPPADDING', (0, 0), (-1, 0), 8),
-        # Yellow underline under header
-        ('LINEBELOW', (0, 0), (-1, 0), 1.5, colors.HexColor(PALETTE["brand_yellow"])),
-
-        ('FONTNAME', (0, 1), (-1, -1), BASE_FONT),
-        ('FONTSIZE', (0, 1), (-1, -1), 9),
-        ('TEXTCOLOR', (0, 1), (-1, -1), colors.HexColor(PALETTE["text_dark"])),
-        ('VALIGN', (0, 0), (-1, -1), "MIDDLE"),
-        ('TOPPADDING', (0, 1), (-1, -1), 6),
-        ('BOTTOMPADDING', (0, 1), (-1, -1), 6),
-        ('LEFTPADDING', (0, 0), (-1, -1), 6),
-        ('RIGHTPADDING', (0, 0), (-1, -1), 6),
-        ('GRID', (0,0), (-1,-1), 0.25, colors.HexColor(PALETTE["border_light"])),
-    ]
-
-    if zebra and len(rows) > 2:
-        for r in range(1, len(rows)):
-            if r % 2 == 1:
-                style.append(('BACKGROUND', (0, r), (-1, r), colors.HexColor(PALETTE["bg_light"])))
-
-    for c in numeric_cols:
-        style.append(("ALIGN", (c, 1), (c, -1), "RIGHT"))
-
-    table.setStyle(TableStyle(style))
-    return table
-
 # Formatting helpers
 def _fmt_euro(x: Optional[float]) -> str:
     return f"{x:,.2f} €".replace(",", " ").replace(".", ",") if x is not None else "—"
@@ -1226,298 +1000,327 @@ def enforce_single_energy_if_clear(parsed: dict, raw_text: str) -> dict:
     except Exception:
         return parsed
 
-# ───────────────── PDF Builder ─────────────────
-# ───────────────── PDF Builder ─────────────────
-def build_pdfs(parsed: dict, sections: List[Dict[str, Any]], combined_dual: List[Dict[str, Any]]) -> Tuple[bytes, bytes]:
+# ───────────────── Sélection des pages pertinentes (avant le LLM) ─────────────────
+# Une facture arrive souvent avec CGV, talon de paiement, mandat SEPA, annexes légales :
+# on note chaque page (mots-clés de detect_energy_signals + indices regex) et seules les
+# meilleures partent au LLM. Le texte complet reste utilisé par les heuristiques locales.
+_PDL_PCE_RX = re.compile(r"\b\d{14}\b")
+_KWH_RX = re.compile(r"\d[\d\s.,]*\s*kwh\b|kwh\W{0,4}\d", re.I)  # "1 234 kWh" ou JSON OCR "conso_kwh": 1234
+_TTC_RX = re.compile(r"(?:total|montant)[^\n]{0,40}?ttc|ttc[^\n]{0,20}?\d+[.,]\d{2}", re.I)
+_PAGE_HINTS = (
+    # (regex, poids, plafond de hits comptés)
+    (_PDL_PCE_RX, 6, 2),
+    (_KWH_RX, 2, 6),
+    (_TTC_RX, 4, 3),
+    (re.compile(r"\d+[.,]\d{2}\s*(?:€|eur)", re.I), 1, 8),
+    (re.compile(r"\b\d{2}/\d{2}/\d{4}\b"), 1, 6),
+    (re.compile(r"\bdu\s+\d{1,2}[/ .]\w+[/ .]\d{2,4}\s+au\s+\d{1,2}", re.I), 4, 2),
+    (re.compile(r"puissance\s+souscrite|\bkva\b|heures?\s+(?:pleines|creuses)|option\s+base", re.I), 3, 3),
+)
+_PAGE_NOISE = re.compile(
+    r"conditions\s+g[ée]n[ée]rales|\barticle\s+\d+|mandat\s+de\s+pr[ée]l[èe]vement|\bsepa\b|"
+    r"titre\s+interbancaire|talon|m[ée]diateur\s+national|donn[ée]es\s+personnelles|\brgpd\b",
+    re.I,
+)
+
+_PAGE_REL_MIN = 0.25  # part de la meilleure note en dessous de laquelle une page est écartée
+
+def page_relevance(text: str) -> float:
+    """Score d'une page pour l'extraction (0 = rien d'utile ; CGV et talons pénalisés)."""
+    if not text or len(text.strip()) < 20:
+        return 0.0
+    signals = detect_energy_signals(text)["scores"]
+    score = float(min(signals["gaz"] + signals["electricite"], 30))
+    for rx, weight, cap in _PAGE_HINTS:
+        score += weight * min(len(rx.findall(text)), cap)
+    score -= 3 * min(len(_PAGE_NOISE.findall(text)), 10)
+    return max(score, 0.0)
+
+def select_relevant_pages(pages: List[str], top_k: Optional[int] = None,
+                          min_score: Optional[float] = None) -> Tuple[List[int], bool]:
     """
-    Generates two PDF reports in memory and returns them as byte strings.
+    Indices (ordre d'origine) des pages à envoyer au LLM, et si la sélection est fiable.
+    Garde la 1re page (client, récapitulatif) + les `top_k` mieux notées. Si la meilleure
+    note est sous `min_score`, ou qu'un indice PDL/PCE, kWh ou TTC du document ne se trouve
+    que sur des pages écartées, la sélection n'est pas fiable : toutes les pages sont
+    renvoyées si PAGE_SELECT_FALLBACK_ALL.
+    """
+    everything = list(range(len(pages)))
+    top_k = top_k or Config.PAGE_SELECT_TOP_K
+    min_score = Config.PAGE_SELECT_MIN_SCORE if min_score is None else min_score
+    if not Config.PAGE_SELECT_ENABLED or len(pages) <= top_k:
+        return everything, True
+
+    scores = [page_relevance(t) for t in pages]
+    ranked = sorted(everything, key=lambda i: -scores[i])
+    # une page loin derrière la meilleure (CGV qui citent "électricité" et "kWh") n'est pas retenue
+    floor = max(_PAGE_REL_MIN * scores[ranked[0]], 1e-9)
+    keep = sorted({0, *[i for i in ranked[:top_k] if scores[i] >= floor]})
+    # fiable si aucun indice clé (PDL/PCE, kWh, TTC) présent dans le document n'est perdu
+    kept_text, all_text = "\n".join(pages[i] for i in keep), "\n".join(pages)
+    lost = [rx for rx in (_PDL_PCE_RX, _KWH_RX, _TTC_RX) if rx.search(all_text) and not rx.search(kept_text)]
+    confident = max(scores) >= min_score and not lost
+    if not confident and Config.PAGE_SELECT_FALLBACK_ALL:
+        keep = everything
+    metrics.record_pages("llm", sent=len(keep), skipped=len(pages) - len(keep))
+    print(f"[INFO] Pages envoyées au LLM : {[i + 1 for i in keep]} / {len(pages)} "
+          f"(scores {[round(x) for x in scores]}{'' if confident else ', sélection peu fiable'})")
+    return keep, confident
+
+REPORT_VARIANTS = ("full", "anon", "both")
+
+def normalize_variants(x: str | None) -> str:
+    """'full' (non anonyme) | 'anon' (anonyme) | 'both' (défaut)."""
+    v = (x or "both").strip().lower()
+    if v not in REPORT_VARIANTS:
+        raise ValueError(f"Paramètre variants invalide: {x!r}. Utilise: full | anon | both")
+    return v
+
+# â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€ Pipeline â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€
+def _notify_stage(on_stage: Optional[Callable[[str], None]], stage: str) -> None:
+    # La progression ne doit jamais faire échouer le traitement
+    if on_stage is None:
+        return
+    try:
+        on_stage(stage)
+    except Exception as e:
+        print(f"[AVERTISSEMENT] Notification d'étape '{stage}' échouée : {e}")
+
 
-    Returns:
-        (non_anonymous_pdf_bytes, anonymous_pdf_bytes)
+def _join_ocr_pages(texts: List[str], keep: Optional[List[int]] = None) -> str:
+    keep = range(len(texts)) if keep is None else keep
+    return "\n\n".join(f"=== PAGE {i + 1} ===\n{texts[i]}" for i in keep)
+
+def ocr_scanned_pdf(pdf_source: InvoiceSource, dpi: int = 200, max_parallel: Optional[int] = None) -> str:
+    """Texte OCR de toutes les pages, "=== PAGE n ===" dans l'ordre (voir `ocr_scanned_pages`)."""
+    return _join_ocr_pages(ocr_scanned_pages(pdf_source, dpi=dpi, max_parallel=max_parallel))
+
+def _local_ocr():
+    """Backend Tesseract si activé et utilisable, sinon None (toutes les pages vont à GPT vision)."""
+    if not Config.TESSERACT_ENABLED:
+        return None
+    try:
+        tess = _backend("tesseract")
+    except ImportError as e:
+        print(f"[AVERTISSEMENT] pytesseract indisponible ({e}) : OCR local désactivé.")
+        return None
+    return tess if tess.tesseract_available() else None
+
+def ocr_scanned_pages(pdf_source: InvoiceSource, dpi: int = 200, max_parallel: Optional[int] = None,
+                      pages: Optional[Sequence[int]] = None) -> List[str]:
     """
-    def render(anonymous: bool):
-        buffer = io.BytesIO()
-
-        doc = SimpleDocTemplate(
-            buffer,
-            pagesize=A4,
-            leftMargin=2 * cm, rightMargin=2 * cm,
-            topMargin=2.5 * cm + 50,
-            bottomMargin=2.0 * cm + 60
-        )
-        s = get_pioui_styles()
-        story = []
-        W = doc.width
-
-        def cw(*ratios):
-            total = float(sum(ratios))
-            return [W * (r / total) for r in ratios]
-
-        H1 = lambda x: Paragraph(x, s["H1"])
-        H2 = lambda x: Paragraph(x, s["H2"])
-        P  = lambda x: Paragraph(x if isinstance(x, str) else "—", s["Body"])
-        PR = lambda x: Paragraph(x if isinstance(x, str) else "—", s["BodyRight"])
-        PM = lambda x: Paragraph(x if isinstance(x, str) else "—", s["Muted"])
-
-        client = parsed.get("client") or {}
-        right_title = client.get("name") or ""
-        on_page = draw_header_footer(title_right=right_title)
-
-        story.append(H1("Votre Rapport Comparatif"))
-
-        story.append(P(f"<b>Client :</b> {client.get('name') or '—'}"))
-        if client.get("address"):
-            story.append(PM(client["address"]))
-        story.append(Paragraph(f"<i>Généré le {date.today().strftime('%d/%m/%Y')}</i>", s["ItalicMuted"]))
-        story.append(Spacer(1, 10))
-        story.append(HRFlowable(width="100%", color=colors.HexColor(PALETTE["border_light"]), thickness=1))
-        story.append(Spacer(1, 10))
-
-        # — Période
-        periode = parsed.get("periode") or {}
-        p_de, p_a, p_j = periode.get("de"), periode.get("a"), periode.get("jours")
-        if p_de and p_a:
-            story.append(H2("Période de facturation analysée"))
-            story.append(P(f"Du <b>{p_de}</b> au <b>{p_a}</b> (soit {p_j or '~'} jours)"))
-            story.append(Spacer(1, 12))
-
-        # — Sections per energy type
-        for sec in sections:
-            # Reset provider letter mapping for each energy type section
-            provider_letter_map = {}
-            letter_counter = 0
-            
-            params = sec["params"]
-            rows = sec["rows"]
-            if not rows:
-                continue
-            energy_label = "Électricité" if params["energy"] == "electricite" else "Gaz"
-
-            # 1) Offre actuelle
-            story.append(H1(f"Analyse {energy_label}"))
-            story.append(H2("Votre offre actuelle"))
-
-            p_de_sec = params.get("period_start_date")
-            p_a_sec = params.get("period_end_date")
-            p_j_sec = params.get("period_days")
-            if p_de_sec and p_a_sec and p_j_sec:
-                story.append(P(f"<i>Période analysée : Du <b>{p_de_sec}</b> au <b>{p_a_sec}</b> (soit {p_j_sec} jours)</i>"))
-                story.append(Spacer(1, 6))
-
-            conso_period = params.get("period_kwh")
-            total_period = params.get("total_ttc_period")
-            avg_price = (total_period / conso_period) if (total_period and conso_period) else None
-            annual_now = current_annual_total(params)
-
-            head = [P("Fournisseur"), P("Offre"), P("Puissance"), P("Option"), P("Conso. (période)"),
-                    PR("Total TTC (période)"), PR("Prix moyen (€/kWh)"), PR("Estimation annuelle actuelle")]
-            row = [P(f"<b>{params.get('fournisseur') or '—'}</b>"), P(params.get('offre') or '—'),
-                   P(str(params.get('kva')) if params["energy"] == "electricite" else "—"),
-                   P(params.get('option') if params["energy"] == "electricite" else "—"), P(_fmt_kwh(conso_period)),
-                   PR(_fmt_euro(total_period)), PR(f"{avg_price:.4f} €/kWh" if avg_price else "—"),
-                   PR(_fmt_euro(annual_now))]
-            story.append(create_modern_table([head, row], cw(1.3, 1.8, 0.9, 0.9, 1.2, 1.2, 1.2, 1.6),
-                                             numeric_cols={4, 5, 6, 7}, zebra=False))
-            story.append(Spacer(1, 12))
-
-            # 2) Comparatif
-            story.append(H2(f"Comparatif des offres {energy_label}"))
-            if anonymous:
-                # Créer des maps locales pour chaque type d'offre, basées sur leur ordre d'apparition
-                base_offers = [o for o in rows if o.get("option") in (None, "Base")]
-                hphc_offers = [o for o in rows if o.get("option") == "HP/HC"]
-                base_map = {o['provider']: f"Fournisseur Alternatif {chr(65 + i)}" for i, o in
-                            enumerate(base_offers[:3])}
-                hphc_map = {o['provider']: f"Fournisseur Alternatif {chr(65 + i)}" for i, o in
-                            enumerate(hphc_offers[:3])}
-
-            def get_anon_name(provider_name, offer_option):
-                if not anonymous: return provider_name or "—"
-                # Choisit la bonne map (base ou hphc) en fonction de l'option de l'offre
-                current_map = hphc_map if offer_option == "HP/HC" else base_map
-                return current_map.get(provider_name, provider_name or "—")
-
-            if params["energy"] == "electricite":
-                base = [o for o in rows if o.get("option") in (None, "Base")]
-                hphc = [o for o in rows if o.get("option") == "HP/HC"]
-
-                def map_b(o):
-                    return [P(get_anon_name(o["provider"], "Base")), P(o["offer_name"]),
-                            PR(f"{o['price_kwh_ttc']:.4f} €/kWh"), PR(_fmt_euro(o["abonnement_annuel_ttc"])),
-                            PR(f"<b>{_fmt_euro(o['total_annuel_estime'])}</b>")]
-
-                if base:
-                    # Reset provider letter mapping for Base table
-                    provider_letter_map = {}
-                    letter_counter = 0
-                    
-                    story.append(P("<b> Option Base</b>"))
-                    thead = [P("Fournisseur"), P("Offre"), PR("Prix kWh TTC"), PR("Abonnement / an"),
-                             PR("Total estimé / an")]
-                    story.append(create_modern_table([thead] + [map_b(o) for o in base[:3]], cw(1.2, 2.0, 1.0, 1.2, 1.2),
-                                                     numeric_cols={2, 3, 4}))
-                    story.append(Spacer(1, 6))
-
-                def map_h(o):
-                    return [P(get_anon_name(o["provider"], "HP/HC")), P(o["offer_name"]),
-                            PR(f"{o['price_hp_ttc']:.4f} / {o['price_hc_ttc']:.4f} €/kWh"),
-                            PR(_fmt_euro(o["abonnement_annuel_ttc"])),
-                            PR(f"<b>{_fmt_euro(o['total_annuel_estime'])}</b>")]
-
-                if hphc:
-                    story.append(P("<b> Option Heures Pleines / Heures Creuses</b>"))
-                    thead2 = [P("Fournisseur"), P("Offre"), PR("Prix HP / HC"), PR("Abonnement / an"),
-                              PR("Total estimé / an")]
-                    story.append(create_modern_table([thead2] + [map_h(o) for o in hphc[:3]], cw(1.2, 1.8, 1.4, 1.2, 1.2),
-                                                     numeric_cols={2, 3, 4}))
-                    story.append(Spacer(1, 8))
-            else:  # Gaz
-                def map_g(o):
-                    return [P(get_anon_name(o["provider"], "Base")), P(o["offer_name"]),
-                            PR(f"{o['price_kwh_ttc']:.4f} €/kWh"), PR(_fmt_euro(o["abonnement_annuel_ttc"])),
-                            PR(f"<b>{_fmt_euro(o['total_annuel_estime'])}</b>")]
-
-                thead = [P("Fournisseur"), P("Offre"), PR("Prix kWh TTC"), PR("Abonnement / an"),
-                         PR("Total estimé / an")]
-                story.append(create_modern_table([thead] + [map_g(o) for o in rows[:3]], cw(1.2, 2.0, 1.0, 1.2, 1.2),
-                                                 numeric_cols={2, 3, 4}))
-                story.append(Spacer(1, 8))
-
-            # 3) Vices cachés
-            story.append(H2("Points de vigilance (Vices cachés)"))
-            story.append(PM("Analyse sur l’offre actuelle et les alternatives proposées."))
-            story.append(Spacer(1, 4))
-            bullets = vices_caches_for(params["energy"], params.get("fournisseur"), params.get("offre"))
-            for b in bullets:
-                story.append(Paragraph(f"• {b}", s["Body"]))
-            story.append(Spacer(1, 10))
-
-            badge = Table([[Paragraph("Attention aux clauses et indexations", s["Badge"])]], colWidths=[W])
-            badge.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor(PALETTE["brand_yellow"])),
-                ('LEFTPADDING', (0, 0), (-1, -1), 8),
-                ('RIGHTPADDING', (0, 0), (-1, -1), 8),
-                ('TOPPADDING', (0, 0), (-1, -1), 4),
-                ('BOTTOMPADDING', (0, 0), (-1, -1), 4),
-            ]))
-            story.append(badge)
-            story.append(Spacer(1, 12))
-
-            # 4) Reco
-            story.append(H2("Notre recommandation"))
-            best = min(rows, key=lambda x: x["total_annuel_estime"]) if rows else None
-            curr = annual_now
-            if best and curr and best.get("total_annuel_estime"):
-                delta = curr - best["total_annuel_estime"]
-                if delta > 0:
-                    # ✅ MODIFIÉ : La recommandation utilise la même logique pour trouver le nom anonymisé correct
-                    reco_provider_name = get_anon_name(best['provider'], best.get('option'))
-                    reco_text = Paragraph(
-                        f"Économisez jusqu'à <font size='14' color='{PALETTE['saving_red']}'><b>{_fmt_euro(delta)}</b></font> "
-                        f"par an en passant chez <b>{reco_provider_name}</b> avec l'offre <b>{best['offer_name']}</b>."
-                        f" Pour approfondir cette recommandation et obtenir un conseil personnalisé, "
-                        f"nos experts sont joignables au <b>{PIOUI['tel']}</b>.", s["Body"]
-                    )
-                else:
-                    reco_text = Paragraph("Votre offre actuelle semble compétitive. Aucune économie nette identifiée.", s["Body"])
-            else:
-                reco_text = Paragraph("Données insuffisantes pour une recommandation chiffrée fiable.", s["Body"])
-
-            reco_box = Table([[reco_text]], colWidths=[W])
-            reco_box.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor(PALETTE["bg_light"])),
-                ('BOX', (0, 0), (-1, -1), 1, colors.HexColor(PALETTE["border_light"])),
-                ('LEFTPADDING', (0, 0), (-1, -1), 12),
-                ('RIGHTPADDING', (0, 0), (-1, -1), 12),
-                ('TOPPADDING', (0, 0), (-1, -1), 12),
-                ('BOTTOMPADDING', (0, 0), (-1, -1), 12),
-            ]))
-            story.append(reco_box)
-            story.append(Spacer(1, 12))
-            story.append(HRFlowable(width="100%", color=colors.HexColor(PALETTE["border_light"]), thickness=1))
-            story.append(Spacer(1, 12))
-
-        # Pack Dual (optional)
-        if combined_dual:
-            # ✅ MODIFIÉ : Création d'une map locale pour le pack dual
-            dual_map = {}
-            if anonymous:
-                dual_map = {o['provider']: f"Fournisseur Alternatif {chr(65 + i)}" for i, o in
-                            enumerate(combined_dual[:3])}
-
-            story.append(H1("Pack Dual (Électricité + Gaz)"))
-
-            def map_d(o):
-                provider_name = dual_map.get(o["provider"], o["provider"]) if anonymous else o["provider"]
-                return [P(provider_name), P(o["offer_name"]), PR(f"<b>{_fmt_euro(o['total_annuel_estime'])}</b>")]
-
-            thead = [P("Fournisseur"), P("Offres combinées"), PR("Total estimé (élec+gaz)")]
-            story.append(create_modern_table([thead] + [map_d(o) for o in combined_dual[:3]], cw(1.3, 3.0, 1.2),
-                                             numeric_cols={2}))
-            story.append(Spacer(1, 10))
-
-        # Méthodo
-        story.append(H2("Méthodologie & Fiabilité des données"))
-        story.append(Paragraph(
-            "Les données de ce rapport proviennent de votre facture, d’offres publiques de référence, et de barèmes officiels. Les comparaisons sont estimées à partir d’hypothèses réalistes pour illustrer des économies potentielles.",
-            s["Muted"]))
-        story.append(Spacer(1, 6))
-        story.append(Paragraph(
-            "<b>Rapport indépendant</b>, sans publicité ni affiliation. Son seul but : identifier vos économies possibles.",
-            s["Muted"]))
-
-        doc.build(story, onFirstPage=on_page, onLaterPages=on_page)
-        pdf_bytes = buffer.getvalue()
-        buffer.close()
-        return pdf_bytes
-
-    non_anon_bytes = render(anonymous=False)
-    anon_bytes = render(anonymous=True)
-    return non_anon_bytes, anon_bytes
+    OCR d'un PDF scanné, pages en parallèle : un texte par page, dans l'ordre des pages
+    (`pages` : indices à traiter, 0-based ; défaut toutes).
+    - chaque page passe d'abord par Tesseract (local, TESSERACT_ENABLED) ; seules celles dont
+      la confiance est sous TESSERACT_MIN_CONFIDENCE (ou si Tesseract échoue) partent à GPT vision ;
+    - les pages sont rendues une à une, jamais tout le document en mémoire ;
+    - au plus `max_parallel` pages en vol (OCR_PAGE_PARALLELISM) : le rendu de la suivante
+      attend qu'une page se termine ;
+    - l'image envoyée à GPT est préparée (imageprep : recadrée, réduite, JPEG) et la page
+      d'origine relâchée avant l'envoi de la requête.
+    Le temps total tend vers celui de la page la plus lente. Une page en échec fait échouer
+    l'ensemble (les pages pas encore envoyées sont annulées).
+    """
+    from services.reporting import imageprep
 
+    text_backend, vision, tess = _backend("text"), _backend("vision"), _local_ocr()
+    cap = max(1, max_parallel or Config.OCR_PAGE_PARALLELISM)
+    slots = threading.BoundedSemaphore(cap)
+    failed = threading.Event()
 
+    def ocr_page(holder: list) -> str:
+        try:
+            page = holder.pop()  # la page PIL n'est plus référencée que par `page`
+            if tess is not None:
+                try:
+                    text, confidence = tess.ocr_page_with_tesseract(page, dpi=dpi)
+                except Exception as e:
+                    print(f"[AVERTISSEMENT] Tesseract en échec sur une page ({e}), envoi à GPT vision.")
+                    text, confidence = "", -1.0
+                if text.strip() and confidence >= Config.TESSERACT_MIN_CONFIDENCE:
+                    metrics.record_ocr_engine("tesseract")
+                    return text
+            image = imageprep.prepare(page, "openai")
+            del page
+            metrics.record_ocr_engine("gpt")
+            return vision.ocr_invoice_with_gpt(image)
+        except Exception:
+            failed.set()
+            raise
+        finally:
+            slots.release()
 
-# â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€ Pipeline â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€
-def process_invoice_file(pdf_path: str,
+    futures = []
+    images = text_backend.iter_pdf_pages(pdf_source, dpi=dpi, pages=pages)
+    pool = ThreadPoolExecutor(max_workers=cap, thread_name_prefix="ocr-page")
+    try:
+        while True:
+            slots.acquire()  # une place libre avant de rendre la page suivante
+            page = None if failed.is_set() else next(images, None)
+            if page is None:
+                slots.release()
+                break
+            # un contexte copié par page : les métriques gardent les labels de l'appelant
+            futures.append(pool.submit(contextvars.copy_context().run, ocr_page, [page]))
+            del page
+        if not futures:
+            raise ValueError("No pages converted from PDF.")
+        texts = [f.result() for f in futures]
+    finally:
+        images.close()
+        pool.shutdown(wait=False, cancel_futures=True)
+    return texts
+
+def pages_without_text(pdf_source: InvoiceSource, page_texts: List[str]) -> List[int]:
+    """
+    Indices des pages sans couche texte exploitable, à rasteriser pour l'OCR : moins de
+    OCR_PAGE_MIN_CHARS caractères (hors blancs) et des images sur au moins
+    OCR_PAGE_MIN_IMAGE_COVERAGE de la page (une page blanche ou un verso vide n'est pas OCRisé).
+    """
+    thin = [i for i, t in enumerate(page_texts) if len("".join((t or "").split())) < Config.OCR_PAGE_MIN_CHARS]
+    if not thin:
+        return []
+    coverage = _backend("text").image_coverage(pdf_source)
+    if len(coverage) != len(page_texts):
+        return thin  # couverture inconnue : toutes les pages pauvres en texte
+    return [i for i in thin if coverage[i] >= Config.OCR_PAGE_MIN_IMAGE_COVERAGE]
+
+def _templates():
+    from services.reporting import templates  # importe engine (via fastpath) : chargé au premier appel
+    return templates
+
+def template_extract(pdf_source: InvoiceSource) -> Optional[dict]:
+    """
+    Champs lus directement dans les boîtes de mots si la mise en page correspond à un gabarit
+    fournisseur connu (services/reporting/templates.py), sinon None. Aucun appel LLM.
+    """
+    if not Config.TEMPLATES_ENABLED:
+        return None
+    try:
+        registry = _templates().get_registry()
+        if not len(registry):
+            return None
+        with metrics.stage("template"):
+            layout = _backend("text").page_layout(pdf_source, max_pages=Config.TEMPLATE_MAX_PAGES)
+            parsed, template, missing = registry.extract(layout)
+    except Exception as e:
+        print(f"[AVERTISSEMENT] Gabarit fournisseur indisponible ({type(e).__name__}: {e}).")
+        return None
+    if parsed is not None:
+        print(f"[INFO] Gabarit {template.name} reconnu : champs lus sans appel LLM.")
+    elif template is not None:
+        print(f"[INFO] Gabarit {template.name} reconnu mais champs illisibles : {', '.join(missing)}")
+    return parsed
+
+def _fastpath():
+    from services.reporting import fastpath  # fastpath importe engine : chargé au premier appel
+    return fastpath
+
+def fast_extract(text: str):
+    """
+    Extraction regex des champs `Facture` (services/reporting/fastpath.py), ou None si
+    FASTPATH_ENABLED est désactivé ou en cas d'erreur. `complete` : l'appel LLM peut être évité.
+    """
+    if not Config.FASTPATH_ENABLED or not text:
+        return None
+    try:
+        with metrics.stage("fastpath"):
+            fast = _fastpath().extract_invoice_fields(text)
+    except Exception as e:
+        print(f"[AVERTISSEMENT] Extraction regex échouée ({e}), analyse LLM complète.")
+        return None
+    metrics.record_fastpath("complete" if fast.complete else "partial")
+    if not fast.complete:
+        print(f"[INFO] Extraction regex partielle, champs manquants pour le LLM : {', '.join(fast.missing)}")
+    return fast
+
+def analyze_invoice_file(pdf_source: InvoiceSource,
                          energy_mode: str = "auto",
                          confidence_min: float = 0.5,
-                         strict: bool = True) -> Tuple[bytes, bytes, List[str]]:
+                         strict: bool = True,
+                         on_stage: Optional[Callable[[str], None]] = None,
+                         ) -> Tuple[dict, List[Dict[str, Any]], List[Dict[str, Any]], List[str]]:
     """
-    Processes a PDF invoice file and returns the generated reports as raw bytes.
-    This version is modified for stateless API usage and does not write report files to disk.
+    Extraction stage of `process_invoice_file` (text/OCR + LLM + offers), without rendering.
+    Returns (parsed, sections, combined_dual, highlights); `build_pdfs` can be run
+    separately on the first three (e.g. in another process).
+    `pdf_source` is a path, raw bytes/memoryview or a binary file-like: the engine writes no
+    intermediate files.
+    `on_stage` is called with "extracting" (text layer and OCR) then "llm" once, right before
+    the first structuring call (job progress events); "llm" is skipped when a supplier template (`template_extract`) or the regex fast path
+    (`fast_extract`) finds every field.
     """
-    pdf_path = os.path.abspath(pdf_path)
+    pdf_bytes = read_source_bytes(pdf_source)
+    text_backend, vision = _backend("text"), _backend("vision")
 
     # --- All processing logic remains the same ---
-    text = extract_text_from_pdf(pdf_path)
+    _notify_stage(on_stage, "extracting")
+    page_texts = text_backend.extract_pages_text(pdf_bytes)
+    text = "\n".join(t for t in page_texts if t).strip()
     parsed = None
+    ocr_done: Dict[int, str] = {}
+    ocr_only = 0  # pages OCRisées d'un PDF sans couche texte (hors `ocr_done`)
+    llm_notified = False  # "llm" une seule fois, juste avant le premier appel de structuration
     if text and len(text) > 60:
-        print("[INFO] PDF basé sur le texte trouvé. Analyse avec GPT...")
-        raw = parse_text_with_gpt(text)
-        try:
-            parsed = json.loads(raw)
-        except Exception:
-            print("[AVERTISSEMENT] Échec de l'analyse JSON. Retour à l'OCR...")
+        scanned = pages_without_text(pdf_bytes, page_texts) if Config.OCR_HYBRID_ENABLED else []
+        if scanned:
+            # PDF mixte : seules les pages image sont rendues et OCRisées, les autres gardent leur texte
+            # l'OCR des pages image fait partie de l'étape "extracting"
+            print(f"[INFO] PDF mixte : OCR des pages {[i + 1 for i in scanned]} / {len(page_texts)}, texte pour les autres. Analyse avec GPT...")
+            try:
+                ocr_done = dict(zip(scanned, ocr_scanned_pages(pdf_bytes, dpi=200, pages=scanned)))
+            except Exception as e:
+                print(f"[AVERTISSEMENT] OCR des pages image échoué ({e}), analyse du texte seul.")
+        else:
+            print("[INFO] PDF basé sur le texte trouvé. Analyse avec GPT...")
+        merged = [ocr_done.get(i, t) for i, t in enumerate(page_texts)]
+        if ocr_done:
+            # détection d'énergie et kWh dérivés voient aussi les pages OCRisées
+            text = "\n".join(t for t in merged if t).strip()
+        # gabarit fournisseur (couche texte seule), puis regex, puis LLM pour ce qui manque
+        parsed = template_extract(pdf_bytes) if not ocr_done else None
+        if parsed is None:
+            fast = fast_extract("\n".join(t for t in merged if t))
+            if fast is not None and fast.complete:
+                print("[INFO] Tous les champs trouvés par les regex : appel LLM évité.")
+                parsed = fast.parsed
+            else:
+                _notify_stage(on_stage, "llm")
+                llm_notified = True
+                known = fast.known() if fast is not None else None
+                if ocr_done:
+                    keep, _ = select_relevant_pages(merged)
+                    raw = vision.parse_text_with_gpt(_join_ocr_pages(merged, [i for i in keep if merged[i]]), known=known)
+                else:
+                    keep, _ = select_relevant_pages(page_texts)
+                    raw = vision.parse_text_with_gpt("\n".join(page_texts[i] for i in keep if page_texts[i]).strip(),
+                                                     known=known)
+                try:
+                    parsed = json.loads(raw)
+                except Exception:
+                    print("[AVERTISSEMENT] Échec de l'analyse JSON. Retour à l'OCR...")
+                if parsed and fast is not None:
+                    parsed = _fastpath().merge_into(parsed, fast)
     if not parsed:
-        print("[INFO] Le PDF est basé sur des images ou l'analyse de texte a échoué. Utilisation de l'OCR via GPT-4o (toutes les pages)...")
+        print("[INFO] Le PDF est basé sur des images ou l'analyse de texte a échoué. OCR de toutes les pages (Tesseract, puis GPT-4o si confiance faible)...")
         try:
-            # Note: This part still creates temporary image files from the PDF for OCR, which is necessary.
-            out_dir = os.path.dirname(pdf_path)
-            basename = os.path.splitext(os.path.basename(pdf_path))[0]
-            pages = convert_from_path(pdf_path, dpi=200)
-            if not pages:
-                raise ValueError("No pages converted from PDF.")
-
-            all_ocr_text = []
-            for i, page in enumerate(pages):
-                tmp_img = os.path.join(out_dir, f"{basename}_page{i + 1}_temp.png")
-                page.save(tmp_img, "PNG")
-                page_text = ocr_invoice_with_gpt(tmp_img)
-                all_ocr_text.append(f"=== PAGE {i + 1} ===\n{page_text}")
-                os.remove(tmp_img)
-
-            combined_ocr = "\n\n".join(all_ocr_text)
-            raw = parse_text_with_gpt(combined_ocr)
+            # Pages rendues une à une et envoyées en parallèle (aucun fichier image temporaire) ;
+            # celles déjà OCRisées par le passage mixte ne sont pas renvoyées.
+            if not page_texts:
+                ocr_pages = ocr_scanned_pages(pdf_bytes, dpi=200)
+                ocr_only = len(ocr_pages)
+            else:
+                todo = [i for i in range(len(page_texts)) if i not in ocr_done]
+                if todo:
+                    ocr_done.update(zip(todo, ocr_scanned_pages(pdf_bytes, dpi=200, pages=todo)))
+                ocr_pages = [ocr_done[i] for i in range(len(page_texts))]
+            if len(text) <= 60:
+                # PDF scanné : le texte OCR sert aussi à la détection d'énergie et aux kWh dérivés
+                text = "\n".join(t for t in ocr_pages if t).strip()
+            keep, _ = select_relevant_pages(ocr_pages)
+            if not llm_notified:
+                _notify_stage(on_stage, "llm")
+            raw = vision.parse_text_with_gpt(_join_ocr_pages(ocr_pages, keep))
             parsed = json.loads(raw)
 
         except Exception as e:
@@ -1527,6 +1330,8 @@ def process_invoice_file(pdf_path: str,
                 "periode": {"de": None, "a": None, "jours": None},
                 "energies": [{"type": "electricite", "fournisseur": None, "offre": None, "option": "Base", "puissance_kVA": 6, "conso_kwh": 3500, "total_ttc": None}]
             }
+    # routes comptées une fois, d'après le routage final (le repli OCR reprend des pages texte)
+    metrics.record_page_routes(text=len(page_texts) - len(ocr_done), ocr=len(ocr_done) + ocr_only)
 
     periode = parsed.get("periode") or {}
     if not periode.get("jours") and periode.get("de") and periode.get("a"):
@@ -1569,175 +1374,48 @@ def process_invoice_file(pdf_path: str,
                 })
             combined_dual.sort(key=lambda x: x["total_annuel_estime"])
 
-    non_anon_bytes, anon_bytes = build_pdfs(parsed, sections, combined_dual)
-
     # Compute highlights for API response
     highlights = compose_marketing_highlights(parsed, sections, _diag, total_max=4)
 
-    return non_anon_bytes, anon_bytes, highlights
+    return parsed, sections, combined_dual, highlights
 
-_PIXTRAL_SYSTEM = (
-    "You extract structured data from French electricity/gas invoices. "
-    "Return ONLY a JSON object (no prose, no markdown). "
-    "If something is not visible, return an empty string for that field."
-)
-
-_PIXTRAL_USER_INSTRUCTIONS = """\
-From these image(s) of a French utility invoice, return this JSON:
-
-{
-  "type_facture": "electricite|gaz|dual",
-  "client": {"name":"", "address":"", "zipcode":""},
-  "periode": {"de":"JJ/MM/AAAA", "a":"JJ/MM/AAAA", "jours":""},
-  "energies": [
-    {
-      "type":"electricite|gaz",
-      "fournisseur":"",
-      "offre":"",
-      "option":"Base|Heures Creuses|HP/HC",
-      "puissance_kVA":"",
-      "conso_kwh_total":"",
-      "conso_hc_kwh":"",
-      "conso_hp_kwh":"",
-      "prix_hc_eur_kwh":"",
-      "prix_hp_eur_kwh":"",
-      "abonnement_ttc":"",
-      "total_ttc":""
-    }
-  ]
-}
 
-Rules:
-- Copy numbers as printed (e.g., '98,68 €', '0,1894'); do not invent values.
-- Use empty string "" for any unknown field.
-- Use French field names exactly as shown.
-"""
-
-def _fr_num(s):
-    import re
-    if not isinstance(s, str): return None
-    x = re.sub(r"[^\d,.\-]", "", s)
-    if "," in x and "." in x: x = x.replace(".", "").replace(",", ".")
-    elif "," in x: x = x.replace(",", ".")
-    try: return float(x)
-    except: return None
-
-def _extract_json_loose(s: str) -> dict:
-    import json, re
-    try:
-        return json.loads(s)
-    except Exception:
-        m = re.search(r"\{.*\}", s, flags=re.S)
-        if not m:
-            raise
-        return json.loads(m.group(0))
-
-def normalize_pixtral_json(data: dict) -> dict:
-    """Coerce fields to what the pipeline expects."""
-    import re
-
-    # periode.jours -> int if str
-    j = (data.get("periode") or {}).get("jours")
-    if isinstance(j, str):
-        m = re.search(r"\d+", j)
-        data["periode"]["jours"] = int(m.group(0)) if m else None
-
-    # fill zipcode if missing (extract from address)
-    cli = data.get("client") or {}
-    if (cli.get("zipcode") in (None, "")) and cli.get("address"):
-        m = re.search(r"\b\d{5}\b", cli["address"])
-        if m:
-            cli["zipcode"] = m.group(0)
-            data["client"] = cli
-
-    energies = data.get("energies") or []
-    for e in energies:
-        # Normalize option
-        opt = (e.get("option") or "").strip().lower()
-        if opt in {"heures creuses", "hp/hc", "heures pleines/creuses", "heures pleines et creuses", "hc/hp", "hp hc"}:
-            e["option"] = "HP/HC"
-        elif opt in {"base", "option base"}:
-            e["option"] = "Base"
-
-        # Numbers => floats
-        for k in ("conso_kwh_total","conso_hc_kwh","conso_hp_kwh",
-                  "prix_hc_eur_kwh","prix_hp_eur_kwh",
-                  "abonnement_ttc","total_ttc"):
-            if k in e and isinstance(e[k], str):
-                e[k] = _fr_num(e[k])
-
-        # puissance -> int
-        if isinstance(e.get("puissance_kVA"), str):
-            m = re.search(r"\d+", e["puissance_kVA"])
-            e["puissance_kVA"] = int(m.group(0)) if m else None
-
-        # Add legacy key  pipeline expects
-        if e.get("conso_kwh") is None and e.get("conso_kwh_total") is not None:
-            e["conso_kwh"] = e["conso_kwh_total"]
-
-        # Fix total kWh if inconsistent with HP/HC
-        hp = e.get("conso_hp_kwh") or 0
-        hc = e.get("conso_hc_kwh") or 0
-        if (hp or hc):
-            s = (hp or 0) + (hc or 0)
-            tot = e.get("conso_kwh_total")
-            if tot is None or (s and abs(s - tot) / max(s, 1) > 0.2) or (tot and tot > 20000):
-                e["conso_kwh_total"] = s
-                e["conso_kwh"] = s
-
-    data["energies"] = energies
-    return data
-
-def pixtral_extract_invoice(image_paths: List[str],
-                            model: str = "pixtral-large-latest",
-                            energy_hint: str | None = None) -> dict:
-    """Call Mistral Pixtral on 1..8 images and return normalized JSON."""
-    if not Config.MISTRAL_API_KEY:
-        raise RuntimeError("Set MISTRAL_API_KEY in your environment or Config.")
-    if len(image_paths) > 8:
-        raise ValueError("Pixtral accepts up to 8 images per request.")
-
-    client = Mistral(api_key=Config.MISTRAL_API_KEY)
-
-    content = [{"type": "text", "text": _PIXTRAL_USER_INSTRUCTIONS}]
-    if energy_hint and energy_hint != "auto":
-        content.insert(0, {"type": "text", "text": f"Type attendu: {energy_hint}."})
-
-    # Reuse  existing helper to embed as data URLs
-    for p in image_paths:
-        content.append({"type": "image_url", "image_url": _image_to_data_url(p)})
-
-    resp = client.chat.complete(
-        model=model,
-        messages=[
-            {"role": "system", "content": _PIXTRAL_SYSTEM},
-            {"role": "user", "content": content},
-        ],
-        response_format={"type": "json_object"},
-        temperature=0,
-        max_tokens=2200,
+def process_invoice_file(pdf_source: InvoiceSource,
+                         energy_mode: str = "auto",
+                         confidence_min: float = 0.5,
+                         strict: bool = True,
+                         variants: str = "both") -> Tuple[Optional[bytes], Optional[bytes], List[str]]:
+    """
+    Processes a PDF invoice file and returns the generated reports as raw bytes.
+    This version is modified for stateless API usage and does not write report files to disk.
+    `variants` ('full' | 'anon' | 'both') selects which report(s) are rendered; the other is None.
+    """
+    variants = normalize_variants(variants)
+    parsed, sections, combined_dual, highlights = analyze_invoice_file(
+        pdf_source, energy_mode=energy_mode, confidence_min=confidence_min, strict=strict
     )
-    print("[Mistral] usage:", getattr(resp, "usage", None))
-    raw = resp.choices[0].message.content
-    parsed = _extract_json_loose(raw)
-    return normalize_pixtral_json(parsed)
-
+    non_anon_bytes, anon_bytes = _backend("render").build_pdfs(parsed, sections, combined_dual, variants=variants)
+    return non_anon_bytes, anon_bytes, highlights
 
-def process_image_files(image_paths: List[str],
+def analyze_image_files(images: List[InvoiceSource],
                         energy_mode: str = "auto",
                         confidence_min: float = 0.5,
-                        strict: bool = True) -> Tuple[bytes, bytes, List[str]]:
+                        strict: bool = True,
+                        on_stage: Optional[Callable[[str], None]] = None,
+                        ) -> Tuple[dict, List[Dict[str, Any]], List[Dict[str, Any]], List[str]]:
     """
-    Processes invoice images and returns the generated reports as raw bytes.
-    This version is modified for stateless API usage and does not write report files to disk.
+    Extraction stage of `process_image_files` (Pixtral + offers), without rendering.
+    `images` are paths, raw bytes/memoryviews or binary file-likes.
+    Returns (parsed, sections, combined_dual, highlights). `on_stage` receives "llm".
     """
-    if not image_paths:
+    if not images:
         raise ValueError("No image paths provided")
 
     # --- All processing logic remains the same ---
-    print(f"[INFO] Extraction de la structure avec Pixtral ({len(image_paths)} image(s))...")
+    print(f"[INFO] Extraction de la structure avec Pixtral ({len(images)} image(s))...")
+    _notify_stage(on_stage, "llm")
     model = os.getenv("PIOUI_PIXTRAL_MODEL", "pixtral-large-latest")
-    parsed = pixtral_extract_invoice(image_paths, model=model, energy_hint=(energy_mode if energy_mode != "auto" else None))
+    parsed = _backend("pixtral").pixtral_extract_invoice(images, model=model, energy_hint=(energy_mode if energy_mode != "auto" else None))
 
     periode = parsed.get("periode") or {}
     if not periode.get("jours") and periode.get("de") and periode.get("a"):
@@ -1780,11 +1458,27 @@ def process_image_files(image_paths: List[str],
                 })
             combined_dual.sort(key=lambda x: x["total_annuel_estime"])
 
-    non_anon_bytes, anon_bytes = build_pdfs(parsed, sections, combined_dual)
-
     # Compute highlights for API response
     highlights = compose_marketing_highlights(parsed, sections, _diag, total_max=4)
 
+    return parsed, sections, combined_dual, highlights
+
+
+def process_image_files(images: List[InvoiceSource],
+                        energy_mode: str = "auto",
+                        confidence_min: float = 0.5,
+                        strict: bool = True,
+                        variants: str = "both") -> Tuple[Optional[bytes], Optional[bytes], List[str]]:
+    """
+    Processes invoice images and returns the generated reports as raw bytes.
+    This version is modified for stateless API usage and does not write report files to disk.
+    `variants` ('full' | 'anon' | 'both') selects which report(s) are rendered; the other is None.
+    """
+    variants = normalize_variants(variants)
+    parsed, sections, combined_dual, highlights = analyze_image_files(
+        images, energy_mode=energy_mode, confidence_min=confidence_min, strict=strict
+    )
+    non_anon_bytes, anon_bytes = _backend("render").build_pdfs(parsed, sections, combined_dual, variants=variants)
     return non_anon_bytes, anon_bytes, highlights
 
 # CLI - Updated to handle both PDFs and images
@@ -1804,6 +1498,8 @@ if __name__ == "__main__":
                         help="Ne pas bloquer en cas de contradiction forte; avertir seulement")
     parser.add_argument("--vlm", choices=["pixtral", "gpt"], default="pixtral",
                         help="Vision backend for images (default: pixtral).")
+    parser.add_argument("--variants", choices=list(REPORT_VARIANTS), default="both",
+                        help="Rapport(s) à générer: full | anon | both (par défaut: both)")
 
     args = parser.parse_args()
 
@@ -1851,7 +1547,8 @@ if __name__ == "__main__":
                 input_paths[0],
                 energy_mode=args.energy,
                 confidence_min=max(0.0, min(1.0, args.conf)),
-                strict=(not args.no_strict)
+                strict=(not args.no_strict),
+                variants=args.variants,
             )
         else:
             # Image processing (single or multiple)
@@ -1864,7 +1561,8 @@ if __name__ == "__main__":
                 input_paths,
                 energy_mode=args.energy,
                 confidence_min=max(0.0, min(1.0, args.conf)),
-                strict=(not args.no_strict)
+                strict=(not args.no_strict),
+                variants=args.variants,
             )
 
         print("\n🎉 Rapports générés avec succès !")
@@ -0,0 +1,310 @@
+# services/reporting/fastpath.py
+"""
+Deterministic invoice extraction from the PDF text layer, ahead of `parse_text_with_gpt`.
+
+Every field of the `Facture` schema has a regex extractor: client name, address and
+zipcode, consumption period, energy type (`detect_energy_signals`), supplier, offer,
+option, kVA, TTC total and kWh (`derive_consumptions_from_text` first). A field is
+"sure" only when its evidence is unambiguous — a labelled value, or every candidate in
+the document agreeing. Otherwise it is left to the LLM.
+
+`extract_invoice_fields` returns the fields in the `parse_text_with_gpt` JSON shape
+plus the set of sure paths. When `complete` (every REQUIRED path is sure), the engine
+skips the LLM; otherwise GPT runs with the sure values as hints and `merge_into`
+keeps them over its answer. Dual-energy invoices never complete here: totals and kWh
+per energy are too layout-specific for a regex.
+"""
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass, field
+from datetime import datetime as dt
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from services.reporting.engine import (
+    PROVIDERS_ELEC, PROVIDERS_GAZ, _norm, _parse_date_fr, derive_consumptions_from_text, detect_energy_signals,
+)
+
+# paths of the parse_text_with_gpt JSON; "energy.*" = the single energy of the invoice
+REQUIRED = (
+    "client.name", "client.zipcode", "periode.de", "periode.a",
+    "energy.type", "energy.fournisseur", "energy.offre", "energy.total_ttc", "energy.conso_kwh",
+)
+REQUIRED_ELEC = ("energy.option", "energy.puissance_kVA")
+
+_MONTHS = {
+    "janvier": 1, "fevrier": 2, "mars": 3, "avril": 4, "mai": 5, "juin": 6, "juillet": 7, "aout": 8,
+    "septembre": 9, "octobre": 10, "novembre": 11, "decembre": 12,
+}
+_DATE = r"(\d{1,2}[/.]\d{1,2}[/.]\d{2,4}|\d{1,2}(?:er)?\s+[a-zéèêëûôîàç]+\.?\s+\d{4})"
+_PERIOD_RX = re.compile(rf"\bdu\s+{_DATE}\s+au\s+{_DATE}", re.I)
+_AMOUNT = r"(\d{1,3}(?:[\s\u00a0\u202f.]\d{3})*,\d{2}|\d+[.,]\d{2})"
+_TTC_LABELS = (
+    re.compile(rf"total\s+(?:de\s+(?:ma|votre|la)\s+facture\s+)?(?:\w+\s+)?ttc\b[^\d\n]{{0,40}}{_AMOUNT}", re.I),
+    re.compile(rf"montant\s+(?:total\s+)?(?:de\s+(?:ma|votre|la)\s+facture\s+)?ttc\b[^\d\n]{{0,40}}{_AMOUNT}", re.I),
+    re.compile(rf"total\s+(?:facture|factur[ée])\b[^\d\n]{{0,40}}{_AMOUNT}", re.I),
+)
+_KVA_RX = re.compile(r"\b(\d{1,2})\s*kva\b", re.I)
+_KVA_LABEL_RX = re.compile(r"puissance\s+souscrite\D{0,30}(\d{1,2})\s*kva\b", re.I)
+_STANDARD_KVA = {3, 6, 9, 12, 15, 18, 24, 30, 36}
+_OPTION_RX = re.compile(
+    r"option\s*(?:tarifaire)?\s*[:\-]?\s*(base|heures?\s+pleines?\s*(?:/|-|et)\s*heures?\s+creuses?|hp\s*/?\s*hc|tempo|ejp)",
+    re.I,
+)
+_HP_KWH_RX = re.compile(r"heures? pleines?[^\n]{0,60}\bkwh\b")
+_HC_KWH_RX = re.compile(r"heures? creuses?[^\n]{0,60}\bkwh\b")
+_OFFER_RX = re.compile(r"(?:votre\s+|nom\s+de\s+l['’]\s*|l['’])?offre(?:\s+souscrite)?\s*[:\-]\s*([^\n]{3,60})", re.I)
+_KNOWN_OFFERS = re.compile(r"\b(tarif\s+bleu|tarif\s+r[ée]glement[ée])\b", re.I)
+_CONSO_LABEL_RX = re.compile(
+    r"(?:total\s+)?consommation(?:\s+factur[ée]e)?(?:\s+de\s+la\s+p[ée]riode)?\s*[:\-]?\s*(\d{1,3}(?:[\s\u00a0\u202f]\d{3})*|\d+)\s*kwh",
+    re.I,
+)
+_CIVILITY_RX = re.compile(
+    r"^(?i:m\.?\s+(?:ou|et)\s+mme|monsieur\s+(?:ou|et)\s+madame|m\.|mme|mlle|monsieur|madame)\s+"
+    r"([A-ZÀ-Ü][A-Za-zÀ-ÿ'’\- ]{2,60})$"
+)
+_HOLDER_RX = re.compile(r"(?:titulaire(?:\s+du\s+contrat)?|nom\s+du\s+client)\s*:\s*([A-ZÀ-Ü][A-Za-zÀ-ÿ'’.\- ]{2,60})$", re.I)
+_ZIP_LINE_RX = re.compile(r"^(?:\d{1,4}\s+[^\n]*\s)?(\d{5})\s+[A-ZÀ-Ü][A-ZÀ-Ü'’\- ]{1,40}(?:\s+CEDEX(?:\s+\d+)?)?$")
+_STREET_RX = re.compile(r"^\d{1,4}\s*(?:bis|ter)?\s*,?\s+\w", re.I)
+
+# extra spellings of the suppliers in PROVIDERS_ELEC / PROVIDERS_GAZ
+_SUPPLIER_ALIASES = {
+    "EDF": ("edf", "electricite de france"),
+    "Engie": ("engie",),
+    "TotalEnergies": ("totalenergies", "total energies", "total direct energie"),
+    "Plenitude (ex Eni)": ("plenitude", "eni gas"),
+    "Happ-e by Engie": ("happ e",),
+    "Gaz de Bordeaux": ("gaz de bordeaux",),
+    "Octopus Energy": ("octopus energy",),
+}
+
+
+@dataclass
+class FastExtraction:
+    parsed: Dict[str, Any]
+    sure: Set[str] = field(default_factory=set)
+    required: Tuple[str, ...] = REQUIRED
+
+    @property
+    def missing(self) -> List[str]:
+        return [p for p in self.required if p not in self.sure]
+
+    @property
+    def complete(self) -> bool:
+        return not self.missing
+
+    def known(self) -> Dict[str, Any]:
+        """Sure values only, in the parse_text_with_gpt shape (LLM hints)."""
+        out: Dict[str, Any] = {}
+        for path in sorted(self.sure):
+            scope, key = path.split(".", 1)
+            if scope == "energy":
+                out.setdefault("energies", [{}])[0][key] = self.parsed["energies"][0].get(key)
+            else:
+                out.setdefault(scope, {})[key] = self.parsed[scope].get(key)
+        if {"periode.de", "periode.a"} <= self.sure:
+            out["periode"]["jours"] = self.parsed["periode"]["jours"]  # never mixed with another period's
+        return out
+
+
+def _lines(text: str) -> List[str]:
+    return [" ".join(l.split()) for l in text.splitlines() if l.strip()]
+
+
+def _date(s: str) -> Optional[str]:
+    """'12/01/2024', '12.01.24', '1er janvier 2024' -> 'JJ/MM/AAAA'."""
+    s = s.strip().lower()
+    m = re.match(r"(\d{1,2})[/.](\d{1,2})[/.](\d{2,4})$", s)
+    if m:
+        d, mo, y = (int(x) for x in m.groups())
+        y = y + 2000 if y < 100 else y
+    else:
+        m = re.match(r"(\d{1,2})(?:er)?\s+([a-z]+)\.?\s+(\d{4})$", _norm(s))
+        if not m or m.group(2) not in _MONTHS:
+            return None
+        d, mo, y = int(m.group(1)), _MONTHS[m.group(2)], int(m.group(3))
+    try:
+        return dt(y, mo, d).strftime("%d/%m/%Y")
+    except ValueError:
+        return None
+
+
+def _amount(s: str) -> Optional[float]:
+    s = re.sub(r"[\s\u00a0\u202f]", "", s)
+    if "," in s:
+        s = s.replace(".", "").replace(",", ".")
+    try:
+        return float(s)
+    except ValueError:
+        return None
+
+
+def _unique(values: List[Any]) -> Tuple[Optional[Any], bool]:
+    """(first value, every candidate agrees)."""
+    distinct = list(dict.fromkeys(v for v in values if v is not None))
+    return (distinct[0] if distinct else None), len(distinct) == 1
+
+
+def _period(lines: List[str]) -> Tuple[Optional[Tuple[str, str]], bool]:
+    labelled, others = [], []
+    for line in lines:
+        for m in _PERIOD_RX.finditer(line):
+            pair = (_date(m.group(1)), _date(m.group(2)))
+            if None in pair:
+                continue
+            low = _norm(line)
+            if "abonnement" in low or "echeance" in low or "prochaine" in low:
+                continue  # subscription billed in advance, next instalments
+            (labelled if "consommation" in low or "periode" in low else others).append(pair)
+    if labelled:
+        return _unique(labelled)
+    return _unique(others)
+
+
+def _supplier(text_norm: str) -> Tuple[Optional[str], bool]:
+    counts = {}
+    for name in dict.fromkeys(PROVIDERS_ELEC + PROVIDERS_GAZ):
+        aliases = _SUPPLIER_ALIASES.get(name, (_norm(name),))
+        n = sum(len(re.findall(rf"\b{re.escape(a)}\b", text_norm)) for a in aliases)
+        if n:
+            counts[name] = n
+    if not counts:
+        return None, False
+    ranked = sorted(counts.items(), key=lambda kv: -kv[1])
+    best, n = ranked[0]
+    runner_up = ranked[1][1] if len(ranked) > 1 else 0
+    return best, n >= 2 and n >= 3 * runner_up
+
+
+def _offer(lines: List[str]) -> Tuple[Optional[str], bool]:
+    labelled = []
+    for line in lines:
+        m = _OFFER_RX.search(line)
+        if m:
+            value = re.split(r"\s{2,}|\s[-|]\s|\bpuissance\b|\boption\b", m.group(1), flags=re.I)[0].strip(" .:-")
+            if len(value) >= 3 and re.search(r"[A-Za-zÀ-ÿ]{3}", value):
+                labelled.append(value)
+    if labelled:
+        return _unique(labelled)
+    known = [m.group(1).title() for line in lines for m in _KNOWN_OFFERS.finditer(line)]
+    return _unique(known)
+
+
+def _option(text: str, text_norm: str) -> Tuple[Optional[str], bool]:
+    found = []
+    for m in _OPTION_RX.finditer(text):
+        v = _norm(m.group(1))
+        found.append("Base" if v == "base" else "HP/HC" if ("creuse" in v or "hp" in v) else v.upper())
+    if found:
+        value, sure = _unique(found)
+        return value, sure and value in ("Base", "HP/HC")
+    # no option label: HP/HC only if both periods carry metered kWh
+    hp_hc = _HP_KWH_RX.search(text_norm) and _HC_KWH_RX.search(text_norm)
+    return ("HP/HC", True) if hp_hc else (None, False)
+
+
+def _kva(text: str) -> Tuple[Optional[int], bool]:
+    labelled = [int(x) for x in _KVA_LABEL_RX.findall(text)]
+    values = labelled or [int(x) for x in _KVA_RX.findall(text)]
+    return _unique([v for v in values if v in _STANDARD_KVA])
+
+
+def _total_ttc(text: str) -> Tuple[Optional[float], bool]:
+    for rx in _TTC_LABELS:
+        values = [_amount(a) for a in rx.findall(text)]
+        values = [v for v in values if v is not None and v > 0]
+        if values:
+            return _unique(values)
+    return None, False
+
+
+def _conso_kwh(text: str, energy: str, days: Optional[int]) -> Tuple[Optional[float], bool]:
+    period_kwh, _ = derive_consumptions_from_text(text, energy, days)
+    if period_kwh:
+        return period_kwh, True
+    values = [float(re.sub(r"\D", "", x)) for x in _CONSO_LABEL_RX.findall(text)]
+    return _unique([v for v in values if v > 0])
+
+
+def _client(lines: List[str]) -> Dict[str, Tuple[Optional[str], bool]]:
+    names = []
+    for i, line in enumerate(lines):
+        m = _CIVILITY_RX.match(line) or _HOLDER_RX.search(line)
+        if m:
+            names.append((i, m.group(0).strip() if _CIVILITY_RX.match(line) else m.group(1).strip()))
+    name, name_sure = _unique([n for _, n in names])
+    out: Dict[str, Tuple[Optional[str], bool]] = {"name": (name, name_sure), "address": (None, False),
+                                                  "zipcode": (None, False)}
+    if not name:
+        return out
+    # the billing address follows the first occurrence of the name: street lines, then "75011 PARIS"
+    first = next(i for i, n in names if n == name)
+    block = []
+    for line in lines[first + 1:first + 5]:
+        zm = _ZIP_LINE_RX.match(line)
+        block.append(line)
+        if zm:
+            out["zipcode"] = (zm.group(1), True)
+            out["address"] = (", ".join(block), any(_STREET_RX.match(l) for l in block))
+            break
+    return out
+
+
+def extract_invoice_fields(text: str) -> FastExtraction:
+    """Regex extraction of the Facture fields from the text layer (see module docstring)."""
+    lines = _lines(text or "")
+    text_norm = _norm(text or "")
+    sure: Set[str] = set()
+
+    def keep(path: str, pair: Tuple[Any, bool]) -> Any:
+        value, ok = pair
+        if value is not None and ok:
+            sure.add(path)
+        return value
+
+    client = {k: keep(f"client.{k}", v) for k, v in _client(lines).items()}
+    period = _period(lines)
+    de, a = (period[0] or (None, None))
+    keep("periode.de", (de, period[1]))
+    keep("periode.a", (a, period[1]))
+    d1, d2 = _parse_date_fr(de) if de else None, _parse_date_fr(a) if a else None
+    jours = (d2 - d1).days if d1 and d2 and d1 < d2 else None
+    periode = {"de": de, "a": a, "jours": jours}
+
+    decision = detect_energy_signals(text or "")["decision"]
+    parsed: Dict[str, Any] = {"client": client, "periode": periode, "energies": []}
+    required = REQUIRED
+    if len(decision) == 1:
+        energy_type = next(iter(decision))
+        energy: Dict[str, Any] = {"type": keep("energy.type", (energy_type, True)), "periode": dict(periode)}
+        energy["fournisseur"] = keep("energy.fournisseur", _supplier(text_norm))
+        energy["offre"] = keep("energy.offre", _offer(lines))
+        if energy_type == "electricite":
+            energy["option"] = keep("energy.option", _option(text or "", text_norm))
+            energy["puissance_kVA"] = keep("energy.puissance_kVA", _kva(text or ""))
+            required = REQUIRED + REQUIRED_ELEC
+        else:
+            energy["option"], energy["puissance_kVA"] = None, None
+        energy["total_ttc"] = keep("energy.total_ttc", _total_ttc(text or ""))
+        energy["conso_kwh"] = keep("energy.conso_kwh", _conso_kwh(text or "", energy_type, jours))
+        parsed["energies"] = [energy]
+    return FastExtraction(parsed=parsed, sure=sure, required=required)
+
+
+def merge_into(parsed: Dict[str, Any], fast: FastExtraction) -> Dict[str, Any]:
+    """`parsed` (LLM answer) with every sure regex value written over it."""
+    known = fast.known()
+    for scope in ("client", "periode"):
+        if scope in known:
+            parsed[scope] = {**(parsed.get(scope) or {}), **known[scope]}
+    if "energies" in known:
+        energies = parsed.get("energies") or []
+        etype = fast.parsed["energies"][0]["type"]
+        target = next((e for e in energies if (e.get("type") or "").startswith(etype)), None)
+        if target is None and len(energies) <= 1:
+            target = energies[0] if energies else {}
+            energies = [target]
+        if target is not None:
+            target.update(known["energies"][0])
+        parsed["energies"] = energies
+    return parsed
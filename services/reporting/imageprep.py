@@ -0,0 +1,215 @@
+# services/reporting/imageprep.py
+"""
+In-memory image preparation for vision LLM calls (GPT OCR fallback, Pixtral).
+
+Sending the raw file wastes upload time and tokens: a 200-dpi PNG page or a 12 MP
+phone photo is downscaled by the provider anyway. `prepare_image` does it on our
+side, without touching the disk:
+
+  EXIF auto-orient -> flatten alpha on white -> optional grayscale -> crop empty
+  margins -> downscale to the model's effective resolution -> JPEG / WebP encode
+  (default "auto": the smaller of JPEG and PNG)
+
+Profiles follow each model's own resizing, so nothing it would have seen is lost:
+- "openai": fit in 2048x2048, then shortest side <= 768 (detail=high); image tokens
+  = 85 + 170 per 512 px tile.
+- "pixtral": longest side <= IMAGE_PREP_PIXTRAL_MAX_SIDE; ~1 token per 16x16 patch
+  plus one per patch row (estimate).
+
+Every prepared image reports its budget (source / sent bytes, estimated tokens) to
+`metrics.record_image`. Anything PIL cannot decode is sent unchanged.
+"""
+from __future__ import annotations
+
+import base64
+import io
+import logging
+import math
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+from core import metrics
+from core.config import Config
+from services.reporting.sources import read_source_bytes, source_mime
+
+logger = logging.getLogger("pioui.imageprep")
+
+
+@dataclass(frozen=True)
+class Profile:
+    max_long: int
+    max_short: int
+    tile: int = 0          # openai: 512 px tiles
+    patch: int = 0         # pixtral: 16 px patches
+
+
+PROFILES: Dict[str, Profile] = {
+    "openai": Profile(max_long=2048, max_short=768, tile=512),
+    "pixtral": Profile(max_long=Config.IMAGE_PREP_PIXTRAL_MAX_SIDE, max_short=Config.IMAGE_PREP_PIXTRAL_MAX_SIDE,
+                       patch=16),
+}
+
+_MIME = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+
+@dataclass
+class PreparedImage:
+    data: bytes
+    mime: str
+    size: Tuple[int, int]
+    source_bytes: int
+    tokens: int
+
+    def data_url(self) -> str:
+        return f"data:{self.mime};base64,{base64.b64encode(self.data).decode('ascii')}"
+
+    def budget(self) -> Dict[str, Any]:
+        return {"source_bytes": self.source_bytes, "sent_bytes": len(self.data),
+                "width": self.size[0], "height": self.size[1], "tokens": self.tokens}
+
+
+def estimate_tokens(size: Tuple[int, int], profile: Profile) -> int:
+    """Image input tokens for an image of `size` already within the profile's limits."""
+    w, h = size
+    if profile.tile:
+        return 85 + 170 * math.ceil(w / profile.tile) * math.ceil(h / profile.tile)
+    if profile.patch:
+        rows = math.ceil(h / profile.patch)
+        return math.ceil(w / profile.patch) * rows + rows
+    return 0
+
+
+def target_size(size: Tuple[int, int], profile: Profile, tile_slack: float = 1.0) -> Tuple[int, int]:
+    """
+    Largest size within the profile's limits. With `tile_slack` < 1, a tiled profile gives
+    up to that much resolution when it saves a row / column of tiles (768x1086 -> 724x1024:
+    6 tiles -> 4, -6% pixels per side).
+    """
+    w, h = size
+    scale = min(1.0, profile.max_long / max(w, h), profile.max_short / min(w, h))
+    if profile.tile and tile_slack < 1.0:
+        snaps = [profile.tile * (d // profile.tile) / d for d in (w * scale, h * scale)
+                 if d > profile.tile and d % profile.tile]
+        snaps = [f for f in snaps if f >= tile_slack]
+        if snaps:
+            scale *= min(snaps)
+    return max(1, round(w * scale)), max(1, round(h * scale))
+
+
+def _content_box(gray, threshold: int = 24, pad: int = 8):
+    """Bounding box of the non-background pixels (background = the brightest corner)."""
+    from PIL import Image, ImageChops
+
+    w, h = gray.size
+    background = max(gray.getpixel(p) for p in ((0, 0), (w - 1, 0), (0, h - 1), (w - 1, h - 1)))
+    diff = ImageChops.difference(gray, Image.new("L", gray.size, background))
+    box = diff.point(lambda p: 255 if p > threshold else 0).getbbox()
+    if not box:
+        return None
+    x0, y0, x1, y1 = box
+    return max(0, x0 - pad), max(0, y0 - pad), min(w, x1 + pad), min(h, y1 + pad)
+
+
+def _open(image):
+    from PIL import Image
+
+    if isinstance(image, Image.Image):
+        return image, None
+    data = read_source_bytes(image)
+    im = Image.open(io.BytesIO(data))
+    return im, data
+
+
+def prepare_image(image: Any, profile: str = "openai", *, fmt: Optional[str] = None,
+                  quality: Optional[int] = None, grayscale: Optional[bool] = None,
+                  crop: Optional[bool] = None) -> PreparedImage:
+    """
+    `image`: path, bytes, file-like or an already decoded PIL image (OCR fallback pages;
+    its `source_bytes` is then the uncompressed pixel size).
+    Options default to IMAGE_PREP_FORMAT / _QUALITY / _GRAYSCALE / _CROP.
+    """
+    from PIL import Image, ImageOps
+
+    prof = PROFILES[profile]
+    fmt = (fmt or Config.IMAGE_PREP_FORMAT).upper()
+    fmt = "JPEG" if fmt == "JPG" else fmt
+    quality = quality or Config.IMAGE_PREP_QUALITY
+    grayscale = Config.IMAGE_PREP_GRAYSCALE if grayscale is None else grayscale
+    crop = Config.IMAGE_PREP_CROP if crop is None else crop
+
+    im, data = _open(image)
+    source_bytes = len(data) if data is not None else im.width * im.height * len(im.getbands())
+    if data is not None and im.format == "JPEG":
+        # DCT-domain downscale while decoding: a 12 MP photo is never fully decoded
+        im.draft("L" if grayscale else "RGB", target_size(im.size, prof))
+    im = ImageOps.exif_transpose(im)
+
+    if im.mode in ("RGBA", "LA") or (im.mode == "P" and "transparency" in im.info):
+        rgba = im.convert("RGBA")
+        flat = Image.new("RGB", rgba.size, "white")
+        flat.paste(rgba, mask=rgba.getchannel("A"))
+        im = flat
+    im = im.convert("L" if grayscale else "RGB")
+
+    if crop:
+        box = _content_box(im if grayscale else im.convert("L"))
+        if box and (box[2] - box[0]) * (box[3] - box[1]) < 0.97 * im.width * im.height:
+            im = im.crop(box)
+
+    size = target_size(im.size, prof, Config.IMAGE_PREP_TILE_SLACK)
+    if size != im.size:
+        im = im.resize(size, Image.LANCZOS, reducing_gap=3.0)
+
+    if fmt == "AUTO":
+        # clean scans / screenshots (flat background, sharp text) are often smaller as PNG
+        fmt, data = min((_encode(im, f, quality) for f in ("JPEG", "PNG")), key=lambda r: len(r[1]))
+    else:
+        fmt, data = _encode(im, fmt, quality)
+    return PreparedImage(data, _MIME[fmt], im.size, source_bytes, estimate_tokens(im.size, prof))
+
+
+def _encode(im, fmt: str, quality: int) -> Tuple[str, bytes]:
+    buf = io.BytesIO()
+    if fmt == "PNG":
+        im.save(buf, "PNG", optimize=False)
+    elif fmt == "WEBP":
+        im.save(buf, "WEBP", quality=quality, method=4)
+    else:
+        fmt = "JPEG"
+        im.save(buf, "JPEG", quality=quality, optimize=True)
+    return fmt, buf.getvalue()
+
+
+def _png(image) -> bytes:
+    buf = io.BytesIO()
+    image.save(buf, "PNG")
+    return buf.getvalue()
+
+
+def prepare(image: Any, profile: str) -> Any:
+    """
+    `prepare_image` behind the IMAGE_PREP_ENABLED switch, timed as stage "image_prep".
+    Returns a PreparedImage, or the original source when preparation is off or fails
+    (a PIL image is then PNG-encoded, as before this stage existed).
+    """
+    from PIL import Image
+
+    if Config.IMAGE_PREP_ENABLED:
+        try:
+            with metrics.stage("image_prep"):
+                return prepare_image(image, profile)
+        except Exception as e:
+            # not an image PIL can read: the provider gets the original bytes
+            logger.warning("image_prep_failed: %s: %s", type(e).__name__, e)
+    return _png(image) if isinstance(image, Image.Image) else image
+
+
+def to_data_url(image: Any, profile: str, call: str) -> str:
+    """Data URL of `image` (source, PIL image or PreparedImage) for one vision call; records its budget."""
+    prepared = image if isinstance(image, PreparedImage) else prepare(image, profile)
+    if not isinstance(prepared, PreparedImage):
+        data = read_source_bytes(prepared)
+        return f"data:{source_mime(prepared, data)};base64,{base64.b64encode(data).decode('ascii')}"
+    metrics.record_image(call, prepared.source_bytes, len(prepared.data), prepared.tokens)
+    logger.info("image_budget", extra={"call": call, "profile": profile, **prepared.budget()})
+    return prepared.data_url()
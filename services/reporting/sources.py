@@ -0,0 +1,90 @@
+# services/reporting/sources.py
+"""
+Input helpers for the engine: every entry point accepts a path, raw bytes
+(bytes / bytearray / memoryview) or a binary file-like object, so the API can hand
+uploads over without writing them to disk first.
+"""
+from __future__ import annotations
+
+import base64
+import io
+import mimetypes
+import os
+from typing import BinaryIO, Optional, Union
+
+# path | raw bytes | binary file-like
+InvoiceSource = Union[str, os.PathLike, bytes, bytearray, memoryview, BinaryIO]
+
+_MAGIC = (
+    (b"%PDF-", "application/pdf"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"II*\x00", "image/tiff"),
+    (b"MM\x00*", "image/tiff"),
+    (b"BM", "image/bmp"),
+    (b"PK\x03\x04", "application/zip"),
+)
+
+
+def sniff_mime(head: bytes) -> Optional[str]:
+    """MIME type from the first bytes of a file (magic numbers), None if unknown."""
+    head = bytes(head[:16])
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    for magic, mime in _MAGIC:
+        if head.startswith(magic):
+            return mime
+    # PDFs may carry a few junk bytes before the header
+    if b"%PDF-" in head:
+        return "application/pdf"
+    return None
+
+
+def is_path(src: InvoiceSource) -> bool:
+    return isinstance(src, (str, os.PathLike))
+
+
+def read_source_bytes(src: InvoiceSource) -> bytes:
+    """Returns the full content of `src` as bytes (reads the file for a path / file-like)."""
+    if isinstance(src, bytes):
+        return src
+    if isinstance(src, (bytearray, memoryview)):
+        return bytes(src)
+    if is_path(src):
+        with open(src, "rb") as f:
+            return f.read()
+    if hasattr(src, "seek"):
+        src.seek(0)
+    return src.read()
+
+
+def as_binary_stream(src: InvoiceSource) -> Union[str, BinaryIO]:
+    """Something pdfplumber / PIL can open: the path itself, or a seekable binary stream."""
+    if is_path(src):
+        return os.fspath(src)
+    if isinstance(src, (bytes, bytearray, memoryview)):
+        return io.BytesIO(src)
+    if hasattr(src, "seek"):
+        src.seek(0)
+    return src
+
+
+def source_mime(src: InvoiceSource, data: Optional[bytes] = None, default: str = "image/png") -> str:
+    """MIME of `src`: extension for paths, magic bytes otherwise."""
+    if is_path(src):
+        guessed = mimetypes.guess_type(os.fspath(src))[0]
+        if guessed:
+            return guessed
+    if data is not None:
+        return sniff_mime(data) or default
+    return default
+
+
+def image_to_data_url(image: InvoiceSource) -> str:
+    """Data URL from a path, raw bytes/memoryview or a binary file-like (MIME from extension or magic bytes)."""
+    data = read_source_bytes(image)
+    mime = source_mime(image, data)
+    b64 = base64.b64encode(data).decode("ascii")
+    return f"data:{mime};base64,{b64}"
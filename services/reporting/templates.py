@@ -0,0 +1,543 @@
+# services/reporting/templates.py
+"""
+Supplier layout templates: coordinate-based field extractors for known PDF layouts.
+
+Most invoices come from a handful of suppliers whose layouts barely change. A layout
+is identified in two steps:
+- `layout_key`: hash of the PDF producer / creator (versions stripped), the fonts of
+  page 1 and the set of anchor labels ("Total TTC", "Puissance souscrite", "PDL"...)
+  present on page 1;
+- each template registered under that key then checks its *fixed* anchors are where
+  it expects them (ANCHOR_TOLERANCE, fraction of the page height).
+
+A matching template reads every field straight from the word boxes of the text layer
+(`page_layout`): words whose centre falls in the field box, relative to its anchor
+label (or absolute when the field has no label, like the client name). The result is
+validated (types, dates in order, every REQUIRED path) before the LLM is skipped;
+anything else falls back to the regex fast path, then GPT.
+
+Templates are JSON files in TEMPLATE_DIR, one per layout, generated offline from
+invoices the LLM parsed successfully (`scripts/learn_templates.py`, see `learn`).
+`TemplateRegistry.stats()` and `pioui_template_lookups_total{outcome}` give the hit rate.
+"""
+from __future__ import annotations
+
+import glob
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from dataclasses import dataclass
+from datetime import datetime as dt
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from core import metrics
+from core.config import Config
+from services.reporting.engine import _norm, _parse_date_fr
+from services.reporting.fastpath import REQUIRED, REQUIRED_ELEC, _amount, _date
+
+logger = logging.getLogger("pioui.templates")
+
+TEMPLATE_VERSION = 1
+ANCHORS = (
+    "total ttc", "montant ttc", "total a payer", "montant total", "puissance souscrite", "option tarifaire",
+    "option", "offre", "votre offre", "consommation", "periode", "pdl", "pce", "point de livraison",
+    "reference client", "numero client", "titulaire", "date de facture", "kva", "kwh",
+)
+ANCHOR_TOLERANCE = 0.03      # anchor drift accepted at match time (fraction of page height)
+_Y_PAD = 2.0                 # points above / below a learned value box
+
+# path -> value type (address spans several lines: left to the regex fast path / LLM)
+FIELD_TYPES = {
+    "client.name": "text", "client.zipcode": "zipcode", "periode.de": "date", "periode.a": "date",
+    "energy.offre": "text", "energy.option": "option",
+    "energy.puissance_kVA": "int", "energy.total_ttc": "amount", "energy.conso_kwh": "number",
+}
+CONSTANT_PATHS = ("energy.type", "energy.fournisseur")  # same for every invoice of a layout, never read
+
+Word = Sequence[Any]  # [x0, y0, x1, y1, text]
+
+
+# ───────────────── Fingerprint ─────────────────
+def _family(s: str) -> str:
+    # "Apache FOP Version 2.6" -> "apache fop version"; versions change, the tool does not
+    return " ".join(t for t in _norm(s).split() if not any(c.isdigit() for c in t))
+
+
+def _reading_order(words: List[Word]) -> List[Word]:
+    return sorted(words, key=lambda w: (round(w[3]), w[0]))
+
+
+def _find_labels(words: List[Word], label: str,
+                 norm: Optional[List[str]] = None) -> List[Tuple[float, float, float, float]]:
+    """Boxes of every occurrence of `label` (normalized tokens, consecutive words in reading order)."""
+    tokens = label.split()
+    norm = norm if norm is not None else [_norm(w[4]) for w in words]
+    found = []
+    for i in range(len(words) - len(tokens) + 1):
+        if norm[i:i + len(tokens)] == tokens:
+            span = words[i:i + len(tokens)]
+            if max(w[3] for w in span) - min(w[3] for w in span) > 3:
+                continue  # tokens on different lines
+            found.append((min(w[0] for w in span), min(w[1] for w in span),
+                          max(w[2] for w in span), max(w[3] for w in span)))
+    return found
+
+
+def _find_label(words: List[Word], label: str,
+                norm: Optional[List[str]] = None) -> Optional[Tuple[float, float, float, float]]:
+    found = _find_labels(words, label, norm)
+    return found[0] if found else None
+
+
+def _nearest(boxes: List[Tuple[float, float, float, float]], at: Optional[Sequence[float]]):
+    # a label repeated on the page ("Consommation" in a title and in the summary): the one where it was learned
+    if not boxes:
+        return None
+    if not at:
+        return boxes[0]
+    return min(boxes, key=lambda b: abs(b[0] - at[0]) + 4 * abs(b[1] - at[1]))  # lines first
+
+
+def page_anchors(page: Dict[str, Any]) -> Dict[str, Tuple[float, float, float, float]]:
+    words = _reading_order(page["words"])
+    norm = [_norm(w[4]) for w in words]
+    found = {}
+    for label in ANCHORS:
+        box = _find_label(words, label, norm)
+        if box is not None:
+            found[label] = box
+    return found
+
+
+def layout_key(layout: Dict[str, Any]) -> str:
+    first = layout["pages"][0] if layout.get("pages") else {"words": []}
+    payload = {
+        "producer": _family(layout.get("producer") or ""),
+        "creator": _family(layout.get("creator") or ""),
+        "fonts": sorted({_family(f) for f in layout.get("fonts") or []}),
+        "anchors": sorted(page_anchors(first)),
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+# ───────────────── Reading fields ─────────────────
+def _words_in(words: List[Word], box: Sequence[float]) -> str:
+    x0, y0, x1, y1 = box
+    inside = [w for w in words
+              if x0 <= (w[0] + w[2]) / 2 <= x1 and y0 <= (w[1] + w[3]) / 2 <= y1]
+    return " ".join(w[4] for w in _reading_order(inside)).strip()
+
+
+def _parse(kind: str, raw: str) -> Any:
+    if not raw:
+        return None
+    if kind == "text":
+        return raw.strip(" :-")
+    if kind == "zipcode":
+        m = re.search(r"\b(\d{5})\b", raw)
+        return m.group(1) if m else None
+    if kind == "date":
+        m = re.search(r"\d{1,2}[/.]\d{1,2}[/.]\d{2,4}", raw)
+        return _date(m.group(0)) if m else None
+    if kind == "int":
+        m = re.search(r"\d{1,3}", raw)
+        return int(m.group(0)) if m else None
+    if kind == "amount":
+        found = re.findall(r"\d{1,3}(?:[\s.]\d{3})*,\d{2}|\d+[.,]\d{2}", raw)
+        return _amount(found[-1]) if found else None
+    if kind == "number":
+        m = re.search(r"\d{1,3}(?:\s\d{3})*(?:,\d+)?|\d+(?:[.,]\d+)?", raw)
+        return _amount(m.group(0)) if m else None
+    if kind == "option":
+        v = _norm(raw)
+        if "creuse" in v or re.search(r"\bhp\b|\bhc\b", v):
+            return "HP/HC"
+        return "Base" if "base" in v else None
+    return None
+
+
+def _valid(path: str, value: Any) -> bool:
+    if value in (None, ""):
+        return False
+    if path == "energy.puissance_kVA":
+        return value in (3, 6, 9, 12, 15, 18, 24, 30, 36)
+    if path in ("energy.total_ttc", "energy.conso_kwh"):
+        return value > 0
+    return True
+
+
+@dataclass
+class Template:
+    key: str
+    supplier: Optional[str]
+    energy: str
+    anchors: Dict[str, Dict[str, Any]]      # label -> {"page", "box", "fixed", "height"}
+    fields: Dict[str, Dict[str, Any]]       # path -> {"type", "page", "anchor", "at", "box"}
+    constants: Dict[str, Any]
+    name: str = ""
+    samples: int = 1
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any], name: str = "") -> "Template":
+        return cls(key=d["key"], supplier=d.get("supplier"), energy=d["energy"], anchors=d.get("anchors") or {},
+                   fields=d.get("fields") or {}, constants=d.get("constants") or {}, name=name,
+                   samples=int(d.get("samples") or 1))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"version": TEMPLATE_VERSION, "key": self.key, "supplier": self.supplier, "energy": self.energy,
+                "samples": self.samples, "anchors": self.anchors, "fields": self.fields,
+                "constants": self.constants}
+
+    @property
+    def required(self) -> Tuple[str, ...]:
+        return REQUIRED + (REQUIRED_ELEC if self.energy == "electricite" else ())
+
+    def matches(self, layout: Dict[str, Any]) -> bool:
+        """Every fixed anchor within ANCHOR_TOLERANCE of its learned position."""
+        pages = layout.get("pages") or []
+        ordered: Dict[int, Tuple[List[Word], List[str]]] = {}
+        for label, a in self.anchors.items():
+            if not a.get("fixed"):
+                continue
+            if a["page"] >= len(pages):
+                return False
+            if a["page"] not in ordered:
+                words = _reading_order(pages[a["page"]]["words"])
+                ordered[a["page"]] = (words, [_norm(w[4]) for w in words])
+            box = _nearest(_find_labels(ordered[a["page"]][0], label, ordered[a["page"]][1]), a["box"])
+            tol = ANCHOR_TOLERANCE * pages[a["page"]]["height"]
+            if box is None or abs(box[1] - a["box"][1]) > tol or abs(box[0] - a["box"][0]) > tol:
+                return False
+        return True
+
+    def read(self, layout: Dict[str, Any]) -> Dict[str, Any]:
+        """{path: value} of every field found and valid (missing ones are left out)."""
+        pages = layout.get("pages") or []
+        values: Dict[str, Any] = dict(self.constants)
+        words_by_page: Dict[int, List[Word]] = {}
+        for path, rule in self.fields.items():
+            if rule["page"] >= len(pages):
+                continue
+            words = words_by_page.setdefault(rule["page"], pages[rule["page"]]["words"])
+            box = list(rule["box"])
+            if rule.get("anchor"):
+                at = _nearest(_find_labels(_reading_order(words), rule["anchor"]), rule.get("at"))
+                if at is None:
+                    continue
+                box = [at[0] + box[0], at[1] + box[1], at[0] + box[2], at[1] + box[3]]
+            value = _parse(rule["type"], _words_in(words, box))
+            if _valid(path, value):
+                values[path] = value
+        return values
+
+    def extract(self, layout: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], List[str]]:
+        """(parsed JSON in the parse_text_with_gpt shape, or None; missing required paths)."""
+        values = self.read(layout)
+        missing = [p for p in self.required if p not in values]
+        de, a = values.get("periode.de"), values.get("periode.a")
+        d1, d2 = _parse_date_fr(de) if de else None, _parse_date_fr(a) if a else None
+        if d1 and d2 and d1 >= d2:
+            missing += ["periode.de", "periode.a"]
+        if missing:
+            return None, missing
+        periode = {"de": de, "a": a, "jours": (d2 - d1).days}
+        energy = {"type": self.energy, "periode": dict(periode), "option": None, "puissance_kVA": None}
+        energy.update({p.split(".", 1)[1]: v for p, v in values.items() if p.startswith("energy.")})
+        parsed = {
+            "client": {"name": values.get("client.name"), "address": None, "zipcode": values.get("client.zipcode")},
+            "periode": periode,
+            "energies": [energy],
+        }
+        return parsed, []
+
+
+# ───────────────── Registry ─────────────────
+class TemplateRegistry:
+    """Templates loaded from TEMPLATE_DIR (once per process), with lookup counters."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._by_key: Dict[str, List[Template]] = {}
+        self._lock = threading.Lock()
+        self._counters = {"lookups": 0, "hits": 0, "partial": 0, "unknown": 0}
+        self._hits_by_template: Dict[str, int] = {}
+        self.load()
+
+    def load(self) -> int:
+        by_key: Dict[str, List[Template]] = {}
+        for path in sorted(glob.glob(os.path.join(self.directory, "*.json"))):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("version") != TEMPLATE_VERSION:
+                    continue
+                t = Template.from_dict(data, name=os.path.splitext(os.path.basename(path))[0])
+            except Exception as e:
+                logger.warning("template_load_failed: %s: %s", path, e)
+                continue
+            by_key.setdefault(t.key, []).append(t)
+        with self._lock:
+            self._by_key = by_key
+        return sum(len(v) for v in by_key.values())
+
+    def __len__(self) -> int:
+        return sum(len(v) for v in self._by_key.values())
+
+    def _count(self, outcome: str, template: Optional[Template] = None) -> None:
+        with self._lock:
+            self._counters["lookups"] += 1
+            self._counters[outcome] += 1
+            if template is not None and outcome == "hits":
+                self._hits_by_template[template.name] = self._hits_by_template.get(template.name, 0) + 1
+        metrics.record_template({"hits": "hit", "partial": "partial", "unknown": "unknown"}[outcome])
+
+    def extract(self, layout: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], Optional[Template], List[str]]:
+        """(parsed, template, missing): parsed is None unless a template matched and read every field."""
+        if not layout.get("pages"):
+            return None, None, []
+        candidates = [t for t in self._by_key.get(layout_key(layout), []) if t.matches(layout)]
+        if not candidates:
+            self._count("unknown")
+            return None, None, []
+        missing: List[str] = []
+        for t in candidates:
+            parsed, missing = t.extract(layout)
+            if parsed is not None:
+                self._count("hits", t)
+                return parsed, t, []
+        self._count("partial", candidates[0])
+        return None, candidates[0], missing
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            c = dict(self._counters)
+            by_template = dict(self._hits_by_template)
+        c["hit_rate"] = round(c["hits"] / c["lookups"], 4) if c["lookups"] else 0.0
+        c["templates"] = len(self)
+        c["hits_by_template"] = by_template
+        return c
+
+
+_registry: Optional[TemplateRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> TemplateRegistry:
+    """Process-wide registry (loaded on first call, or by `engine.preload` before the fork)."""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = TemplateRegistry(Config.TEMPLATE_DIR)
+    return _registry
+
+
+# ───────────────── Learning (offline, scripts/learn_templates.py) ─────────────────
+def _lines(words: List[Word]) -> List[List[Word]]:
+    lines: List[List[Word]] = []
+    for w in _reading_order(words):
+        if lines and abs(w[3] - lines[-1][-1][3]) <= 3:
+            lines[-1].append(w)
+        else:
+            lines.append([w])
+    return [sorted(line, key=lambda w: w[0]) for line in lines]
+
+
+def _same_value(kind: str, raw: str, expected: Any) -> bool:
+    got = _parse(kind, raw)
+    if got is None or expected in (None, ""):
+        return False
+    if kind in ("amount", "number"):
+        try:
+            return abs(float(got) - float(expected)) < 0.01
+        except (TypeError, ValueError):
+            return False
+    if kind == "text":
+        return _norm(str(got)) == _norm(str(expected))
+    return str(got) == str(expected)
+
+
+def _locate(pages: List[Dict[str, Any]], kind: str, expected: Any) -> Optional[Tuple[int, List[Word], List[Word]]]:
+    """(page, value words, line words) of the shortest word span that reads as `expected`."""
+    for p, page in enumerate(pages):
+        for line in _lines(page["words"]):
+            for size in range(1, min(len(line), 8) + 1):
+                for i in range(len(line) - size + 1):
+                    span = line[i:i + size]
+                    if _same_value(kind, " ".join(w[4] for w in span), expected):
+                        # a date shares a "du 01/01 au 29/02" line with the other one: single word only
+                        return p, span, line
+    return None
+
+
+def _anchor_for(span: List[Word], line: List[Word], page: Dict[str, Any]) -> Optional[str]:
+    """Label just left of the value on its line, else just above it; None when the value stands alone."""
+    left = [w for w in line if w[2] <= span[0][0]]
+    label: List[str] = []
+    for w in reversed(left):
+        t = _norm(w[4])
+        if not t:
+            continue  # ":" between label and value
+        if any(c.isdigit() for c in t):
+            break
+        label.insert(0, t)
+        if len(label) == 4:
+            break
+    if label:
+        return " ".join(label)
+    # column header: only a known label, the line above may well be customer data (street...)
+    above = [l for l in _lines(page["words"]) if l[0][3] < span[0][1]]
+    if above and span[0][1] - above[-1][0][3] < 20:
+        over = " ".join(_norm(w[4]) for w in above[-1] if w[0] < span[-1][2] and w[2] > span[0][0])
+        for label in ANCHORS:
+            if re.search(rf"(?:^| ){re.escape(label)}(?: |$)", over):
+                return label
+    return None
+
+
+def _value_box(kind: str, span: List[Word], page: Dict[str, Any]) -> List[float]:
+    x0, y0 = min(w[0] for w in span), min(w[1] for w in span)
+    x1, y1 = max(w[2] for w in span), max(w[3] for w in span)
+    width = x1 - x0
+    if kind in ("amount", "number", "int"):
+        x0, x1 = x0 - max(30.0, width), x1 + 10.0      # right-aligned figures grow to the left
+    elif kind in ("text", "option"):
+        x1 = min(page["width"], x1 + max(40.0, 0.6 * width))  # longer names / offers
+    else:
+        x0, x1 = x0 - 5.0, x1 + 5.0
+    return [round(x0, 1), round(y0 - _Y_PAD, 1), round(x1, 1), round(y1 + _Y_PAD, 1)]
+
+
+def _expected(parsed: Dict[str, Any]) -> Tuple[Optional[str], Dict[str, Any]]:
+    energies = parsed.get("energies") or []
+    if len(energies) != 1:
+        return None, {}
+    e = energies[0]
+    etype = "gaz" if (e.get("type") or "").lower().startswith("gaz") else "electricite"
+    periode = e.get("periode") or parsed.get("periode") or {}
+    client = parsed.get("client") or {}
+    return etype, {
+        "client.name": client.get("name"), "client.zipcode": client.get("zipcode"),
+        "periode.de": periode.get("de"), "periode.a": periode.get("a"),
+        "energy.fournisseur": e.get("fournisseur"), "energy.offre": e.get("offre"),
+        "energy.option": e.get("option"), "energy.puissance_kVA": e.get("puissance_kVA"),
+        "energy.total_ttc": e.get("total_ttc"), "energy.conso_kwh": e.get("conso_kwh"),
+    }
+
+
+def learn(layout: Dict[str, Any], parsed: Dict[str, Any]) -> Tuple[Optional[Template], List[str]]:
+    """
+    Template learned from one invoice and its (LLM) parse: each field is located in the
+    word boxes and tied to the label next to it. Returns (template or None, unlocated paths).
+    Single-energy invoices only.
+    """
+    pages = layout.get("pages") or []
+    energy, expected = _expected(parsed)
+    if energy is None or not pages:
+        return None, ["energies"]
+    fields: Dict[str, Dict[str, Any]] = {}
+    constants: Dict[str, Any] = {"energy.type": energy}
+    if expected.get("energy.fournisseur"):
+        constants["energy.fournisseur"] = expected["energy.fournisseur"]
+    used_anchors: Dict[str, Dict[str, Any]] = {}
+    missing: List[str] = []
+    for path, kind in FIELD_TYPES.items():
+        if energy != "electricite" and path in ("energy.option", "energy.puissance_kVA"):
+            continue
+        value = expected.get(path)
+        hit = _locate(pages, kind, value) if value not in (None, "") else None
+        if hit is None:
+            if path in REQUIRED or path in REQUIRED_ELEC:
+                missing.append(path)
+            continue
+        p, span, line = hit
+        box = _value_box(kind, span, pages[p])
+        anchor = _anchor_for(span, line, pages[p])
+        at = _nearest(_find_labels(_reading_order(pages[p]["words"]), anchor), span[0][:2]) if anchor else None
+        if at is not None:
+            box = [round(box[0] - at[0], 1), round(box[1] - at[1], 1), round(box[2] - at[0], 1), round(box[3] - at[1], 1)]
+            used_anchors.setdefault(anchor, {"page": p, "box": [round(v, 1) for v in at], "fixed": True,
+                                             "height": pages[p]["height"]})
+        else:
+            anchor = None
+        fields[path] = {"type": kind, "page": p, "anchor": anchor,
+                        "at": [round(at[0], 1), round(at[1], 1)] if at is not None else None, "box": box}
+    # page-1 labels of the layout key are also position checks, when not already used
+    for label, box in page_anchors(pages[0]).items():
+        used_anchors.setdefault(label, {"page": 0, "box": [round(v, 1) for v in box], "fixed": True,
+                                        "height": pages[0]["height"]})
+    t = Template(key=layout_key(layout), supplier=constants.get("energy.fournisseur"),
+                 energy=energy, anchors=used_anchors, fields=fields, constants=constants)
+    return t, missing
+
+
+def combine(templates: List[Template]) -> Template:
+    """
+    One template from several samples of the same layout: field boxes are merged (union)
+    where all samples agree on page and anchor, fields they disagree on are dropped, and
+    anchors that moved by more than ANCHOR_TOLERANCE stop being position checks.
+    """
+    base = templates[0]
+    fields: Dict[str, Dict[str, Any]] = {}
+    for path, rule in base.fields.items():
+        rules = [t.fields.get(path) for t in templates]
+        if any(r is None or r["page"] != rule["page"] or r.get("anchor") != rule.get("anchor") for r in rules):
+            continue
+        boxes = [r["box"] for r in rules]
+        fields[path] = {**rule, "box": [min(b[0] for b in boxes), min(b[1] for b in boxes),
+                                        max(b[2] for b in boxes), max(b[3] for b in boxes)]}
+    anchors: Dict[str, Dict[str, Any]] = {}
+    for label, a in base.anchors.items():
+        seen = [t.anchors.get(label) for t in templates]
+        if any(s is None for s in seen):
+            continue
+        tol = ANCHOR_TOLERANCE * a.get("height", 842.0)  # A4 by default
+        xs, ys = [s["box"][0] for s in seen], [s["box"][1] for s in seen]
+        fixed = max(xs) - min(xs) <= tol and max(ys) - min(ys) <= tol
+        anchors[label] = {**a, "fixed": bool(fixed and all(s.get("fixed") for s in seen))}
+    constants = {k: v for k, v in base.constants.items() if all(t.constants.get(k) == v for t in templates)}
+    return Template(key=base.key, supplier=base.supplier, energy=base.energy, anchors=anchors, fields=fields,
+                    constants=constants, samples=sum(t.samples for t in templates))
+
+
+def check(t: Template, layout: Dict[str, Any], parsed: Dict[str, Any]) -> List[str]:
+    """Required paths the template reads differently from `parsed` on this invoice ([] = exact)."""
+    if not t.matches(layout):
+        return ["layout"]
+    values = t.read(layout)
+    _, expected = _expected(parsed)
+    wrong = []
+    for path in t.required:
+        got, want = values.get(path), expected.get(path, values.get(path))
+        if path == "energy.type":
+            continue
+        if got is None or want is None:
+            wrong.append(path)
+        elif isinstance(got, (int, float)) and not isinstance(got, bool):
+            try:
+                if abs(float(got) - float(want)) >= 0.01:
+                    wrong.append(path)
+            except (TypeError, ValueError):
+                wrong.append(path)
+        elif _norm(str(got)) != _norm(str(want)):
+            wrong.append(path)
+    return wrong
+
+
+def template_filename(t: Template) -> str:
+    supplier = re.sub(r"[^a-z0-9]+", "-", _norm(t.supplier or "inconnu")).strip("-") or "inconnu"
+    return f"{supplier}-{t.energy}-{t.key}.json"
+
+
+def save(t: Template, directory: Optional[str] = None) -> str:
+    directory = directory or Config.TEMPLATE_DIR
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, template_filename(t))
+    data = t.to_dict()
+    data["learned_at"] = dt.now().strftime("%Y-%m-%dT%H:%M:%S")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    return path
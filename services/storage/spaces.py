@@ -1,10 +1,9 @@
 # services/storage/spaces.py
 from __future__ import annotations
-import json, hashlib, datetime, mimetypes, logging
+import json, hashlib, datetime, mimetypes, logging, threading
 from typing import Dict, List, Tuple, Optional
-import boto3
-from botocore.config import Config as BotoConfig
 from core.config import Config
+from core.prefork import after_fork
 import re, unicodedata
 
 def _slugify_name(name: str) -> str:
@@ -23,6 +22,9 @@ def _now_utc() -> datetime.datetime:
 class SpacesClient:
     """Thin wrapper around DigitalOcean Spaces (S3-compatible)."""
     def __init__(self):
+        # boto3 / botocore are only loaded when a client is built (backups, warm-up)
+        import boto3
+        from botocore.config import Config as BotoConfig
         self._s3 = boto3.client(
             "s3",
             region_name=Config.DO_SPACES_REGION,
@@ -136,12 +138,12 @@ class SpacesClient:
             prefix: str,
             filenames: Dict[str, str],
             original_pdf_bytes: Optional[bytes],
-            non_anon_bytes: bytes,
-            anon_bytes: bytes,
+            non_anon_bytes: Optional[bytes],
+            anon_bytes: Optional[bytes],
             manifest: Dict,
             metadata: Dict[str, str],
     ) -> Dict[str, str]:
-        """Uploads all files directly under `prefix/` with descriptive names."""
+        """Uploads all files directly under `prefix/` with descriptive names (reports not rendered are skipped)."""
         keys: Dict[str, str] = {}
 
         # original pdf (if provided)
@@ -151,13 +153,15 @@ class SpacesClient:
             keys["original_pdf"] = k
 
         # reports
-        k_full = f"{prefix}/{filenames['report_full']}"
-        self.put_bytes(k_full, non_anon_bytes, "application/pdf", metadata)
-        keys["report_full"] = k_full
+        if non_anon_bytes is not None:
+            k_full = f"{prefix}/{filenames['report_full']}"
+            self.put_bytes(k_full, non_anon_bytes, "application/pdf", metadata)
+            keys["report_full"] = k_full
 
-        k_anon = f"{prefix}/{filenames['report_anon']}"
-        self.put_bytes(k_anon, anon_bytes, "application/pdf", metadata)
-        keys["report_anon"] = k_anon
+        if anon_bytes is not None:
+            k_anon = f"{prefix}/{filenames['report_anon']}"
+            self.put_bytes(k_anon, anon_bytes, "application/pdf", metadata)
+            keys["report_anon"] = k_anon
 
         # manifest
         k_manifest = f"{prefix}/{filenames['manifest']}"
@@ -177,3 +181,23 @@ class SpacesClient:
         self.put_bytes(key, data, guessed, meta)
         return key, {"sha256": sha, "size": len(data), "filename": filename}
 
+
+_client: Optional[SpacesClient] = None
+_client_lock = threading.Lock()
+
+
+def get_spaces_client() -> SpacesClient:
+    """Process-wide client, built on first backup (or by the warm-up), not at import."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = SpacesClient()
+    return _client
+
+
+@after_fork
+def reset_spaces_client() -> None:
+    # boto3 clients are not fork-safe (urllib3 pool): every worker builds its own
+    global _client
+    _client = None
@@ -1,11 +1,84 @@
-import os, base64, json, hmac, hashlib
+import os, base64, json, hmac, hashlib, time
 from typing import List, Optional
 import httpx
 from celery_app import celery
-from services.reporting.engine import process_invoice_file, process_image_files
+from services.cache.result_cache import result_cache, make_key as result_cache_key
+from services.batches.store import batch_store
+from core import progress, metrics
+from core.admission import admission as admission_control
+from core.config import Config
 
-def _b64(b: bytes) -> str:
-    return base64.b64encode(b).decode("utf-8")
+def _b64(b: Optional[bytes]) -> Optional[str]:
+    return base64.b64encode(b).decode("utf-8") if b is not None else None
+
+def _sha256(b: Optional[bytes]) -> Optional[str]:
+    return hashlib.sha256(b).hexdigest() if b is not None else None
+
+def _size(b: Optional[bytes]) -> Optional[int]:
+    return len(b) if b is not None else None
+
+def _file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _run_engine_cached(kind: str, paths: List[str], *, type: str, confidence_min: float,
+                       strict: bool, variants: str, task_id: Optional[str] = None):
+    """
+    Engine run behind the content-addressed result cache (shared with the sync API via Redis).
+    Stage events (extracting / llm / rendering) are published for `task_id`.
+    """
+    key = result_cache_key(kind=kind, digests=[_file_sha256(p) for p in paths], energy_mode=type,
+                           confidence_min=confidence_min, strict=strict, variants=variants)
+    entry = result_cache.get(key)
+    if entry is None:
+        from services.reporting.engine import analyze_invoice_file, analyze_image_files, build_pdfs
+        analyze = analyze_invoice_file if kind == "pdf" else analyze_image_files
+        source = paths[0] if kind == "pdf" else paths
+        with metrics.labels(energy_type=type, source_kind=kind):
+            parsed, sections, combined_dual, highlights = analyze(source, energy_mode=type,
+                                                                  confidence_min=confidence_min, strict=strict,
+                                                                  on_stage=progress.stage_callback(task_id))
+            progress.publish(task_id, "rendering")
+            non_anon, anon = build_pdfs(parsed, sections, combined_dual, variants=variants)
+        entry = {"parsed": parsed, "sections": sections, "combined_dual": combined_dual,
+                 "highlights": highlights, "non_anon": non_anon, "anon": anon}
+        result_cache.put(key, entry)
+    return entry["non_anon"], entry["anon"], entry["highlights"]
+
+def _report_payload(non_anon: Optional[bytes], anon: Optional[bytes], highlights: List[str], **context) -> dict:
+    """Task result / webhook body shared by the job and batch tasks."""
+    return {
+        "non_anonymous_report_base64": _b64(non_anon),
+        "anonymous_report_base64": _b64(anon),
+        "highlights": highlights,
+        # optional integrity metadata (handy for DB/audits)
+        "non_anonymous_size": _size(non_anon),
+        "anonymous_size": _size(anon),
+        "non_anonymous_sha256": _sha256(non_anon),
+        "anonymous_sha256": _sha256(anon),
+        # pass-through context (if the enqueue provided these)
+        **context,
+    }
+
+def _result_meta(result: dict) -> dict:
+    """Result without the Base64 reports (progress events, batch listings)."""
+    return {k: v for k, v in result.items() if not k.endswith("_base64")}
+
+def _will_retry(task) -> bool:
+    max_retries = (task.retry_kwargs or {}).get("max_retries", task.max_retries) or 0
+    return task.request.retries < max_retries
+
+def _publish_failure(task, exc: Exception) -> None:
+    progress.publish(task.request.id, "failed", error=f"{exc.__class__.__name__}: {exc}",
+                     will_retry=_will_retry(task))
+
+def _release_admission(admission: Optional[dict]) -> None:
+    """Frees the per-key inflight lease taken by the enqueue endpoint (job finished or gave up)."""
+    if admission:
+        admission_control.release(admission.get("key"), admission.get("lease"), admission.get("pool") or "inflight")
 
 def _safe_unlink(path: str):
     try: os.remove(path)
@@ -27,7 +100,7 @@ def _post_webhook(url: str, payload: dict, task_id: str):
         headers["X-Webhook-Signature"] = sig
 
     # non-2xx => raises => Celery autoretry kicks in
-    with httpx.Client(timeout=15) as cli:
+    with metrics.stage("webhook"), httpx.Client(timeout=15) as cli:
         r = cli.post(url, content=body, headers=headers)
         r.raise_for_status()
 
@@ -49,30 +122,30 @@ def process_pdf_task(
     invoice_id: Optional[int] = None,
     external_ref: Optional[str] = None,
     source_kind: Optional[str] = "pdf",
+    variants: str = "both",
+    admission: Optional[dict] = None,
 ) -> dict:
-    non_anon, anon, highlights = process_invoice_file(file_path, energy_mode=type,
-                                                      confidence_min=confidence_min, strict=strict)
-
-    result = {
-        "non_anonymous_report_base64": _b64(non_anon),
-        "anonymous_report_base64": _b64(anon),
-        "highlights": highlights,
-        # optional integrity metadata (handy for DB/audits)
-        "non_anonymous_size": len(non_anon),
-        "anonymous_size": len(anon),
-        "non_anonymous_sha256": hashlib.sha256(non_anon).hexdigest(),
-        "anonymous_sha256": hashlib.sha256(anon).hexdigest(),
-        # pass-through context (if the enqueue provided these)
-        "user_id": user_id,
-        "invoice_id": invoice_id,
-        "external_ref": external_ref,
-        "source_kind": source_kind or "pdf",
-    }
     try:
+        non_anon, anon, highlights = _run_engine_cached("pdf", [file_path], type=type,
+                                                        confidence_min=confidence_min, strict=strict,
+                                                        variants=variants, task_id=self.request.id)
+
+        result = _report_payload(non_anon, anon, highlights, user_id=user_id, invoice_id=invoice_id,
+                                 external_ref=external_ref, source_kind=source_kind or "pdf")
         if webhook_url:
-            _post_webhook(webhook_url, result, task_id=self.request.id)
-    finally:
-        _safe_unlink(file_path)
+            progress.publish(self.request.id, "uploading")
+            with metrics.labels(energy_type=type, source_kind="pdf"):
+                _post_webhook(webhook_url, result, task_id=self.request.id)
+    except Exception as e:
+        _publish_failure(self, e)
+        if not _will_retry(self):
+            # upload kept until the last attempt: a retry (e.g. webhook down) re-reads it, cache hit
+            _safe_unlink(file_path)
+            _release_admission(admission)
+        raise
+    _safe_unlink(file_path)
+    _release_admission(admission)
+    progress.publish(self.request.id, "done", **_result_meta(result))
     return result
 
 @celery.task(
@@ -93,26 +166,137 @@ def process_images_task(
     invoice_id: Optional[int] = None,
     external_ref: Optional[str] = None,
     source_kind: Optional[str] = "images",
+    variants: str = "both",
+    admission: Optional[dict] = None,
 ) -> dict:
-    non_anon, anon, highlights = process_image_files(file_paths, energy_mode=type,
-                                                     confidence_min=confidence_min, strict=strict)
-
-    result = {
-        "non_anonymous_report_base64": _b64(non_anon),
-        "anonymous_report_base64": _b64(anon),
-        "highlights": highlights,
-        "non_anonymous_size": len(non_anon),
-        "anonymous_size": len(anon),
-        "non_anonymous_sha256": hashlib.sha256(non_anon).hexdigest(),
-        "anonymous_sha256": hashlib.sha256(anon).hexdigest(),
-        "user_id": user_id,
-        "invoice_id": invoice_id,
-        "external_ref": external_ref,
-        "source_kind": source_kind or "images",
-    }
     try:
+        non_anon, anon, highlights = _run_engine_cached("images", file_paths, type=type,
+                                                        confidence_min=confidence_min, strict=strict,
+                                                        variants=variants, task_id=self.request.id)
+
+        result = _report_payload(non_anon, anon, highlights, user_id=user_id, invoice_id=invoice_id,
+                                 external_ref=external_ref, source_kind=source_kind or "images")
         if webhook_url:
-            _post_webhook(webhook_url, result, task_id=self.request.id)
+            progress.publish(self.request.id, "uploading")
+            with metrics.labels(energy_type=type, source_kind="images"):
+                _post_webhook(webhook_url, result, task_id=self.request.id)
+    except Exception as e:
+        _publish_failure(self, e)
+        if not _will_retry(self):
+            # upload kept until the last attempt: a retry (e.g. webhook down) re-reads it, cache hit
+            for p in file_paths: _safe_unlink(p)
+            _release_admission(admission)
+        raise
+    for p in file_paths: _safe_unlink(p)
+    _release_admission(admission)
+    progress.publish(self.request.id, "done", **_result_meta(result))
+    return result
+
+
+# ——— Batches (/v1/batches) ———
+
+_SWEEP_GRACE = 60  # seconds past the hard time limit before a running item is declared lost
+
+def dispatch_next_batch_item(batch_id: str) -> Optional[str]:
+    """
+    Pops the next pending item of the batch and enqueues it under its pre-generated task id,
+    with its watchdog (`sweep_batch_item_task`).
+    """
+    item = batch_store.next_pending(batch_id)
+    if item is None:
+        return None
+    kwargs = {"batch_id": batch_id, "index": item["index"]}
+    process_batch_item_task.apply_async(kwargs=kwargs, task_id=item["task_id"])
+    sweep_batch_item_task.apply_async(kwargs=kwargs, countdown=Config.CELERY_TASK_TIME_LIMIT + _SWEEP_GRACE)
+    return item["task_id"]
+
+def _finish_batch_item(batch_id: str, header: dict, item: dict, *, result: dict, error: Optional[str]) -> bool:
+    """Records the item once; only the recording call moves the window and may send the batch webhook."""
+    recorded, completed = batch_store.mark_done(batch_id, item, ok=error is None, result=result, error=error)
+    if recorded:
+        dispatch_next_batch_item(batch_id)
+    if completed and header.get("webhook_url"):
+        send_batch_webhook_task.delay(batch_id)
+    return recorded
+
+@celery.task(bind=True, name="process_batch_item_task")
+def process_batch_item_task(self, batch_id: str, index: int) -> dict:
+    """
+    One batch item. Engine errors are recorded on the item (no retry: the batch must
+    move on); the task result has the same shape as the job tasks, so the job
+    endpoints work with the item task ids.
+    """
+    header = batch_store.header(batch_id)
+    item = batch_store.item(batch_id, index)
+    if header is None or item is None:
+        return {}
+    if batch_store.is_done(batch_id, index):
+        # redelivered (acks_late) after the outcome was recorded, or declared lost by the watchdog
+        return {k: v for k, v in item.items() if k != "paths"}
+    params = header["params"]
+    paths = item.get("paths") or []
+    batch_store.mark_running(batch_id, item)
+    result, error = {}, None
+    try:
+        non_anon, anon, highlights = _run_engine_cached(
+            "pdf" if item["kind"] == "pdf" else "images", paths,
+            type=params["type"], confidence_min=params["confidence_min"],
+            strict=params["strict"], variants=params["variants"], task_id=self.request.id,
+        )
+        result = _report_payload(non_anon, anon, highlights, batch_id=batch_id, batch_index=index,
+                                 external_ref=item["name"], source_kind=item["kind"])
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
     finally:
-        for p in file_paths: _safe_unlink(p)
+        for p in paths: _safe_unlink(p)
+
+    meta = _result_meta(result)
+    meta.pop("external_ref", None)
+    _finish_batch_item(batch_id, header, item, result=meta, error=error)
+    if error:
+        progress.publish(self.request.id, "failed", error=error, will_retry=False)
+        return {"batch_id": batch_id, "batch_index": index, "error": error}
+    progress.publish(self.request.id, "done", **meta)
     return result
+
+@celery.task(name="sweep_batch_item_task")
+def sweep_batch_item_task(batch_id: str, index: int) -> None:
+    """
+    Watchdog of one dispatched item. A worker killed by the hard time limit (or lost) never
+    records its item, which would shrink the batch window for good: past the limit, the
+    item is recorded as failed and the next one dispatched. Re-armed while the item is
+    still queued behind other work or within its time limit.
+    """
+    item = batch_store.item(batch_id, index)
+    if item is None or batch_store.is_done(batch_id, index):
+        return
+    now = time.time()
+    started = item.get("started_at")
+    deadline = (started or now) + Config.CELERY_TASK_TIME_LIMIT + _SWEEP_GRACE
+    if started is None or now < deadline:
+        sweep_batch_item_task.apply_async(kwargs={"batch_id": batch_id, "index": index},
+                                          countdown=max(deadline - now, _SWEEP_GRACE))
+        return
+    header = batch_store.header(batch_id)
+    if header is None:
+        return
+    paths = item.get("paths") or []
+    error = "WorkerLost: item did not finish within the task time limit"
+    if _finish_batch_item(batch_id, header, item, result={}, error=error):
+        for p in paths: _safe_unlink(p)
+        progress.publish(item["task_id"], "failed", error=error, will_retry=False)
+
+@celery.task(
+    bind=True,
+    autoretry_for=(Exception,),
+    retry_backoff=True, retry_jitter=True, retry_kwargs={'max_retries': 6},
+    name="send_batch_webhook_task",
+)
+def send_batch_webhook_task(self, batch_id: str) -> None:
+    """Single webhook per batch: aggregate counters + per-item metadata (reports via the job endpoints)."""
+    header = batch_store.header(batch_id)
+    if header is None or not header.get("webhook_url"):
+        return
+    payload = dict(batch_store.summary(batch_id))
+    payload["items"] = batch_store.items(batch_id)
+    _post_webhook(header["webhook_url"], payload, task_id=batch_id)